@@ -0,0 +1,144 @@
+from typing import List, Tuple
+
+from helper_classes import CARD_COLOURS, Colour
+
+# Draw slots: face-up card indices 0-4, then the deck, then not drawing a second card
+DECK_SLOT = 5
+NODRAW_SLOT = 6
+NUM_FIRST_SLOTS = 6  # A first draw is a face-up card or the deck
+NUM_SECOND_SLOTS = 7  # A second draw can also be skipped (after a face-up wild)
+
+
+class ActionSpace:
+    """
+    A fixed integer index for every action on a map.
+
+    Indices are laid out as:
+        claims: For each route id, every colour it can be claimed with times
+            every number of wilds from 0 to the route length
+        draws: Every (first slot, second slot) pair of train card draws
+        destinations: Every keep mask (i, j, k) of a destination draw
+
+    Actions only carry what the index cannot: card colours and player names are read
+    back from the game state when decoding.
+    """
+
+    def __init__(self, route_list, route_cities: List[Tuple[str, str]]):
+        """
+        Lay out the index for a map.
+
+        :param route_list: All routes, indexed by Route.route_id
+        :type route_list: List[Route]
+        :param route_cities: (city1, city2) (alphabetical) by route id
+        :type route_cities: List[Tuple[str, str]]
+        """
+        self.route_list = route_list
+        self.route_cities = route_cities
+
+        # First claim index of each route, and the (route id, colour, wilds) of every claim index
+        self.claim_offsets: List[int] = []
+        self.claims: List[Tuple[int, Colour, int]] = []
+        for route in route_list:
+            self.claim_offsets.append(len(self.claims))
+            colours = CARD_COLOURS if route.colour == Colour.GRAY else [route.colour]
+            for colour in colours:
+                for wilds_used in range(route.length + 1):
+                    self.claims.append((route.route_id, colour, wilds_used))
+
+        self.draw_offset = len(self.claims)
+        self.destination_offset = self.draw_offset + NUM_FIRST_SLOTS * NUM_SECOND_SLOTS
+        self.size = self.destination_offset + 8
+
+    def encode(self, action) -> int:
+        """
+        Returns the index of an action.
+
+        :param action: A formatted action
+        :type action: tuple(str, ...)
+        :raises ValueError: If the action has no index (e.g. more wilds than the route length)
+        :return: Index of the action
+        :rtype: int
+        """
+        match action:
+            case ["claim_route", _, _, colour, wilds_used, route_id, _]:
+                length = self.route_list[route_id].length
+                if not 0 <= wilds_used <= length:
+                    raise ValueError(
+                        f"No index for {wilds_used} wilds on route {route_id}"
+                    )
+                colour_slot = 0
+                if self.route_list[route_id].colour == Colour.GRAY:
+                    colour_slot = colour
+                return (
+                    self.claim_offsets[route_id]
+                    + colour_slot * (length + 1)
+                    + wilds_used
+                )
+            case ["draw_two_train_cards", idx1, _, idx2, _, _]:
+                slot1 = DECK_SLOT if idx1 == "deck" else idx1
+                if idx2 == "deck":
+                    slot2 = DECK_SLOT
+                elif idx2 == "nodraw":
+                    slot2 = NODRAW_SLOT
+                else:
+                    slot2 = idx2
+                return self.draw_offset + slot1 * NUM_SECOND_SLOTS + slot2
+            case ["draw_destination_tickets", i, j, k, _]:
+                return self.destination_offset + i * 4 + j * 2 + k
+        raise ValueError(f"No index for action {action}")
+
+    def decode(self, index: int, game_state):
+        """
+        Rebuilds the action for an index in a game state, for its current player.
+
+        :param index: Index of the action
+        :type index: int
+        :param game_state: The state the action is taken in
+        :type game_state: GameEngine
+        :return: The formatted action
+        :rtype: tuple(str, ...)
+        """
+        name = game_state.current_player.name
+        if index < self.draw_offset:
+            route_id, colour, wilds_used = self.claims[index]
+            city1, city2 = self.route_cities[route_id]
+            return ("claim_route", city1, city2, colour, wilds_used, route_id, name)
+
+        if index < self.destination_offset:
+            slot1, slot2 = divmod(index - self.draw_offset, NUM_SECOND_SLOTS)
+            face_up_cards = game_state.face_up_cards
+            if slot1 == DECK_SLOT:
+                return ("draw_two_train_cards", "deck", "deck", "deck", "deck", name)
+            if slot2 == NODRAW_SLOT:
+                return (
+                    "draw_two_train_cards",
+                    slot1,
+                    face_up_cards[slot1],
+                    "nodraw",
+                    "nodraw",
+                    name,
+                )
+            if slot2 == DECK_SLOT:
+                return (
+                    "draw_two_train_cards",
+                    slot1,
+                    face_up_cards[slot1],
+                    "deck",
+                    "deck",
+                    name,
+                )
+            # Taking the same slot twice takes the card that replaces the first one
+            card2 = face_up_cards[slot2]
+            if slot2 == slot1 and len(game_state.train_deck) > 0:
+                card2 = game_state.train_deck.peek()
+            return (
+                "draw_two_train_cards",
+                slot1,
+                face_up_cards[slot1],
+                slot2,
+                card2,
+                name,
+            )
+
+        keep = index - self.destination_offset
+        return ("draw_destination_tickets", keep >> 2, keep >> 1 & 1, keep & 1, name)
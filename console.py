@@ -1,14 +1,25 @@
 import platform
 
-from rich.console import Console
-from rich.layout import Layout
-from rich.live import Live
-from rich.progress import BarColumn, Progress, TimeRemainingColumn
-from rich.table import Table
+# rich is imported by LiveConsole when a display is started, so searches that never
+# show one (worker processes, headless runs) don't load it
 
 # Check if running under PyPy
 is_pypy = platform.python_implementation() == "PyPy"
 
+# Set to False (see set_live_display) to run every search without a display
+live_display = True
+
+
+def set_live_display(enabled: bool):
+    """
+    Turns the live MCTS display on or off for every LiveConsole created afterwards.
+
+    :param enabled: True to show the display
+    :type enabled: bool
+    """
+    global live_display
+    live_display = enabled
+
 
 class LiveConsole:
     """
@@ -24,11 +35,13 @@ class LiveConsole:
         Initialise the live console interface.
         """
 
-        # Skip initialisation if running under PyPy
-        if is_pypy:
+        # Skip initialisation if running under PyPy or without a display
+        if is_pypy or not live_display:
             self.enabled = False
             return
 
+        from rich.console import Console
+
         self.console = Console()
         self.avg_points = 0
         self.max_points = 0
@@ -49,6 +62,11 @@ class LiveConsole:
         if not self.enabled or self.live:
             return
 
+        from rich.layout import Layout
+        from rich.live import Live
+        from rich.progress import BarColumn, Progress, TimeRemainingColumn
+        from rich.table import Table
+
         # Reset statistics at the start
         self.avg_points = 0
         self.max_points = -1000
@@ -100,6 +118,8 @@ class LiveConsole:
         if not self.enabled or not self.live:
             return
 
+        from rich.table import Table
+
         try:
             # Update the simulation count (add 1 to convert from 0-indexed)
             self.total_sims = sim_num
@@ -1,3 +1,21 @@
+import heapq
+
+
+def load_numpy():
+    """
+    Imports NumPy on first use. Only solving a graph uses it, games load their matrices
+    from the compiled map pack, so most processes never import it.
+
+    :return: The numpy module, or None if it is not installed
+    :rtype: module or None
+    """
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
 class FloydWarshall:
     """
     This class computes and stores all-pairs shortest paths.
@@ -22,7 +40,7 @@ class FloydWarshall:
             for city2 in routes[city1]:
                 self.cities.add(city2)
 
-        self.cities = list(self.cities)  # Convert set to list for indexing
+        self.cities = sorted(self.cities)  # Sorted so indices are stable between runs
         self.n = len(self.cities)
         self.city_idx = {
             city: i for i, city in enumerate(self.cities)
@@ -51,13 +69,68 @@ class FloydWarshall:
             self.dist[i][i] = 0
             self.next[i][i] = i
 
-        # Compute shortest paths
+        # Games load the solved matrices from the map pack, so this only runs when a
+        # pack is compiled (see map_pack.compile_map)
         self.compute_shortest_paths()
+        self.reset_path_tables()
+
+    @classmethod
+    def from_matrices(cls, cities, dist, nxt) -> "FloydWarshall":
+        """
+        Creates the object from already computed matrices (e.g. a compiled map pack).
+
+        :param cities: Sorted city names, giving the matrix indices
+        :type cities: List[str]
+        :param dist: Distance matrix, infinity for unreachable pairs
+        :type dist: List[List[float]]
+        :param nxt: Next-hop matrix
+        :type nxt: List[List[int]]
+        :return: The shortest paths object
+        :rtype: FloydWarshall
+        """
+        fw = cls.__new__(cls)
+        fw.cities = list(cities)
+        fw.n = len(fw.cities)
+        fw.city_idx = {city: i for i, city in enumerate(fw.cities)}
+        fw.dist = dist
+        fw.next = nxt
+        fw.reset_path_tables()
+        return fw
+
+    def set_matrices(self, dist, nxt):
+        """
+        Stores NumPy matrices as nested lists, which are faster for single lookups.
+        Distances are kept as ints, unreachable pairs as infinity.
+
+        :param dist: Distance matrix
+        :type dist: numpy.ndarray
+        :param nxt: Next-hop matrix
+        :type nxt: numpy.ndarray
+        """
+        INF = float("inf")
+        self.dist = [
+            [int(d) if d != INF else INF for d in row] for row in dist.tolist()
+        ]
+        self.next = nxt.tolist()
 
     def compute_shortest_paths(self):
         """
         Execute the Floyd-Warshall algorithm to compute shortest paths.
+        With NumPy each k step is one vectorised min-plus update of the whole matrix.
         """
+        np = load_numpy()
+        if np is not None:
+            dist = np.array(self.dist, dtype=np.float64)
+            nxt = np.array(self.next, dtype=np.int32)
+            for k in range(self.n):
+                # Row k is unchanged in step k (dist[k][k] is 0), so updating in place is safe
+                via = dist[:, k, None] + dist[None, k, :]
+                better = via < dist
+                dist[better] = via[better]
+                nxt[better] = np.broadcast_to(nxt[:, k, None], nxt.shape)[better]
+            self.set_matrices(dist, nxt)
+            return
+
         for k in range(self.n):
             for i in range(self.n):
                 for j in range(self.n):
@@ -65,31 +138,122 @@ class FloydWarshall:
                         self.dist[i][j] = self.dist[i][k] + self.dist[k][j]
                         self.next[i][j] = self.next[i][k]  # Update next matrix
 
+    def reset_path_tables(self):
+        """
+        Sets up the shortest path tables, indexed [i][j]:
+            paths: Tuple of city names from city i to city j (empty if unreachable)
+            path_cities: Frozenset of the cities on the path
+            path_edges: Frozenset of the path's edges, each as an alphabetical (city1, city2)
+        Rows are built from the next-hop matrix the first time a path from city i is used.
+        """
+        self.paths = [None] * self.n
+        self.path_cities = [None] * self.n
+        self.path_edges = [None] * self.n
+
+    def build_path_row(self, i: int):
+        """
+        Builds every shortest path from one city into the path tables.
+
+        :param i: Index of the start city
+        :type i: int
+        """
+        INF = float("inf")
+        paths = [()] * self.n
+        path_cities = [frozenset()] * self.n
+        path_edges = [frozenset()] * self.n
+        for j in range(self.n):
+            if self.dist[i][j] == INF:
+                continue
+            path = [self.cities[i]]
+            k = i
+            while k != j:
+                k = self.next[k][j]
+                path.append(self.cities[k])
+            paths[j] = tuple(path)
+            path_cities[j] = frozenset(path)
+            path_edges[j] = frozenset(
+                (a, b) if a < b else (b, a) for a, b in zip(path, path[1:])
+            )
+        self.paths[i] = paths
+        self.path_cities[i] = path_cities
+        self.path_edges[i] = path_edges
+
     def get_path(self, city1, city2):
         """
-        Returns the list of cities on the shortest path from city1 to city2.
+        Returns the cities on the shortest path from city1 to city2.
+
+        :param city1: Starting city name
+        :type city1: str
+        :param city2: Destination city name
+        :type city2: str
+        :return: Tuple of city names forming the shortest path (including start and end)
+                or empty tuple if no path exists
+        :rtype: Tuple[str, ...]
+        """
+        i, j = self.city_idx.get(city1), self.city_idx.get(city2)
+        if i is None or j is None:
+            return ()
+        if self.paths[i] is None:
+            self.build_path_row(i)
+        return self.paths[i][j]
 
-        Uses the next-hop matrix to reconstruct the optimal path between cities.
+    def get_path_cities(self, city1, city2):
+        """
+        Returns the set of cities on the shortest path from city1 to city2.
 
         :param city1: Starting city name
         :type city1: str
         :param city2: Destination city name
         :type city2: str
-        :return: List of city names forming the shortest path (including start and end)
-                or empty list if no path exists
-        :rtype: List[str]
+        :return: Cities on the path, empty if no path exists
+        :rtype: FrozenSet[str]
+        """
+        i, j = self.city_idx.get(city1), self.city_idx.get(city2)
+        if i is None or j is None:
+            return frozenset()
+        if self.path_cities[i] is None:
+            self.build_path_row(i)
+        return self.path_cities[i][j]
+
+    def get_path_edges(self, city1, city2):
         """
+        Returns the set of edges on the shortest path from city1 to city2.
 
+        :param city1: Starting city name
+        :type city1: str
+        :param city2: Destination city name
+        :type city2: str
+        :return: Edges on the path as alphabetical (city1, city2) tuples, empty if no path exists
+        :rtype: FrozenSet[Tuple[str, str]]
+        """
         i, j = self.city_idx.get(city1), self.city_idx.get(city2)
-        if i is None or j is None or self.dist[i][j] == float("inf"):
-            return []
+        if i is None or j is None:
+            return frozenset()
+        if self.path_edges[i] is None:
+            self.build_path_row(i)
+        return self.path_edges[i][j]
 
-        path = [city1]
-        while i != j:
-            i = self.next[i][j]
-            path.append(self.cities[i])  # type: ignore
+    def is_path_edge(self, city1, city2, edge_city1, edge_city2):
+        """
+        Checks if two cities are adjacent on the shortest path from city1 to city2.
 
-        return path
+        :param city1: Starting city name
+        :type city1: str
+        :param city2: Destination city name
+        :type city2: str
+        :param edge_city1: One end of the edge
+        :type edge_city1: str
+        :param edge_city2: Other end of the edge
+        :type edge_city2: str
+        :return: True if the edge is on the path
+        :rtype: bool
+        """
+        edge = (
+            (edge_city1, edge_city2)
+            if edge_city1 < edge_city2
+            else (edge_city2, edge_city1)
+        )
+        return edge in self.get_path_edges(city1, city2)
 
     def get_distance(self, city1, city2):
         """
@@ -107,3 +271,149 @@ class FloydWarshall:
         if i is None or j is None:
             return float("inf")
         return self.dist[i][j]
+
+
+class DynamicDistances:
+    """
+    Shortest path distances for a graph whose edge weights change during a game.
+
+    Distances are held per set of weights as a DistanceRows, whose rows are only solved
+    (single source Dijkstra) when read. A weight change is repaired rather than solved
+    again: a row is kept unless the changed edge can alter it, so after a claim only the
+    affected rows are recomputed, and only if they are used.
+    """
+
+    def __init__(self, n: int, edges):
+        """
+        Set up the graph structure, the weights are given per DistanceRows.
+
+        :param n: Number of cities
+        :type n: int
+        :param edges: (city index, city index) of every edge, weights are indexed the same way
+        :type edges: List[Tuple[int, int]]
+        """
+        self.n = n
+        self.edges = edges
+        # city index -> (edge index, other city index) for every edge from that city
+        self.neighbours = [[] for _ in range(n)]
+        for edge_idx, (i, j) in enumerate(edges):
+            self.neighbours[i].append((edge_idx, j))
+            self.neighbours[j].append((edge_idx, i))
+
+    def shortest_from(self, source: int, weights):
+        """
+        Dijkstra from a single city.
+
+        :param source: Index of the start city
+        :type source: int
+        :param weights: Weight of every edge (infinity for a removed edge)
+        :type weights: List[float]
+        :return: Distance to every city
+        :rtype: List[float]
+        """
+        INF = float("inf")
+        dist = [INF] * self.n
+        dist[source] = 0
+        neighbours = self.neighbours
+        heap = [(0, source)]
+        while heap:
+            d, city = heapq.heappop(heap)
+            if d > dist[city]:
+                continue
+            for edge_idx, other in neighbours[city]:
+                new_d = d + weights[edge_idx]
+                if new_d < dist[other]:
+                    dist[other] = new_d
+                    heapq.heappush(heap, (new_d, other))
+        return dist
+
+    def distances(self, weights) -> "DistanceRows":
+        """
+        :param weights: Weight of every edge (infinity for a removed edge)
+        :type weights: List[float]
+        :return: Distances for the weights, with no rows solved yet
+        :rtype: DistanceRows
+        """
+        return DistanceRows(self, weights, [None] * self.n)
+
+
+class DistanceRows:
+    """Shortest distances from every city for one set of edge weights, solved lazily."""
+
+    __slots__ = ("graph", "weights", "rows")
+
+    def __init__(self, graph: DynamicDistances, weights, rows):
+        """
+        :param graph: The graph the distances are on
+        :type graph: DynamicDistances
+        :param weights: Weight of every edge, never modified
+        :type weights: List[float]
+        :param rows: Distances from each city, None where not solved yet
+        :type rows: List[Optional[List[float]]]
+        """
+        self.graph = graph
+        self.weights = weights
+        self.rows = rows
+
+    def row(self, i: int):
+        """
+        Distances from a city to every city, solved on first use.
+
+        :param i: Index of the city
+        :type i: int
+        :return: Distance to every city by index (infinity if unreachable)
+        :rtype: List[float]
+        """
+        row = self.rows[i]
+        if row is None:
+            row = self.graph.shortest_from(i, self.weights)
+            self.rows[i] = row
+        return row
+
+    def distance(self, i: int, j: int) -> float:
+        """
+        :param i: Index of the first city
+        :type i: int
+        :param j: Index of the second city
+        :type j: int
+        :return: Shortest distance between the cities (infinity if unreachable)
+        :rtype: float
+        """
+        return self.row(i)[j]
+
+    def repaired(self, new_weights) -> "DistanceRows":
+        """
+        Distances for changed edge weights, keeping every solved row the changes cannot
+        alter. Rows are never modified, so kept rows are shared with this object.
+
+        A cheaper edge a-b only changes the row of a city it brings closer to a or b.
+        A dearer (or removed) edge only changes the row of a city with a shortest path
+        through it, and such a path reaches one end of the edge through the other.
+
+        :param new_weights: Changed weights by edge index
+        :type new_weights: Dict[int, float]
+        :return: Distances for the new weights
+        :rtype: DistanceRows
+        """
+        INF = float("inf")
+        edges = self.graph.edges
+        weights = self.weights[:]
+        rows = self.rows[:]
+        for edge_idx, new_weight in new_weights.items():
+            old_weight = weights[edge_idx]
+            if new_weight == old_weight:
+                continue
+            weights[edge_idx] = new_weight
+            a, b = edges[edge_idx]
+            for i, row in enumerate(rows):
+                if row is None:
+                    continue
+                if new_weight < old_weight:
+                    stale = row[a] + new_weight < row[b] or row[b] + new_weight < row[a]
+                else:
+                    stale = row[a] != INF and (
+                        row[a] + old_weight == row[b] or row[b] + old_weight == row[a]
+                    )
+                if stale:
+                    rows[i] = None
+        return DistanceRows(self.graph, weights, rows)
@@ -5,49 +5,78 @@ import time
 from typing import List, Optional, Tuple
 
 # from graph import TicketToRideVisualizer
-from fw import FloydWarshall
-from helper_classes import Colour, Destination, Player, Route, UnionFind
+from fw import DistanceRows, FloydWarshall
+from helper_classes import (
+    CARD_COLOURS,
+    NUM_COLOURS,
+    Colour,
+    Destination,
+    Player,
+    Route,
+    TrainDeck,
+    UndoRecord,
+    UnionFind,
+)
 from heuristic_agents import (
     BestMoveHeuristic,
     DestinationHeuristic,
     LongestRouteHeuristic,
     RandomHeuristic,
 )
-from map_data import MapData
-from mcts import MCTS
-from mcts_no_heuristics import MCTS as MCTS_no_heuristics
-from mcts_rollouts import MCTS as MCTS_rollouts
-from mcts_selection import MCTS as MCTS_selection
-from play import PlayerController
-
-is_pypy = False
+from topology import MapTopology
 
-# Only import GUI modules if not running under PyPy
+# The GUI (pygame), the MCTS agents and the human controller are only imported by main(),
+# so headless runs and worker processes that unpickle a GameEngine load the engine alone
 is_pypy = platform.python_implementation() == "PyPy"
+UNSCORED = -1  # Route value not worked out yet, see get_route_values
+# Rollout rewards an agent can use, see GameEngine.game_results
+REWARDS = ("score", "margin", "win")
 
-# Only import GUI modules if not running under PyPy or Nuitka standalone mode
-if not is_pypy:
-    try:
-        from gui import initialise_gui, shutdown, update_game_state
 
-        gui_available = True
+def load_gui():
+    """
+    Imports the GUI on first use, it is not available under PyPy or without pygame.
+
+    :return: The gui module, or None if it can't be used
+    :rtype: module or None
+    """
+    if is_pypy:
+        print("Running under PyPy - GUI disabled for compatibility.")
+        return None
+    try:
+        import gui
     except ImportError:
-        gui_available = False
         print("GUI modules couldn't be imported. Running in console-only mode.")
-else:
-    # Dummy functions for PyPy
-    gui_available = False
-
-    def initialise_gui():
-        return False
-
-    def update_game_state(game, action=None):
-        pass
+        return None
+    return gui
 
-    def shutdown():
-        pass
 
-    print("Running under PyPy - GUI disabled for compatibility.")
+def persistent_agent(agents: dict, player_name: str, agent_class, game, **options):
+    """
+    Returns a player's search agent for this turn, keeping one agent per player for the
+    whole game so its tree carries over between turns (see MCTS.advance).
+
+    :param agents: Agents made so far this game, by player name
+    :type agents: dict
+    :param player_name: Name of the player to move
+    :type player_name: str
+    :param agent_class: The MCTS class the player uses
+    :type agent_class: type
+    :param game: The game state at the start of the player's turn
+    :type game: GameEngine
+    :param options: Keyword arguments for a new agent, e.g. reward
+    :return: The player's agent, with its root at the current position
+    :rtype: MCTS
+    """
+    agent = agents.get(player_name)
+    if agent is None or type(agent) is not agent_class:
+        agent = agent_class(game, **options)
+        agents[player_name] = agent
+    else:
+        reused = agent.advance(game)
+        if reused:
+            print(f"Reusing {reused} simulations from the previous search")
+    return agent
 
 
 class GameEngine:
@@ -61,8 +90,8 @@ class GameEngine:
         self.players: List[Player] = []  # List of players
         self.current_player_idx: int = 0  # Index of the current player
         self.current_player: Player = None  # Reference to the current player
-        self.train_deck: List[Colour] = []  # Train deck
-        self.discard_deck: List[Colour] = []  # Discard deck
+        self.train_deck: TrainDeck = TrainDeck()  # Train deck, as colour counts
+        self.discard_deck: TrainDeck = TrainDeck()  # Discard deck, as colour counts
         self.destination_deck: List[Destination] = []  # Destination ticket deck
         self.destination_discard_deck: List[
             Destination
@@ -72,11 +101,16 @@ class GameEngine:
         self.fw: FloydWarshall = (
             None  # Floyd-Warshall object for shortest path calculations
         )
-        self.routes_cache: dict = {}  # Player dependent cache for unclaimed routes
-        self.routes_cache_valid: dict = {}  # Flag to indicate if cache needs update
-        self.best_routes_cache: dict = {}  # Player dependent cache for best routes
-        self.best_routes_cache_valid: dict = {}  # Flag to indicate if cache needs update
-        self.map_data: MapData = None  # Map data object
+        self.claim_index: List[List[tuple]] = []  # Per player claim actions by route id
+        self.claim_dirty: List[int] = (
+            []
+        )  # Per player bitmask of stale claim_index routes
+        self.claim_actions: List[list] = []  # Per player claim_index flattened
+        self.distance_bases: dict = (
+            {}
+        )  # Per player name, last MapTopology.player_distances
+        self.topology: MapTopology = None  # Static map data shared between copies
+        self.claimed_mask: int = 0  # Bitmask of claimed route ids
         self.map_type: str = "USA"  # Default map type
         self.most_recent_hits: int = 0  # Most recent hits for tunnel routes
 
@@ -88,11 +122,9 @@ class GameEngine:
         :type players: List[Player]
         """
         self.players = players
-        self.map_data = MapData(self.map_type)
-        self.initialise_destination_deck()
         self.initialise_routes()
+        self.initialise_destination_deck()
 
-        self.fw = FloydWarshall(self.routes)
         # Add 12 of each colour (excluding wild) and 14 wild cards
         self.setup_train_deck()
         self.deal_initial_cards()
@@ -101,6 +133,7 @@ class GameEngine:
         self.current_player = self.players[self.current_player_idx]
         # Initialise union-find
         self.init_uf()
+        self.reset_claim_index()
 
     def formatted_trains(self, player: Player) -> List[str]:
         """
@@ -112,8 +145,8 @@ class GameEngine:
         :rtype: List[str]
         """
         return [
-            f"{colour.value}: {count}"
-            for colour, count in player.train_cards.items()
+            f"{colour.label}: {count}"
+            for colour, count in zip(Colour, player.train_cards)
             if count > 0
         ]
 
@@ -152,72 +185,56 @@ class GameEngine:
     def init_uf(self):
         """Initialises the union-find data structure for each player."""
         for player in self.players:
-            player.uf = UnionFind(self.routes.keys())
+            player.uf = UnionFind(self.city_names)
 
     def initialise_destination_deck(self):
         """Add destinations to the destination deck and shuffle it."""
-        if self.map_data:
-            dest_deck = self.map_data.get_destinations()
-            self.destination_deck = dest_deck if dest_deck else []
+        if self.topology:
+            self.destination_deck = list(self.topology.destinations)
             random.shuffle(self.destination_deck)
 
     def initialise_routes(self):
         """
-        Initialise routes datastructure (routes = Dict{"city1", Dict{"city2", List[Route]}})
-        It's innefficient as hell but the most readable way I could think of, so I build indices for faster lookups.
-        self.routes is only used on initialisation of indices and other datastructures and never again.
-
-        Indices:
-            city_to_routes: Maps cities to all routes from that city
-            route_pairs: Maps (city1,city2) to its routes
-            city_names: List of all city names
-            city_to_idx: Maps city name to relative index
-            idx_to_city: Maps index to city name
-            adjacency: Adjacency matrix (i = city1, j = city2)
-        """
-        self.routes = self.map_data.get_routes()
-        self.city_to_routes = {}  # Maps cities to their routes
-        self.route_pairs = {}  # Maps (city1,city2) to route objects
-
-        # Build indices
-        for city1, connections in self.routes.items():
-            if city1 not in self.city_to_routes:
-                self.city_to_routes[city1] = []
-
-            for city2, routes_list in connections.items():
-                # Get canonical order of cities (alphabetical)
-                key = (city1, city2) if city1 < city2 else (city2, city1)
-
-                # Store in route_pairs
-                if key not in self.route_pairs:
-                    self.route_pairs[key] = []
-                self.route_pairs[key].extend(routes_list)
-
-                # Store in city_to_routes
-                self.city_to_routes[city1].extend(
-                    [(city2, route) for route in routes_list]
-                )
+        Attach the shared map topology and reset route ownership.
+        The topology (routes datastructure and its indices) is built once per map type
+        and shared by every copy of the game, see MapTopology for the indices it holds.
+        Only route ownership is per game, stored as bitmasks of Route.route_id
+        (claimed_mask for every claimed route, Player.route_mask for each player's).
+        """
+        self.set_topology(MapTopology.get(self.map_type))
+        self.claimed_mask = 0
 
-        self.city_names = sorted(
-            list(
-                set(
-                    [city for routes in self.routes.values() for city in routes.keys()]
-                    + [city for city in self.routes.keys()]
-                )
-            )
-        )
-        self.city_to_idx = {city: i for i, city in enumerate(self.city_names)}
-        self.idx_to_city = {i: city for i, city in enumerate(self.city_names)}
-
-        # Create adjacency matrix for faster lookups
-        n = len(self.city_names)
-        self.adjacency = [[[] for _ in range(n)] for _ in range(n)]
-        # Populate AM
-        for city1, connections in self.routes.items():
-            i = self.city_to_idx[city1]
-            for city2, routes_list in connections.items():
-                j = self.city_to_idx[city2]
-                self.adjacency[i][j] = routes_list
+    def set_topology(self, topology: MapTopology):
+        """
+        Points the engine's lookup structures at a shared topology.
+
+        :param topology: The static map data to use
+        :type topology: MapTopology
+        """
+        self.topology = topology
+        self.routes = topology.routes
+        self.city_to_routes = topology.city_to_routes
+        self.route_pairs = topology.route_pairs
+        self.city_names = topology.city_names
+        self.city_to_idx = topology.city_to_idx
+        self.idx_to_city = topology.idx_to_city
+        self.adjacency = topology.adjacency
+        self.fw = topology.fw
+
+    def route_owner(self, route: Route) -> Optional[str]:
+        """
+        Returns the name of the player who claimed a route.
+
+        :param route: The route to check
+        :type route: Route
+        :return: The owner's name, or None if the route is unclaimed
+        :rtype: Optional[str]
+        """
+        route_bit = 1 << route.route_id
+        for player in self.players:
+            if player.route_mask & route_bit:
+                return player.name
+        return None
 
     def route_lookup(self, city1: str, city2: str) -> List[Route]:
         """
@@ -247,126 +264,229 @@ class GameEngine:
         self.current_player_idx = (self.current_player_idx + 1) % len(self.players)
         self.current_player = self.players[self.current_player_idx]
 
-    def set_player_routes(self):
+    def info_set_key(self) -> int:
         """
-        Get all claim actions legal for the player using adjacency matrix, with player-specific caching.
+        Hashes what the current player holds: their routes, hand and destination tickets.
+        Opponents' moves and the decks are left out, in a search they are sampled, so
+        positions the player reaches by different move orders or different samples share a key.
 
-        :return: List of actions where each action is a tuple
-        :rtype: List[tuple("claim_route", city1, city2, colour, player)]
+        :return: Hash of the current player's holdings
+        :rtype: int
         """
-        current_player = self.current_player
-        cache_key = current_player.name
+        player = self.current_player
+        return hash(
+            (
+                self.current_player_idx,
+                player.route_mask,
+                tuple(player.train_cards),
+                frozenset(player.destinations),
+            )
+        )
 
-        # Return cached result if available
-        if cache_key in self.routes_cache and self.routes_cache_valid.get(
-            cache_key, False
-        ):
-            return self.routes_cache[cache_key].copy()
+    def same_outcome(self, other: "GameEngine", player_idx: int) -> bool:
+        """
+        Checks whether a player's visible position is the same in another state, e.g.
+        whether a move searched on a sampled state had the outcome the real game reached.
+        Claimed routes, trains left and the number of destination tickets are compared.
+        The cards and tickets drawn are chance outcomes and are not.
+
+        :param other: The state to compare with
+        :type other: GameEngine
+        :param player_idx: Index of the player to compare
+        :type player_idx: int
+        :return: True if the player's position is the same in both states
+        :rtype: bool
+        """
+        if len(self.players) != len(other.players):
+            return False
+        player = self.players[player_idx]
+        other_player = other.players[player_idx]
+        return (
+            player.name == other_player.name
+            and player.route_mask == other_player.route_mask
+            and player.remaining_trains == other_player.remaining_trains
+            and len(player.destinations) == len(other_player.destinations)
+        )
 
-        route_actions = []
-        n = len(self.city_names)
-
-        # Iterate through adjacency matrix
-        for i in range(n):
-            city1 = self.idx_to_city[i]
-            for j in range(i + 1, n):
-                city2 = self.idx_to_city[j]
-                routes_list = self.adjacency[i][j]
-
-                # Skip if this is a double route and the player already owns one of the routes
-                is_double_route = len(routes_list) > 1
-                if is_double_route:
-                    player_owns_route = False
-                    # If it's only two players, do not allow double route claiming
-                    for player in self.players:
-                        for conn in player.claimed_connections:
-                            conn_city1, conn_city2 = conn[0], conn[1]
-                            if (conn_city1 == city1 and conn_city2 == city2) or (
-                                conn_city1 == city2 and conn_city2 == city1
-                            ):
-                                if len(self.players) == 2:
-                                    player_owns_route = True
-                                    break
-                                elif player.name == current_player.name:
-                                    player_owns_route = True
-                                    break
-                    if player_owns_route:
-                        continue  # Skip all routes between these cities if player already owns one
-
-                for route in routes_list:
-                    if route.claimed_by is None:
-                        if current_player.remaining_trains > route.length:
-                            # For gray routes, check each colour
-                            if route.colour == Colour.GRAY:
-                                for colour in Colour:
-                                    if colour != Colour.WILD and colour != Colour.GRAY:
-                                        cards_needed = route.length
-                                        cards_available = current_player.train_cards[
-                                            colour
-                                        ]
-                                        wilds_available = current_player.train_cards[
-                                            Colour.WILD
-                                        ]
-                                        wilds_required = route.num_locomotives
-                                        wilds_needed = max(
-                                            wilds_required,
-                                            (
-                                                route.length
-                                                - current_player.train_cards[colour]
-                                            ),
-                                        )
+    def determinise(self):
+        """
+        Resamples the hidden parts of the state, the order of the destination deck and the
+        next train card, so searches over different determinisations see different draws.
+        The position itself is unchanged.
+        """
+        random.shuffle(self.destination_deck)
+        self.train_deck.top = None
 
-                                        if (
-                                            cards_available + wilds_available
-                                            >= cards_needed + wilds_required
-                                        ):
-                                            for wilds_used in range(
-                                                wilds_needed, wilds_available + 1
-                                            ):
-                                                route_actions.append(
-                                                    (
-                                                        "claim_route",
-                                                        city1,
-                                                        city2,
-                                                        colour,
-                                                        wilds_used,
-                                                        route,
-                                                        current_player.name,
-                                                    )
-                                                )
-                            else:
-                                # For coloured routes
-                                colour = route.colour
-                                cards_needed = route.length
-                                cards_available = current_player.train_cards[colour]
-                                wilds_available = current_player.train_cards[
-                                    Colour.WILD
-                                ]
-                                wilds_needed = max(
-                                    0,
-                                    (route.length - current_player.train_cards[colour]),
-                                )
-                                if cards_available + wilds_available >= cards_needed:
-                                    for wilds_used in range(
-                                        wilds_needed, wilds_available + 1
-                                    ):
-                                        route_actions.append(
-                                            (
-                                                "claim_route",
-                                                city1,
-                                                city2,
-                                                colour,
-                                                wilds_used,
-                                                route,
-                                                current_player.name,
-                                            )
-                                        )
+    def change_train_cards(self, colour: Colour, delta: int):
+        """
+        Adds (or removes, for negative delta) train cards of a colour from the
+        current player's hand, keeping the claim index up to date.
+
+        :param colour: Colour of the cards
+        :type colour: Colour
+        :param delta: Number of cards to add
+        :type delta: int
+        """
+        if delta == 0:
+            return
+        hand = self.current_player.train_cards
+        count = hand[colour]
+        hand[colour] = count + delta
+        self.mark_claims_dirty(
+            self.current_player_idx,
+            self.topology.card_change_mask(hand, colour, max(count, count + delta)),
+        )
+
+    def change_remaining_trains(self, delta: int):
+        """
+        Adds (or removes, for negative delta) trains from the current player's supply,
+        keeping the claim index up to date.
+
+        :param delta: Number of trains to add
+        :type delta: int
+        """
+        player = self.current_player
+        player.remaining_trains += delta
+        # Only routes at least as long as the smaller supply can change
+        self.mark_claims_dirty(
+            self.current_player_idx,
+            self.topology.long_routes_mask(
+                min(player.remaining_trains, player.remaining_trains - delta)
+            ),
+        )
+
+    def reset_claim_index(self):
+        """
+        Marks every route stale in every player's claim index, so the next
+        set_player_routes call for each player re-evaluates all of them.
+        """
+        num_players = len(self.players)
+        self.claim_index = [[()] * self.topology.num_routes for _ in range(num_players)]
+        self.claim_dirty = [self.topology.all_routes_mask] * num_players
+        self.claim_actions = [None] * num_players
+
+    def mark_claims_dirty(self, player_idx: int, route_mask: int):
+        """
+        Marks routes stale in a player's claim index.
+
+        :param player_idx: Index of the player whose index is affected
+        :type player_idx: int
+        :param route_mask: Bitmask of the route ids to re-evaluate
+        :type route_mask: int
+        """
+        # Claimed routes have no actions, mark_claim_dirty_all covers them when unclaimed
+        route_mask &= ~self.claimed_mask
+        if route_mask:
+            self.claim_dirty[player_idx] |= route_mask
+
+    def mark_claim_dirty_all(self, route_id: int):
+        """
+        Marks a route and its double route stale for every player, after it is claimed or unclaimed.
 
-        # Store in cache
-        self.routes_cache[cache_key] = route_actions.copy()
-        self.routes_cache_valid[cache_key] = True
+        :param route_id: Id of the route
+        :type route_id: int
+        """
+        pair_mask = self.topology.pair_masks[route_id]
+        dirty = self.claim_dirty
+        for player_idx in range(len(dirty)):
+            dirty[player_idx] |= pair_mask
+
+    def route_claim_actions(self, player: Player, route: Route) -> tuple:
+        """
+        All claim actions a player could take on a single route.
+
+        :param player: The player claiming
+        :type player: Player
+        :param route: The route to claim
+        :type route: Route
+        :return: Claim actions for the route, empty if it cannot be claimed
+        :rtype: tuple(tuple("claim_route", city1, city2, colour, wilds_used, route_id, player))
+        """
+        route_id = route.route_id
+        if self.claimed_mask >> route_id & 1:
+            return ()
+        # Routes in a pair the player may no longer take: in a two player game one claim
+        # closes the whole double route, otherwise only the player's own claim does
+        if len(self.players) == 2:
+            blocked_mask = self.claimed_mask
+        else:
+            blocked_mask = player.route_mask
+        if self.topology.pair_masks[route_id] & blocked_mask:
+            return ()
+        if player.remaining_trains <= route.length:
+            return ()
+
+        city1, city2 = self.topology.route_cities[route_id]
+        train_cards = player.train_cards
+        wilds_available = train_cards[Colour.WILD]
+        # Paying with more wilds than the route is long only throws cards away
+        wilds_max = min(wilds_available, route.length)
+        route_actions = []
+        # For gray routes, check each colour
+        if route.colour == Colour.GRAY:
+            wilds_required = route.num_locomotives
+            for colour in CARD_COLOURS:
+                cards_available = train_cards[colour]
+                wilds_needed = max(wilds_required, route.length - cards_available)
+                if cards_available + wilds_available >= route.length + wilds_required:
+                    for wilds_used in range(wilds_needed, wilds_max + 1):
+                        route_actions.append(
+                            (
+                                "claim_route",
+                                city1,
+                                city2,
+                                colour,
+                                wilds_used,
+                                route_id,
+                                player.name,
+                            )
+                        )
+        else:
+            # For coloured routes
+            colour = route.colour
+            cards_available = train_cards[colour]
+            wilds_needed = max(0, route.length - cards_available)
+            if cards_available + wilds_available >= route.length:
+                for wilds_used in range(wilds_needed, wilds_max + 1):
+                    route_actions.append(
+                        (
+                            "claim_route",
+                            city1,
+                            city2,
+                            colour,
+                            wilds_used,
+                            route_id,
+                            player.name,
+                        )
+                    )
+        return tuple(route_actions)
 
-        return route_actions
+    def set_player_routes(self):
+        """
+        Get all claim actions legal for the current player from their claim index.
+        Only routes marked stale since the last call (by claims, card and train changes)
+        are re-evaluated, the rest of the index is reused.
+
+        :return: List of actions where each action is a tuple
+        :rtype: List[tuple("claim_route", city1, city2, colour, wilds_used, route_id, player)]
+        """
+        player_idx = self.current_player_idx
+        dirty = self.claim_dirty[player_idx]
+        if dirty:
+            index = self.claim_index[player_idx]
+            route_list = self.topology.route_list
+            player = self.current_player
+            while dirty:
+                low = dirty & -dirty
+                route_id = low.bit_length() - 1
+                index[route_id] = self.route_claim_actions(player, route_list[route_id])
+                dirty ^= low
+            self.claim_dirty[player_idx] = 0
+            # Route id order matches the upper triangle order of the adjacency matrix
+            self.claim_actions[player_idx] = [
+                action for route_actions in index for action in route_actions
+            ]
+        return self.claim_actions[player_idx].copy()
 
     def cache_update_helper(self, city1, city2):
         """
@@ -387,88 +507,46 @@ class GameEngine:
                 if not ((a == i and b == j) or (a == j and b == i))
             ]
 
-    def claim_route_helper(
-        self, colour: Colour, player: str, num_hits: int, routes
-    ) -> bool:
+    def claim_route(self, route_id: int, colour: Colour, num_hits: int) -> bool:
         """
-        Claims the route if possible, otherwise returns False.
+        Claims a single route for the current player if it is unclaimed and affordable.
+        Ownership is a bit per route id, set in both the player's mask and the claimed mask.
 
-        :param colour: Colour of the route
+        :param route_id: Id of the route to claim
+        :type route_id: int
+        :param colour: Colour of cards used to claim the route
         :type colour: Colour
-        :param player: Name of player claiming the route
-        :type player: str
-        :param num_hits: Number of hits for tunnel routes
+        :param num_hits: Precomputed number of hits for tunnel routes
         :type num_hits: int
-        :param routes: List of routes to claim
-        :type routes: List[Route]
         :return: True if the route was claimed, False otherwise
         :rtype: bool
         """
-        claimed = [False] * len(routes)
-        for i, route in enumerate(routes):
-            claimed[i] = route.is_claimed()
-            if (
-                colour == Colour.WILD
-                or route.colour == colour
-                or route.colour == Colour.GRAY
-            ) and not claimed[i]:
-                if (
-                    self.current_player.train_cards[colour]
-                    + self.current_player.train_cards[Colour.WILD]
-                    >= route.length + num_hits
-                ):
-                    # Update route state
-                    route.claim(player)
-                    # Invalidate cache when route is claimed
-                    for player in self.players:
-                        self.routes_cache_valid[player.name] = False
-                else:
-                    claimed[i] = True
-                    if num_hits == 0:
-                        print(
-                            f"Player {player} does not have enough cards to claim route"
-                        )
-
-        if all(claimed):
+        route_bit = 1 << route_id
+        if self.claimed_mask & route_bit:
             return False
-        return True
 
-    def claim_route(
-        self, city1: str, city2: str, colour: Colour, player: str, num_hits: int
-    ) -> bool:
-        """
-        Checks whether any of the routes between cities with a given can be claimed
-        I have to to do it like this because you can have multiple gray routes between two cities
-        And all of them must be claimable...
-        :param city1: First city
-        :type city1: str
-        :param city2: Second city
-        :type city2: str
-        :param colour: Colour of the route
-        :type colour: Colour
-        :param player: Name of player claiming the route
-        :type player: str
-        :param num_hits: Precomputed number of hits for tunnel routes
-        :type num_hits: int
-        :return: True if the route was claimed, False otherwise
-        :rtype: bool
-        """
+        route = self.topology.route_list[route_id]
+        if not (
+            colour == Colour.WILD
+            or route.colour == colour
+            or route.colour == Colour.GRAY
+        ):
+            return False
 
-        routes = self.route_lookup(city1, city2)
-        if len(routes) == 4:
-            path1 = [routes[0], routes[2]]
-            p1 = self.claim_route_helper(colour, player, num_hits, path1)
-            if p1:
-                return True
-            path2 = [routes[1], routes[3]]
-            p2 = self.claim_route_helper(colour, player, num_hits, path2)
-            if p2:
-                return True
+        player = self.current_player
+        if (
+            player.train_cards[colour] + player.train_cards[Colour.WILD]
+            < route.length + num_hits
+        ):
+            if num_hits == 0:
+                print(f"Player {player.name} does not have enough cards to claim route")
             return False
-        else:  # Only one direction so can claim both
-            if self.claim_route_helper(colour, player, num_hits, routes):
-                return True
-        return False
+
+        # Update route state
+        self.claimed_mask |= route_bit
+        player.route_mask |= route_bit
+        self.mark_claim_dirty_all(route_id)
+        return True
 
     def check_hits(self, route: Route, colour) -> int:
         """
@@ -490,14 +568,13 @@ class GameEngine:
 
         # Ensure we have enough cards to check
         if len(self.train_deck) < 3 and self.discard_deck:
-            self.train_deck.extend(self.discard_deck)
+            self.train_deck.merge(self.discard_deck)
             self.discard_deck.clear()
-            random.shuffle(self.train_deck)
 
         # Draw up to 3 cards and check for matches
         for _ in range(min(3, len(self.train_deck))):
             card = self.train_deck.pop()
-            self.discard_deck.insert(0, card)  # Move drawn cards to discard pile
+            self.discard_deck.add(card)  # Move drawn cards to discard pile
             if card == Colour.WILD or card == colour:
                 num_hits += 1
 
@@ -512,11 +589,13 @@ class GameEngine:
         return routes[0].length
 
     def setup_train_deck(self):
+        # Decks are drawn in a sampled order, so no shuffle is needed
+        self.train_deck = TrainDeck()
+        self.discard_deck = TrainDeck()
         for colour in Colour:
             if colour != Colour.WILD and colour != Colour.GRAY:
-                self.train_deck.extend([colour] * 12)
-        self.train_deck.extend([Colour.WILD] * 14)
-        random.shuffle(self.train_deck)
+                self.train_deck.add(colour, 12)
+        self.train_deck.add(Colour.WILD, 14)
 
     def draw_train_face(self, i: int, card: Colour):
         """Draw a face-up card."""
@@ -524,11 +603,11 @@ class GameEngine:
             if len(self.discard_deck) == 0:
                 # print("Broken")
                 return
-            self.train_deck.extend(self.discard_deck)
+            self.train_deck.merge(self.discard_deck)
             self.discard_deck.clear()
         self.face_up_cards.pop(i)
         self.face_up_cards.append(self.train_deck.pop())
-        self.players[self.current_player_idx].train_cards[card] += 1
+        self.change_train_cards(card, 1)
 
     def draw_train_deck(self):
         """Draw a card from the train deck."""
@@ -536,10 +615,10 @@ class GameEngine:
             if len(self.discard_deck) == 0:
                 # print("Broken")
                 return
-            self.train_deck.extend(self.discard_deck)
+            self.train_deck.merge(self.discard_deck)
             self.discard_deck.clear()
         card = self.train_deck.pop()
-        self.players[self.current_player_idx].train_cards[card] += 1
+        self.change_train_cards(card, 1)
 
     def check_all_destinations(self, player) -> List[Tuple[Destination, bool]]:
         """
@@ -594,14 +673,15 @@ class GameEngine:
             for city1, city2, colour in player.claimed_connections:
                 used_trains += self.get_route_length(city1, city2)
                 print(
-                    f"{city1} to {city2} with {colour.value} and length {self.get_route_length(city1, city2)}"
+                    f"{city1} to {city2} with {colour.label} and length {self.get_route_length(city1, city2)}"
                 )
 
     # MCTS methods
     def copy(self):
         """
         Creates a copy of the current game state for simulation purposes.
-        Efficiently copies all game elements including players, decks, and game state.
+        The map topology is immutable and shared, so only per-game state is copied:
+        route ownership, decks, hands and each player's connectivity.
 
         :return: A new GameEngine instance with copied state
         :rtype: GameEngine
@@ -611,63 +691,26 @@ class GameEngine:
 
         # Copy id values
         new_state.current_player_idx = self.current_player_idx
+        new_state.map_type = self.map_type
+        new_state.most_recent_hits = self.most_recent_hits
 
         # Copy simple collections directly
-        new_state.train_deck = self.train_deck.copy() if self.train_deck else []
-        new_state.destination_deck = (
-            self.destination_deck.copy() if self.destination_deck else []
-        )
-        new_state.face_up_cards = (
-            self.face_up_cards.copy() if self.face_up_cards else []
-        )
-
-        # Copy indexing structures (these are mostly immutable after creation)
-        if hasattr(self, "city_names"):
-            new_state.city_names = self.city_names.copy()
-        if hasattr(self, "city_to_idx"):
-            new_state.city_to_idx = self.city_to_idx.copy()
-        if hasattr(self, "idx_to_city"):
-            new_state.idx_to_city = self.idx_to_city.copy()
-
-        # More efficient copying of lookup structures
-        if hasattr(self, "city_to_routes"):
-            new_state.city_to_routes = {}
-            for city, routes in self.city_to_routes.items():
-                new_state.city_to_routes[city] = routes.copy()
-
-        if hasattr(self, "route_pairs"):
-            new_state.route_pairs = {}
-            for key, routes in self.route_pairs.items():
-                new_state.route_pairs[key] = [
-                    Route(r.length, r.colour, r.claimed_by) for r in routes
-                ]
-
-        # Efficiently copy adjacency matrix if it exists
-        if hasattr(self, "adjacency") and self.adjacency:
-            n = len(self.adjacency)
-            new_state.adjacency = [[[] for _ in range(n)] for _ in range(n)]
-            for i in range(n):
-                for j in range(n):
-                    if self.adjacency[i][j]:  # Only copy non-empty lists
-                        new_state.adjacency[i][j] = [
-                            Route(r.length, r.colour, r.claimed_by)
-                            for r in self.adjacency[i][j]
-                        ]
-
-        # Copy caches over
-        new_state.routes_cache = self.routes_cache.copy() if self.routes_cache else {}
-        new_state.routes_cache_valid = (
-            self.routes_cache_valid.copy() if self.routes_cache_valid else {}
-        )
-        new_state.best_routes_cache = (
-            self.best_routes_cache.copy() if self.best_routes_cache else {}
-        )
-        new_state.best_routes_cache_valid = (
-            self.best_routes_cache_valid.copy() if self.best_routes_cache_valid else {}
-        )
-
-        # Handle FloydWarshall - lazy instantiation
-        new_state.fw = self.fw
+        new_state.train_deck = self.train_deck.copy()
+        new_state.discard_deck = self.discard_deck.copy()
+        new_state.destination_deck = self.destination_deck.copy()
+        new_state.destination_discard_deck = self.destination_discard_deck.copy()
+        new_state.face_up_cards = self.face_up_cards.copy()
+
+        # Share the static map data, copy who owns what
+        if self.topology:
+            new_state.set_topology(self.topology)
+        new_state.claimed_mask = self.claimed_mask
+
+        # Copy caches over, claim actions are immutable tuples so they are shared
+        new_state.claim_index = [index.copy() for index in self.claim_index]
+        new_state.claim_dirty = self.claim_dirty.copy()
+        new_state.claim_actions = self.claim_actions.copy()
+        new_state.distance_bases = self.distance_bases.copy()
 
         # Copy players
         new_state.players = []
@@ -678,9 +721,7 @@ class GameEngine:
             )
 
             # Copy collections
-            new_player.train_cards = {
-                colour: count for colour, count in player.train_cards.items()
-            }
+            new_player.train_cards = player.train_cards.copy()
             new_player.destinations = (
                 player.destinations.copy() if player.destinations else []
             )
@@ -693,13 +734,12 @@ class GameEngine:
             # Copy integer values
             new_player.points = player.points
             new_player.turn = player.turn
+            new_player.route_mask = player.route_mask
+            new_player.longest_route = player.longest_route
 
-            # Recreate UnionFind instead of copying it
+            # Clone connectivity instead of replaying every claim
             if player.uf:
-                new_player.uf = UnionFind(self.city_names)
-                # Only rebuild connections that matter
-                for city1, city2, _ in player.claimed_connections:
-                    new_player.uf.union(city1, city2)
+                new_player.uf = player.uf.clone()
 
             new_state.players.append(new_player)
 
@@ -733,35 +773,33 @@ class GameEngine:
                         self.draw_train_face(idx2, card2)
                     else:
                         self.draw_train_deck()
-            case ["claim_route", city1, city2, colour, wilds_used, route, player_name]:
-                num_hits = self.check_hits(route, colour)
-                if self.claim_route(city1, city2, colour, player_name, num_hits):
-                    route_length = self.get_route_length(city1, city2) or 0
-                    total_length = route_length + num_hits
-
-                    # Calculate the minimum number of wilds the player now has to use to complete the route
-                    # Or return False if not possible because of too many tunnel hits.
-                    if num_hits > 0:
-                        if total_length > player.train_cards[colour]:
-                            wilds_used += total_length - player.train_cards[colour]
-                            if wilds_used > player.train_cards[Colour.WILD]:
-                                if wilds_used > player.train_cards[Colour.WILD]:
-                                    return False
-
-                    # If the route is in the best routes cache, invalidate it
-                    if self.best_routes_cache.get(player_name, False):
-                        for i in range(len(self.best_routes_cache[player.name])):
-                            if self.best_routes_cache[player.name][i][1] == (
-                                city1 or city2
-                            ) and self.best_routes_cache[player.name][i][2] == (
-                                city1 or city2
-                            ):
-                                self.best_routes_cache_valid[player.name] = False
-
-                    player.train_cards[Colour.WILD] -= wilds_used
-                    player.train_cards[colour] -= max(0, total_length - wilds_used)
-                    self.discard_deck.extend([Colour.WILD] * wilds_used)
-                    self.discard_deck.extend([colour] * (total_length - wilds_used))
+            case [
+                "claim_route",
+                city1,
+                city2,
+                colour,
+                wilds_used,
+                route_id,
+                player_name,
+            ]:
+                num_hits = self.check_hits(self.topology.route_list[route_id], colour)
+                route_length = self.get_route_length(city1, city2) or 0
+                total_length = route_length + num_hits
+
+                # Calculate the minimum number of wilds the player now has to use to complete the route
+                # Or return False if not possible because of too many tunnel hits.
+                # Checked before claiming so a failed tunnel leaves the route unclaimed.
+                if num_hits > 0:
+                    if total_length > player.train_cards[colour]:
+                        wilds_used += total_length - player.train_cards[colour]
+                        if wilds_used > player.train_cards[Colour.WILD]:
+                            return False
+
+                if self.claim_route(route_id, colour, num_hits):
+                    self.change_train_cards(Colour.WILD, -wilds_used)
+                    self.change_train_cards(colour, -max(0, total_length - wilds_used))
+                    self.discard_deck.add(Colour.WILD, wilds_used)
+                    self.discard_deck.add(colour, max(0, total_length - wilds_used))
                     player.claimed_connections.append((city1, city2, colour))
                     player.claimed_cities.add(city1)
                     player.claimed_cities.add(city2)
@@ -771,17 +809,23 @@ class GameEngine:
                     else:
                         print(f"Error: route length is {route_length}")
                     player.uf.union(city1, city2)
+                    # Only the component the route joined can have a new longest trail
+                    component_routes = (
+                        player.route_mask
+                        & self.topology.incident_routes(player.uf.component_mask(city1))
+                    )
+                    player.longest_route = max(
+                        player.longest_route,
+                        self.topology.longest_trail(component_routes),
+                    )
 
                     self.cache_update_helper(city1, city2)
-                    player.remaining_trains -= route_length
+                    self.change_remaining_trains(-route_length)
                     return True
                 return False
             case ["draw_destination_tickets", i, j, k, player_name]:
                 choices = []
                 destinations = []
-                # If we draw a destination ticket, invalidate the best routes cache
-                if self.best_routes_cache_valid.get(player_name, False):
-                    self.best_routes_cache_valid[player_name] = False
 
                 if len(self.destination_deck) < 3:
                     self.destination_deck.extend(self.destination_discard_deck)
@@ -802,6 +846,108 @@ class GameEngine:
                 )
                 self.current_player.destinations.extend(destinations)
 
+    def make_action(self, action) -> UndoRecord:
+        """
+        Applies an action exactly like apply_action, but first records everything it can change.
+        Passing the record to unmake_action rewinds the state, so rollouts can play out on a
+        single state instead of copying it for every simulation.
+
+        :param action: A formatted action
+        :type action: tuple(str, ...)
+        :return: Record of the state before the action, result of apply_action in record.result
+        :rtype: UndoRecord
+        """
+        player = self.current_player
+        record = UndoRecord(
+            player_idx=self.current_player_idx,
+            most_recent_hits=self.most_recent_hits,
+            train_deck=self.train_deck,
+            discard_deck=self.discard_deck,
+            face_up_cards=self.face_up_cards,
+            train_cards=player.train_cards.copy(),
+            points=player.points,
+            remaining_trains=player.remaining_trains,
+            num_destinations=len(player.destinations),
+            num_connections=len(player.claimed_connections),
+            claimed_mask=self.claimed_mask,
+            route_mask=player.route_mask,
+            longest_route=player.longest_route,
+        )
+        # Card piles are small, swap in copies so the originals stay untouched
+        self.train_deck = self.train_deck.copy()
+        self.discard_deck = self.discard_deck.copy()
+        self.face_up_cards = self.face_up_cards.copy()
+
+        match action[0]:
+            case "claim_route":
+                city1, city2 = action[1], action[2]
+                record.added_cities = [
+                    city for city in (city1, city2) if city not in player.claimed_cities
+                ]
+                record.uf = player.uf
+                player.uf = player.uf.clone()
+            case "draw_destination_tickets":
+                record.destination_deck = self.destination_deck
+                record.destination_discard_deck = self.destination_discard_deck
+                self.destination_deck = self.destination_deck.copy()
+                self.destination_discard_deck = self.destination_discard_deck.copy()
+
+        record.result = self.apply_action(action)
+        return record
+
+    def unmake_action(self, record: UndoRecord):
+        """
+        Reverts the action recorded by make_action. Records must be undone in reverse order.
+
+        :param record: The record returned by make_action
+        :type record: UndoRecord
+        """
+        self.current_player_idx = record.player_idx
+        self.current_player = self.players[record.player_idx]
+        player = self.current_player
+
+        # The claim index is not snapshotted, mark whatever the action touched as stale.
+        # Taking the larger count of every colour covers both hands
+        larger_hand = list(map(max, player.train_cards, record.train_cards))
+        for colour, count in enumerate(record.train_cards):
+            if player.train_cards[colour] != count:
+                self.mark_claims_dirty(
+                    record.player_idx,
+                    self.topology.card_change_mask(
+                        larger_hand, colour, larger_hand[colour]
+                    ),
+                )
+        if player.remaining_trains != record.remaining_trains:
+            self.mark_claims_dirty(
+                record.player_idx,
+                self.topology.long_routes_mask(player.remaining_trains),
+            )
+        claimed = self.claimed_mask ^ record.claimed_mask
+        while claimed:
+            low = claimed & -claimed
+            self.mark_claim_dirty_all(low.bit_length() - 1)
+            claimed ^= low
+
+        self.most_recent_hits = record.most_recent_hits
+        self.train_deck = record.train_deck
+        self.discard_deck = record.discard_deck
+        self.face_up_cards = record.face_up_cards
+        player.train_cards = record.train_cards
+        player.points = record.points
+        player.remaining_trains = record.remaining_trains
+        del player.destinations[record.num_destinations :]
+        del player.claimed_connections[record.num_connections :]
+        self.claimed_mask = record.claimed_mask
+        player.route_mask = record.route_mask
+        player.longest_route = record.longest_route
+
+        if record.uf is not None:
+            player.uf = record.uf
+            player.claimed_cities.difference_update(record.added_cities)
+        if record.destination_deck is not None:
+            self.destination_deck = record.destination_deck
+            self.destination_discard_deck = record.destination_discard_deck
+
     def apply_action_final(self, action):
         """
         Formats an print statement for the action taken by the player.
@@ -813,9 +959,9 @@ class GameEngine:
         success = self.apply_action(action)
 
         print(f"{self.current_player.name}'s hand:")
-        for colour, count in self.current_player.train_cards.items():
+        for colour, count in zip(Colour, self.current_player.train_cards):
             if count > 0:
-                print(f"{colour.value}: {count}")
+                print(f"{colour.label}: {count}")
         match action:
             case [
                 "draw_two_train_cards",
@@ -827,35 +973,44 @@ class GameEngine:
             ]:
                 # Convert to strings and format
                 if card1 != "deck" and card1 != "nodraw":
-                    card1 = card1.value
+                    card1 = card1.label
                 if card2 != "deck" and card2 != "nodraw":
-                    card2 = card2.value
+                    card2 = card2.label
                 if card2 == "nodraw":
                     print(f"{player_name} has drawn a Wild card")
                 else:
                     print(f"{player_name} has drawn two train cards: {card1}, {card2}")
 
-            case ["claim_route", city1, city2, colour, wilds_used, route, player_name]:
+            case [
+                "claim_route",
+                city1,
+                city2,
+                colour,
+                wilds_used,
+                route_id,
+                player_name,
+            ]:
                 route_length = self.get_route_length(city1, city2)
                 num_hits = self.most_recent_hits
+                route = self.topology.route_list[route_id]
                 if route.tunnel and self.most_recent_hits > 0:
                     self.most_recent_hits = 0
                 if success:
                     if num_hits > 0:
                         print(
-                            f"{player_name} has claimed a route of length {route_length} between {city1} and {city2} with {colour.value} using {wilds_used} wild cards and {num_hits} hits"
+                            f"{player_name} has claimed a route of length {route_length} between {city1} and {city2} with {colour.label} using {wilds_used} wild cards and {num_hits} hits"
                         )
                     elif wilds_used > 0:
                         print(
-                            f"{player_name} has claimed a route of length {route_length} between {city1} and {city2} with {colour.value} using {wilds_used} wild cards"
+                            f"{player_name} has claimed a route of length {route_length} between {city1} and {city2} with {colour.label} using {wilds_used} wild cards"
                         )
                     else:
                         print(
-                            f"{player_name} has claimed a route of length {route_length} between {city1} and {city2} with {colour.value}"
+                            f"{player_name} has claimed a route of length {route_length} between {city1} and {city2} with {colour.label}"
                         )
                 else:
                     print(
-                        f"{player_name} got {num_hits} hits on a {route_length} route between {city1} and {city2} with {colour.value}"
+                        f"{player_name} got {num_hits} hits on a {route_length} route between {city1} and {city2} with {colour.label}"
                     )
 
             case ["draw_destination_tickets", i, j, k, player_name]:
@@ -873,6 +1028,10 @@ class GameEngine:
                 print(
                     f"{self.current_player.name} has completed destination ticket {dest.city1} to {dest.city2} ({dest.points} points)"
                 )
+            elif distance == float("inf"):
+                print(
+                    f"{self.current_player.name} can no longer complete destination ticket {dest.city1} to {dest.city2} ({dest.points} points)"
+                )
             else:
                 print(
                     f"{self.current_player.name} is {distance} trains away from completing destination ticket {dest.city1} to {dest.city2} ({dest.points} points)"
@@ -911,7 +1070,7 @@ class GameEngine:
                     for j, card2 in enumerate(self.face_up_cards):
                         if j == i:
                             if len(self.train_deck) > 0:
-                                card2 = self.train_deck[0]
+                                card2 = self.train_deck.peek()
                         if card2 != Colour.WILD:
                             legal_actions.append(
                                 (
@@ -973,57 +1132,53 @@ class GameEngine:
                                 )
         return legal_actions
 
-    def get_longest_route_length(self, player):
+    def encode_action(self, action) -> int:
         """
-        Calculates the longest continuous route length for a player.
-        Uses DFS to find the longest path in the player's network.
+        Returns the fixed index of an action on this map, see ActionSpace.
 
-        :param player: The player to calculate for
-        :type player: Player
-        :return: Length of the longest continuous route
+        :param action: A formatted action
+        :type action: tuple(str, ...)
+        :return: Index of the action
         :rtype: int
         """
-        if not player.claimed_connections:
-            return 0
-
-        # Build weighted adjacency list from player's claimed connections
-        connections = {}
-        for city1, city2, _ in player.claimed_connections:
-            route_length = self.get_route_length(city1, city2)
-
-            if city1 not in connections:
-                connections[city1] = []
-            if city2 not in connections:
-                connections[city2] = []
+        return self.topology.action_space.encode(action)
 
-            # Store the destination city and the route length
-            connections[city1].append((city2, route_length))
-            connections[city2].append((city1, route_length))
-
-        # DFS to find longest path from each starting city
-        max_length = 0
+    def decode_action(self, index: int):
+        """
+        Rebuilds the action at an index for the current player.
 
-        def dfs(city, visited, path_length):
-            visited.add(city)
-            longest = path_length
+        :param index: Index of the action
+        :type index: int
+        :return: The formatted action
+        :rtype: tuple(str, ...)
+        """
+        return self.topology.action_space.decode(index, self)
 
-            for next_city, route_length in connections.get(city, []):
-                if next_city not in visited:
-                    # Add the actual route length to the path
-                    longest = max(
-                        longest, dfs(next_city, visited, path_length + route_length)
-                    )
+    def legal_action_mask(self) -> int:
+        """
+        Bitmask of the legal actions for the current player, bit i set if action index i is legal.
 
-            visited.remove(city)  # Backtrack
-            return longest
+        :return: Bitmask over the map's action space
+        :rtype: int
+        """
+        encode = self.topology.action_space.encode
+        mask = 0
+        for action in self.get_legal_actions():
+            mask |= 1 << encode(action)
+        return mask
 
-        # Try each city as a starting point
-        for city in player.claimed_cities:
-            if city in connections:
-                length = dfs(city, set(), 0)
-                max_length = max(max_length, length)
+    def get_longest_route_length(self, player):
+        """
+        Returns the longest continuous route length for a player.
+        The length is maintained as routes are claimed (see MapTopology.longest_trail),
+        so this is a lookup rather than a search.
 
-        return max_length
+        :param player: The player to calculate for
+        :type player: Player
+        :return: Length of the longest continuous route
+        :rtype: int
+        """
+        return player.longest_route
 
     def remove_destination_tickets(self, player, destinations_remove):
         """
@@ -1040,17 +1195,58 @@ class GameEngine:
             if destinations_remove[i] == 1
         ]
 
+    def get_player_distances(self, player: Player) -> DistanceRows:
+        """
+        Shortest distances between cities for a player in this position: their own routes
+        are free and routes they can no longer claim are removed. Repaired from the
+        player's previous distances, so it is cheap to call after every claim.
+
+        :param player: The player to get distances for
+        :type player: Player
+        :return: Distances by city index (infinity if unreachable)
+        :rtype: DistanceRows
+        """
+        result = self.topology.player_distances(
+            player.route_mask,
+            self.claimed_mask,
+            len(self.players) == 2,
+            self.distance_bases.get(player.name),
+        )
+        self.distance_bases[player.name] = result
+        return result[1]
+
+    def get_component_distances(self, player: Player, cities) -> List[List[float]]:
+        """
+        Distances from the player's network component containing each city to every city.
+        Own routes are free, so every city in a component has the same distances and the
+        row is solved once per component (from its union-find root) and shared.
+
+        :param player: The player to get distances for
+        :type player: Player
+        :param cities: The cities to get distances from
+        :type cities: Iterable[str]
+        :return: Distance rows by city index, one per city
+        :rtype: List[List[float]]
+        """
+        dist = self.get_player_distances(player)
+        parent = player.uf.parent
+        city_to_idx = self.city_to_idx
+        return [dist.row(parent[city_to_idx[city]]) for city in cities]
+
     def get_distance(self, player):
         """
         Calculates how close a player is to completing each destination ticket.
-        For each destination, determines the minimum number of additional trains needed.
+        For each destination, determines the minimum number of additional trains needed,
+        using the routes the player still can claim and counting their own as free.
 
         :param player: The player to analyze
         :type player: Player
-        :return: List of tuples (destination, distance) where distance is train count needed
-        :rtype: List[Tuple[Destination, int]]
+        :return: List of tuples (destination, distance) where distance is train count needed,
+                or infinity if the destination can no longer be completed
+        :rtype: List[Tuple[Destination, float]]
         """
         results = []
+        city_to_idx = self.city_to_idx
 
         # For each destination ticket
         for destination in player.destinations:
@@ -1061,58 +1257,126 @@ class GameEngine:
                 results.append((destination, 0))
                 continue
 
-            # Direct distance between endpoints as fallback
-            direct_distance = self.fw.get_distance(city1, city2)
-            min_distance = direct_distance
-
-            # Check every controlled city for potential connections
-            for controlled_city in player.claimed_cities:
-                # Calculate distances from this controlled city to both endpoints
-                dist_to_city1 = float("inf")
-                dist_to_city2 = float("inf")
-
-                # Check if the controlled city is directly one of the endpoints
-                if controlled_city == city1:
-                    dist_to_city1 = 0
-                elif controlled_city == city2:
-                    dist_to_city2 = 0
-
-                # Find the shortest path from this city to each endpoint
-                # (Only if we need to calculate it - if it's not already 0)
-                if dist_to_city1 > 0:
-                    # Check if controlled_city is connected to city1 through the network
-                    if player.uf.is_connected(controlled_city, city1):
-                        dist_to_city1 = 0
-                    else:
-                        # Use Floyd-Warshall to get shortest path
-                        dist_to_city1 = self.fw.get_distance(controlled_city, city1)
+            # Own routes are free, so this is the trains still needed (infinity if blocked)
+            (dist_from1,) = self.get_component_distances(player, (city1,))
+            results.append((destination, dist_from1[city_to_idx[city2]]))
 
-                if dist_to_city2 > 0:
-                    # Check if controlled_city is connected to city2 through the network
-                    if player.uf.is_connected(controlled_city, city2):
-                        dist_to_city2 = 0
-                    else:
-                        # Use Floyd-Warshall to get shortest path
-                        dist_to_city2 = self.fw.get_distance(controlled_city, city2)
+        return results
 
-                # If either distance is invalid, skip this city
-                if dist_to_city1 < 0 or dist_to_city2 < 0:
-                    continue
+    def get_route_values(
+        self, player: Player, route_ids: List[int]
+    ) -> List[Optional[int]]:
+        """
+        Value of claiming routes towards the player's destination tickets, before the card
+        penalty. Values only depend on the player's network, the claimed routes, the
+        player's destinations and whether it is a two player game, so they are cached under
+        that version on the MapTopology and shared by every game in the process. Only the
+        routes asked for are scored, later calls score the rest as they need them.
 
-                # Calculate combined distance (from controlled city to both endpoints)
-                total_distance = dist_to_city1 + dist_to_city2
+        :param player: The player to value routes for
+        :type player: Player
+        :param route_ids: Ids of the routes to value
+        :type route_ids: List[int]
+        :return: Value of each route, None for routes that don't help (or are claimed)
+        :rtype: List[Optional[int]]
+        """
+        key = (
+            player.route_mask,
+            self.claimed_mask,
+            tuple(player.destinations),
+            len(self.players) == 2,
+        )
+        cache = self.topology.route_value_cache
+        entry = cache.get(key)
+        if entry is None:
+            open_destinations = [
+                dest
+                for dest in player.destinations
+                if not player.uf.is_connected(dest.city1, dest.city2)
+            ]
+            # Distance rows of the endpoints of each unfinished destination, for step 2
+            destination_rows = []
+            for dest in open_destinations:
+                dist_from1, dist_from2 = self.get_component_distances(
+                    player, (dest.city1, dest.city2)
+                )
+                destination_rows.append(
+                    (
+                        dest,
+                        dist_from1,
+                        dist_from2,
+                        dist_from1[self.city_to_idx[dest.city2]],
+                    )
+                )
+            entry = (
+                open_destinations,
+                destination_rows,
+                [UNSCORED] * self.topology.num_routes,
+            )
+            cache.put(key, entry)
+        open_destinations, destination_rows, route_values = entry
 
-                # Update minimum distance if this is better
-                if total_distance < min_distance:
-                    min_distance = total_distance
+        for route_id in route_ids:
+            if route_values[route_id] == UNSCORED:
+                route_values[route_id] = self.score_route(
+                    player, route_id, open_destinations, destination_rows
+                )
+        return [route_values[route_id] for route_id in route_ids]
+
+    def score_route(
+        self,
+        player: Player,
+        route_id: int,
+        open_destinations: List[Destination],
+        destination_rows: list,
+    ) -> Optional[int]:
+        """
+        Value of claiming one route towards the player's unfinished destination tickets.
 
-            # Sanity check for extreme values
-            if min_distance < 0 or min_distance > 25:
-                min_distance = direct_distance
+        :param player: The player to value the route for
+        :type player: Player
+        :param route_id: Id of the route
+        :type route_id: int
+        :param open_destinations: The player's unfinished destinations
+        :type open_destinations: List[Destination]
+        :param destination_rows: (destination, distances from city1, distances from city2,
+            distance between them) for each unfinished destination
+        :type destination_rows: list
+        :return: The value, None if the route doesn't help (or is claimed)
+        :rtype: Optional[int]
+        """
+        if self.claimed_mask >> route_id & 1:
+            return None
+        uf = player.uf
+        city1, city2 = self.topology.route_cities[route_id]
 
-            results.append((destination, min_distance))
+        # Step 1: Check if claiming a route directly completes a destination ticket
+        for dest in open_destinations:
+            if (
+                uf.is_connected(city1, dest.city1)
+                and uf.is_connected(city2, dest.city2)
+            ) or (
+                uf.is_connected(city1, dest.city2)
+                and uf.is_connected(city2, dest.city1)
+            ):
+                # Direct completion - highest priority
+                return 1000 + dest.points
+
+        # Step 2: Check if route is on a shortest path between destination endpoints,
+        # around routes the player can no longer claim
+        route_length = self.topology.route_list[route_id].length
+        i, j = self.city_to_idx[city1], self.city_to_idx[city2]
+        for dest, dist_from1, dist_from2, dest_distance in destination_rows:
+            if dest_distance == float("inf"):
+                continue
 
-        return results
+            # The route is an edge of a shortest path if going through it costs nothing extra
+            if (
+                dist_from1[i] + route_length + dist_from2[j] == dest_distance
+                or dist_from1[j] + route_length + dist_from2[i] == dest_distance
+            ):
+                return 400 + dest.points
+        return None
 
     def select_best_route_action(self, route_actions):
         """
@@ -1130,60 +1394,24 @@ class GameEngine:
 
         player = self.current_player
         beneficial_actions = []
+        route_values = self.get_route_values(
+            player, [action[5] for action in route_actions]
+        )
 
-        for action in route_actions:
-            city1, city2 = action[1], action[2]
+        for action, value in zip(route_actions, route_values):
+            if value is None:
+                continue
             colour = action[3]
-            route = action[5]
+            route = self.topology.route_list[action[5]]
 
             # Calculate card penalty (100 points per card needed)
-            route_length = route.length
-            cards_available = player.train_cards[colour]
             cards_needed = max(
-                0, route_length - cards_available - player.train_cards[Colour.WILD]
+                0,
+                route.length
+                - player.train_cards[colour]
+                - player.train_cards[Colour.WILD],
             )
-            card_penalty = cards_needed * 100
-            completion = False
-
-            # Step 1: Check if claiming a route directly completes a destination ticket
-            for dest in player.destinations:
-                if not player.uf.is_connected(dest.city1, dest.city2):
-                    if (
-                        player.uf.is_connected(city1, dest.city1)
-                        and player.uf.is_connected(city2, dest.city2)
-                    ) or (
-                        player.uf.is_connected(city1, dest.city2)
-                        and player.uf.is_connected(city2, dest.city1)
-                    ):
-                        # Direct completion - highest priority, but with card penalty
-                        beneficial_actions.append(
-                            (action, 1000 + dest.points - card_penalty)
-                        )
-                        completion = True
-                        break
-
-            # If we already found a high-value action, continue to next route
-            if completion:
-                continue
-
-            # Step 2: Check if route is on the optimal path between destination endpoints
-            for dest in player.destinations:
-                # Skip completed destinations
-                if player.uf.is_connected(dest.city1, dest.city2):
-                    continue
-
-                # Get the optimal path between destination endpoints
-                optimal_path = self.fw.get_path(dest.city1, dest.city2)
-                if city1 in optimal_path or city2 in optimal_path:
-                    # If both cities are adjacent on the optimal path, it's even more valuable
-                    if city1 in optimal_path and city2 in optimal_path:
-                        idx1 = optimal_path.index(city1)
-                        idx2 = optimal_path.index(city2)
-                        if abs(idx1 - idx2) == 1:  # Cities are adjacent in the path
-                            beneficial_actions.append(
-                                (action, 400 + dest.points - card_penalty)
-                            )
-                            break
+            beneficial_actions.append((action, value - cards_needed * 100))
 
         # If we found beneficial actions, choose from the top ones
         if beneficial_actions:
@@ -1219,20 +1447,16 @@ class GameEngine:
         # Get Floyd-Warshall paths for optimal routing
         fw = self.fw
 
-        # Store complete path sequences (not just sets of cities)
+        # Store the cities and edges of each optimal path
         path_sequences = []
         for dest in options:
-            # Get optimal path cities - preserve order to check for shared edges
-            if hasattr(fw, "get_path"):
-                path = fw.get_path(dest.city1, dest.city2)
-            else:
-                # Fallback if get_path doesn't exist
-                path = [dest.city1, dest.city2]
-            path_sequences.append((dest, path))
+            path_cities = fw.get_path_cities(dest.city1, dest.city2)
+            path_edges = fw.get_path_edges(dest.city1, dest.city2)
+            path_sequences.append((dest, path_cities, path_edges))
 
         # Calculate a score for each destination ticket
         ticket_scores = []
-        for dest_idx, (dest, path) in enumerate(path_sequences):
+        for dest_idx, (dest, path_cities, path_edges) in enumerate(path_sequences):
             # Get direct distance between cities
             distance = fw.get_distance(dest.city1, dest.city2)
 
@@ -1243,21 +1467,15 @@ class GameEngine:
             path_overlap_score = 0
             intersection_score = 0
 
-            for other_idx, (other_dest, other_path) in enumerate(path_sequences):
+            for other_idx, (other_dest, other_cities, other_edges) in enumerate(
+                path_sequences
+            ):
                 if dest_idx == other_idx:
                     continue
 
                 # Look for shared edges (consecutive city pairs)
-                shared_edges = 0
-                for i in range(len(path) - 1):
-                    city1, city2 = path[i], path[i + 1]
-                    # Check if this edge (city1->city2) exists in the other path
-                    for j in range(len(other_path) - 1):
-                        if (other_path[j] == city1 and other_path[j + 1] == city2) or (
-                            other_path[j] == city2 and other_path[j + 1] == city1
-                        ):
-                            shared_edges += 1
-                            break
+                common_edges = path_edges & other_edges
+                shared_edges = len(common_edges)
 
                 # Add value for shared edges (major bonus - saves actual trains)
                 if shared_edges > 0:
@@ -1265,20 +1483,10 @@ class GameEngine:
 
                 # Add intersection bonus (minor bonus - potential hub cities)
                 # Check for city intersections that aren't already counted in shared edges
-                path_set = set(path)
-                other_set = set(other_path)
-                intersections = path_set.intersection(other_set)
+                intersections = path_cities & other_cities
 
                 # Don't double-count: subtract cities that are part of shared edges
-                edge_cities = set()
-                for i in range(len(path) - 1):
-                    city1, city2 = path[i], path[i + 1]
-                    for j in range(len(other_path) - 1):
-                        if (other_path[j] == city1 and other_path[j + 1] == city2) or (
-                            other_path[j] == city2 and other_path[j + 1] == city1
-                        ):
-                            edge_cities.add(city1)
-                            edge_cities.add(city2)
+                edge_cities = {city for edge in common_edges for city in edge}
 
                 # Only count intersections that aren't part of shared edges
                 unique_intersections = intersections - edge_cities
@@ -1336,40 +1544,103 @@ class GameEngine:
         Advances the game to the next player's turn.
         Updates both the current_player_idx and the current_player reference.
         """
-        self.current_player_idx = (self.current_player_idx + 1) % len(self.players)
-        self.current_player = self.players[self.current_player_idx]
+        self.update_player_turn()
 
-    def game_result(self, game_num):
+    def final_scores(self) -> List[int]:
         """
-        Calculates final scores for all players and returns current player's score.
-        Doesn't print, used during MCTS simulations to evaluate game outcomes.
-
-        :param game_num: The game number (used for tracking in simulations)
-        :type game_num: int
-        :return: Current player's final score
-        :rtype: int
+        Final score of every player if the game ended now, without changing any state:
+        current points, plus or minus each destination ticket and 10 for the longest
+        continuous route (at least 5 long, the later player in turn order wins a tie).
+        Uses the union-find connectivity and the incrementally kept longest route, so the
+        same state can be scored any number of times.
+
+        :return: Final score by player index
+        :rtype: List[int]
         """
+        scores = []
         longest_score = 5
-        longest_player = None
-        current_player = self.current_player
-        for player in self.players:
-            destination_results = self.check_all_destinations(player)
-            longest = self.get_longest_route_length(player)
+        longest_idx = None
+        for idx, player in enumerate(self.players):
+            score = player.points
+            for destination in player.destinations:
+                if player.uf.is_connected(destination.city1, destination.city2):
+                    score += destination.points
+                else:
+                    score -= destination.points
+            scores.append(score)
 
-            if longest >= longest_score:
-                longest_score = longest
-                longest_player = player
+            if player.longest_route >= longest_score:
+                longest_score = player.longest_route
+                longest_idx = idx
 
-            for destination, is_complete in destination_results:
-                if is_complete:
-                    player.points += destination.points
-                else:
-                    player.points -= destination.points
+        if longest_idx is not None:
+            scores[longest_idx] += 10
+        return scores
+
+    @staticmethod
+    def score_margins(scores: List[int]) -> List[int]:
+        """
+        Each player's score minus the best score among the other players.
 
-        if longest_player:
-            longest_player.points += 10
+        :param scores: Score by player index, e.g. from final_scores
+        :type scores: List[int]
+        :return: Margin by player index, positive for the outright leader
+        :rtype: List[int]
+        """
+        margins = []
+        for idx, score in enumerate(scores):
+            best_other = max(other for i, other in enumerate(scores) if i != idx)
+            margins.append(score - best_other)
+        return margins
+
+    @staticmethod
+    def score_wins(scores: List[int]) -> List[float]:
+        """
+        Win share of each player: 1 for an outright winner, split between tied winners.
 
-        return current_player.points
+        :param scores: Score by player index, e.g. from final_scores
+        :type scores: List[int]
+        :return: Win share by player index, summing to 1
+        :rtype: List[float]
+        """
+        best = max(scores)
+        num_winners = scores.count(best)
+        return [1 / num_winners if score == best else 0.0 for score in scores]
+
+    def game_results(self, reward: str = "score") -> List[float]:
+        """
+        Reward of every player if the game ended now, see final_scores.
+        Doesn't print or change the state, so one playout can be scored for every seat.
+
+        :param reward: "score" for the final score, "margin" for the score minus the best
+            other score, "win" for the win share
+        :type reward: str
+        :raises ValueError: If the reward is not one of REWARDS
+        :return: Reward by player index
+        :rtype: List[float]
+        """
+        scores = self.final_scores()
+        if reward == "score":
+            return scores
+        if reward == "margin":
+            return self.score_margins(scores)
+        if reward == "win":
+            return self.score_wins(scores)
+        raise ValueError(f"Unknown reward {reward}, expected one of {REWARDS}")
+
+    def game_result(self, game_num, reward="score"):
+        """
+        Calculates the current player's reward, see game_results.
+        Doesn't print or change the state, used during MCTS simulations to evaluate game outcomes.
+
+        :param game_num: The game number (used for tracking in simulations)
+        :type game_num: int
+        :param reward: Which reward, one of REWARDS
+        :type reward: str
+        :return: Current player's reward
+        :rtype: float
+        """
+        return self.game_results(reward)[self.current_player_idx]
 
     def print_score(self):
         """
@@ -1472,6 +1743,8 @@ def main():
     # Ask user for number of players and agent types
     print("\nWelcome to Ticket to Ride!")
 
+    gui = load_gui()
+    gui_available = gui is not None
     if gui_available:
         use_gui = input("Do you want to use the GUI? (y/n): ").lower() == "y"
 
@@ -1521,6 +1794,7 @@ def main():
     # Default MCTS parameters (used if not customized)
     default_num_sims = 3000
     default_max_depth = 10
+    default_time_limit = None  # Seconds per move, None to always run every simulation
 
     for i in range(num_players):
         print(f"\nPlayer {i + 1} options:")
@@ -1577,10 +1851,29 @@ def main():
                                         print("Please enter a number between 5 and 50.")
                                 except ValueError:
                                     print("Please enter a valid number.")
+
+                            # Get time limit, the number of simulations becomes the most to run
+                            while True:
+                                try:
+                                    time_limit = float(
+                                        input(
+                                            "Enter time limit per move in seconds, stopping early once it is reached (0 for none, 0-600, default: 0)"
+                                        )
+                                    )
+                                    if 0 <= time_limit <= 600:
+                                        time_limit = time_limit or None
+                                        break
+                                    else:
+                                        print(
+                                            "Please enter a number between 0 and 600."
+                                        )
+                                except ValueError:
+                                    print("Please enter a valid number.")
                         else:
                             # Use default parameters
                             num_sims = default_num_sims
                             max_depth = default_max_depth
+                            time_limit = default_time_limit
                             print(
                                 "Using default MCTS parameters (3000 sims, 10 depth)."
                             )
@@ -1592,14 +1885,18 @@ def main():
 
             # Store MCTS parameters for this player
             player_name = f"Player {i + 1}"
-            mcts_params[player_name] = {"num_sims": num_sims, "max_depth": max_depth}
+            mcts_params[player_name] = {
+                "num_sims": num_sims,
+                "max_depth": max_depth,
+                "time_limit": time_limit,
+            }
 
         # Create player
         player_name = f"Player {i + 1}"
         player = Player(
             name=player_name,
             remaining_trains=45,
-            train_cards={colour: 0 for colour in Colour},
+            train_cards=[0] * NUM_COLOURS,
             destinations=[],
             claimed_connections=[],
             points=0,
@@ -1636,10 +1933,12 @@ def main():
         # Reset players
         for player in players:
             player.remaining_trains = 45
-            player.train_cards = {colour: 0 for colour in Colour}
+            player.train_cards = [0] * NUM_COLOURS
             player.destinations = []
             player.claimed_connections = []
             player.claimed_cities = set()
+            player.route_mask = 0
+            player.longest_route = 0
             player.uf = None
             player.points = 0
             player.turn = 1
@@ -1648,19 +1947,18 @@ def main():
         # Set up and start the game
         game = GameEngine()
         if gui_available and use_gui:
-            initialise_gui()
+            gui.initialise_gui()
         game.map_type = chosen_map_type
         game.init(players)
         game.player_agents = player_agents
         game.agent_options = agent_options
+        mcts_agents = {}  # MCTS agent of each player, kept for the whole game
 
         if gui_available and use_gui:
-            update_game_state(game)  # Populate board
+            gui.update_game_state(game)  # Populate board
             time.sleep(0.5)
         # Main game loop
         while not game.is_end():
-            game.routes_cache_valid = {player.name: False for player in game.players}
-
             current_player = game.players[game.current_player_idx]
             agent_type = player_agents[current_player.name]
 
@@ -1678,6 +1976,8 @@ def main():
             match agent_type:
                 case 1:  # Human Player
                     print("You can type back to go to the previous menu option")
+                    from play import PlayerController
+
                     player = PlayerController(game)
                     best_action = player.play_turn(current_player)
                 case 2:  # MCTS AI
@@ -1686,60 +1986,96 @@ def main():
                         params = mcts_params[current_player.name]
                         num_sims = params["num_sims"]
                         max_depth = params["max_depth"]
+                        time_limit = params["time_limit"]
                         print(
                             f"Using MCTS parameters: {num_sims} simulations, max depth {max_depth}"
+                            + (f", {time_limit}s per move" if time_limit else "")
                         )
                     else:
                         num_sims = default_num_sims
                         max_depth = default_max_depth
+                        time_limit = default_time_limit
 
-                    mcts_player = MCTS(game)
-                    best_action = mcts_player.best_action(num_sims, max_depth)
+                    from mcts import MCTS
+
+                    mcts_player = persistent_agent(
+                        mcts_agents, current_player.name, MCTS, game
+                    )
+                    best_action = mcts_player.best_action(
+                        num_sims, max_depth, time_limit
+                    )
                 case 3:  # MCTS Rollouts AI
                     # Get player-specific MCTS parameters or use defaults
                     if current_player.name in mcts_params:
                         params = mcts_params[current_player.name]
                         num_sims = params["num_sims"]
                         max_depth = params["max_depth"]
+                        time_limit = params["time_limit"]
                         print(
                             f"Using MCTS parameters: {num_sims} simulations, max depth {max_depth}"
+                            + (f", {time_limit}s per move" if time_limit else "")
                         )
                     else:
                         num_sims = default_num_sims
                         max_depth = default_max_depth
+                        time_limit = default_time_limit
+
+                    from mcts_rollouts import MCTS as MCTS_rollouts
 
-                    mcts_player = MCTS_rollouts(game)
-                    best_action = mcts_player.best_action(num_sims, max_depth)
+                    mcts_player = persistent_agent(
+                        mcts_agents, current_player.name, MCTS_rollouts, game
+                    )
+                    best_action = mcts_player.best_action(
+                        num_sims, max_depth, time_limit
+                    )
                 case 4:  # MCTS Selection AI
                     # Get player-specific MCTS parameters or use defaults
                     if current_player.name in mcts_params:
                         params = mcts_params[current_player.name]
                         num_sims = params["num_sims"]
                         max_depth = params["max_depth"]
+                        time_limit = params["time_limit"]
                         print(
                             f"Using MCTS parameters: {num_sims} simulations, max depth {max_depth}"
+                            + (f", {time_limit}s per move" if time_limit else "")
                         )
                     else:
                         num_sims = default_num_sims
                         max_depth = default_max_depth
+                        time_limit = default_time_limit
 
-                    mcts_player = MCTS_selection(game)
-                    best_action = mcts_player.best_action(num_sims, max_depth)
+                    from mcts_selection import MCTS as MCTS_selection
+
+                    mcts_player = persistent_agent(
+                        mcts_agents, current_player.name, MCTS_selection, game
+                    )
+                    best_action = mcts_player.best_action(
+                        num_sims, max_depth, time_limit
+                    )
                 case 5:  # MCTS Untuned AI
                     # Get player-specific MCTS parameters or use defaults
                     if current_player.name in mcts_params:
                         params = mcts_params[current_player.name]
                         num_sims = params["num_sims"]
                         max_depth = params["max_depth"]
+                        time_limit = params["time_limit"]
                         print(
                             f"Using MCTS parameters: {num_sims} simulations, max depth {max_depth}"
+                            + (f", {time_limit}s per move" if time_limit else "")
                         )
                     else:
                         num_sims = default_num_sims
                         max_depth = default_max_depth
+                        time_limit = default_time_limit
+
+                    from mcts_no_heuristics import MCTS as MCTS_no_heuristics
 
-                    mcts_player = MCTS_no_heuristics(game)
-                    best_action = mcts_player.best_action(num_sims, max_depth)
+                    mcts_player = persistent_agent(
+                        mcts_agents, current_player.name, MCTS_no_heuristics, game
+                    )
+                    best_action = mcts_player.best_action(
+                        num_sims, max_depth, time_limit
+                    )
                 case 6:  # Destination Heuristic AI
                     heuristic_player = DestinationHeuristic(game)
                     best_action = heuristic_player.choose_action()
@@ -1758,7 +2094,7 @@ def main():
                     print(
                         f"{current_player.name} has no valid actions and 3 trains left. Ending game."
                     )
-                    current_player.remaining_trains -= 1
+                    game.change_remaining_trains(-1)
                 else:
                     print(f"{current_player.name} has no valid actions. Ending turn.")
                 pass
@@ -1766,7 +2102,7 @@ def main():
             game.apply_action_final(best_action)
             game.update_player_turn()
             if gui_available and use_gui:
-                update_game_state(game, best_action)
+                gui.update_game_state(game, best_action)
             current_player.turn += 1
             tet = time.time()
             print(f"Time taken for turn: {(tet - tst):.4f} seconds")
@@ -1785,7 +2121,7 @@ def main():
         print(f"Time taken: {minutes} minutes and {seconds} seconds")
 
     if gui_available and use_gui:
-        shutdown()
+        gui.shutdown()
 
     # Initialise stats
     player_statistics = {}
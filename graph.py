@@ -1,10 +1,21 @@
-import matplotlib
-import networkx as nx
-
-matplotlib.use("TkAgg")
 import random
 
-import matplotlib.pyplot as plt
+
+def load_plotting():
+    """
+    Imports networkx and matplotlib (with the TkAgg backend) on first use, so importing
+    this module costs nothing until something is drawn.
+
+    :return: The networkx and matplotlib.pyplot modules
+    :rtype: Tuple[module, module]
+    """
+    import matplotlib
+    import networkx as nx
+
+    matplotlib.use("TkAgg")
+    import matplotlib.pyplot as plt
+
+    return nx, plt
 
 
 def visualize_mcts_tree(
@@ -22,6 +33,7 @@ def visualize_mcts_tree(
     :param filename: If provided, save the visualisation to this file
     :type filename: str
     """
+    nx, plt = load_plotting()
     G = nx.DiGraph()
 
     # Add root node
@@ -139,6 +151,7 @@ class TicketToRideVisualiser:
         self.game_state = game_state
 
     def visualise_game_map(self):
+        nx, plt = load_plotting()
         G = nx.Graph()
 
         # Add nodes (cities)
@@ -149,11 +162,12 @@ class TicketToRideVisualiser:
         for city1, connections in self.game_state.routes.items():
             for city2, routes in connections.items():
                 for route in routes:
-                    cb = route.claimed_by if route.claimed_by else "Unclaimed"
+                    owner = self.game_state.route_owner(route)
+                    cb = owner if owner else "Unclaimed"
                     G.add_edge(
                         city1,
                         city2,
-                        colour=route.colour.value,
+                        colour=route.colour.label,
                         length=route.length,
                         claimed_by=cb,
                     )
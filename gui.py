@@ -192,7 +192,7 @@ class TicketToRideGUI:
                                     {
                                         "colour": route.colour,
                                         "length": route.length,
-                                        "claimed_by": route.claimed_by,
+                                        "claimed_by": game.route_owner(route),
                                     }
                                 )
 
@@ -228,7 +228,11 @@ class TicketToRideGUI:
                     "agent_type": agent_type,
                     "points": player.points,
                     "remaining_trains": player.remaining_trains,
-                    "train_cards": dict(player.train_cards),
+                    "train_cards": {
+                        colour: count
+                        for colour, count in zip(Colour, player.train_cards)
+                        if count > 0
+                    },
                     "destinations": list(player.destinations),
                     "claimed_connections": [
                         list(conn) for conn in player.claimed_connections
@@ -291,27 +295,27 @@ class TicketToRideGUI:
             player_name = action[-1]  # Player name is the last element
 
             if action_type == "claim_route":
-                return f"{player_name} claimed route: {action[1]} to {action[2]} with {action[3].value} cards"
+                return f"{player_name} claimed route: {action[1]} to {action[2]} with {action[3].label} cards"
             elif action_type == "draw_two_train_cards":
                 card1 = "deck" if action[2] == "deck" else action[2]
                 card2 = "deck" if action[4] == "deck" else action[4]
 
                 if card1 == Colour.WILD:
-                    return f"{player_name} drew 1 {card1.value}"
+                    return f"{player_name} drew 1 {card1.label}"
                 if card1 == "deck" and card2 == "deck":
                     return f"{player_name} drew 2 cards from deck"
                 elif card1 == "deck":
                     return (
-                        f"{player_name} drew 1 card from deck and 1 {card2.value} card"
+                        f"{player_name} drew 1 card from deck and 1 {card2.label} card"
                     )
                 elif card2 == "deck":
                     return (
-                        f"{player_name} drew 1 {card1.value} card and 1 card from deck"
+                        f"{player_name} drew 1 {card1.label} card and 1 card from deck"
                     )
                 elif card1 == card2:
-                    return f"{player_name} drew 2 {card1.value} cards"
+                    return f"{player_name} drew 2 {card1.label} cards"
                 else:
-                    return f"{player_name} drew 1 {card1.value} card and 1 {card2.value} card"
+                    return f"{player_name} drew 1 {card1.label} card and 1 {card2.label} card"
             elif action_type == "draw_destination_tickets":
                 kept_count = action[1] + action[2] + action[3]
                 return f"{player_name} drew destination tickets and kept {kept_count}"
@@ -0,0 +1,204 @@
+import argparse
+import contextlib
+import importlib
+import os
+import time
+from typing import Dict, List
+
+import console
+from game import REWARDS, GameEngine, persistent_agent
+from helper_classes import NUM_COLOURS, Player
+
+# Agent name -> (module, class). Modules are imported when a game uses the agent, so a run
+# never loads agents (or their dependencies) it doesn't play with.
+AGENTS: Dict[str, tuple] = {
+    "mcts": ("mcts", "MCTS"),
+    "mcts_multi": ("mcts_multi", "MCTS"),
+    "mcts_root_parallel": ("mcts_multi", "RootParallelMCTS"),
+    "mcts_rollouts": ("mcts_rollouts", "MCTS"),
+    "mcts_selection": ("mcts_selection", "MCTS"),
+    "mcts_untuned": ("mcts_no_heuristics", "MCTS"),
+    "destination": ("heuristic_agents", "DestinationHeuristic"),
+    "longest_route": ("heuristic_agents", "LongestRouteHeuristic"),
+    "best_move": ("heuristic_agents", "BestMoveHeuristic"),
+    "random": ("heuristic_agents", "RandomHeuristic"),
+}
+
+
+def load_agent(name: str):
+    """
+    Imports an agent class on first use.
+
+    :param name: Agent name, a key of AGENTS
+    :type name: str
+    :return: The agent class
+    :rtype: type
+    """
+    module_name, class_name = AGENTS[name]
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def play_game(
+    map_type: str,
+    agents: List[str],
+    num_sims: int,
+    max_depth: int,
+    time_limit: float = None,
+    min_sims: int = 1,
+    reward: str = "score",
+) -> List[Player]:
+    """
+    Plays one game between AI agents, following the same turn order as game.main.
+
+    :param map_type: The type of map to be used (USA or Europe)
+    :type map_type: str
+    :param agents: Agent name of each player, in turn order
+    :type agents: List[str]
+    :param num_sims: Number of simulations per move for MCTS agents
+    :type num_sims: int
+    :param max_depth: Maximum rollout depth for MCTS agents
+    :type max_depth: int
+    :param time_limit: Seconds per move for MCTS agents, num_sims is then the most they run
+    :type time_limit: float
+    :param min_sims: Simulations MCTS agents run even past the time limit
+    :type min_sims: int
+    :param reward: Rollout reward for MCTS agents, see GameEngine.game_results
+    :type reward: str
+    :return: The players, scored
+    :rtype: List[Player]
+    """
+    players = [
+        Player(
+            name=f"Player {i + 1}",
+            train_cards=[0] * NUM_COLOURS,
+            destinations=[],
+            claimed_connections=[],
+            claimed_cities=set(),
+        )
+        for i in range(len(agents))
+    ]
+    agent_classes = {
+        player.name: load_agent(agent) for player, agent in zip(players, agents)
+    }
+
+    game = GameEngine()
+    game.map_type = map_type
+    game.init(players)
+    mcts_agents = {}  # Search agents keep their tree between turns
+    while not game.is_end():
+        current_player = game.current_player
+        if current_player.turn == 1:
+            destinations = game.select_initial_destinations(current_player)
+            game.remove_destination_tickets(current_player, destinations)
+
+        agent_class = agent_classes[current_player.name]
+        if hasattr(agent_class, "advance"):
+            agent = persistent_agent(
+                mcts_agents, current_player.name, agent_class, game, reward=reward
+            )
+            best_action = agent.best_action(num_sims, max_depth, time_limit, min_sims)
+        elif hasattr(agent_class, "best_action"):
+            # mcts_multi searches in batches that rarely grow past the root's children,
+            # so there is no tree worth keeping and each turn starts a new search
+            best_action = agent_class(game, reward=reward).best_action(
+                num_sims, max_depth, time_limit, min_sims
+            )
+        else:
+            best_action = agent_class(game).choose_action()
+
+        if best_action is None and current_player.remaining_trains == 3:
+            game.change_remaining_trains(-1)
+        game.apply_action_final(best_action)
+        game.update_player_turn()
+        current_player.turn += 1
+
+    return game.game_result_final(0)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Play Ticket to Ride games between AI agents without the GUI or prompts."
+    )
+    parser.add_argument("--map", choices=["USA", "Europe"], default="USA")
+    parser.add_argument(
+        "--agents",
+        nargs="+",
+        choices=sorted(AGENTS),
+        default=["mcts", "destination"],
+        help="Agent of each player (2-4), in turn order",
+    )
+    parser.add_argument("--games", type=int, default=1)
+    parser.add_argument("--sims", type=int, default=3000)
+    parser.add_argument("--depth", type=int, default=10)
+    parser.add_argument(
+        "--time",
+        type=float,
+        default=None,
+        help="Seconds per MCTS move, --sims is then the most simulations run",
+    )
+    parser.add_argument(
+        "--min-sims",
+        type=int,
+        default=1,
+        help="Simulations run per MCTS move even past --time",
+    )
+    parser.add_argument(
+        "--reward",
+        choices=REWARDS,
+        default="score",
+        help="What MCTS rollouts score: final score, margin over the best opponent or win",
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="Print every action as in game.py"
+    )
+    args = parser.parse_args()
+    if not 2 <= len(args.agents) <= 4:
+        parser.error("--agents takes 2 to 4 agents")
+
+    console.set_live_display(False)
+    wins = [0] * len(args.agents)
+    total_points = [0] * len(args.agents)
+    start = time.time()
+    for game_num in range(args.games):
+        game_start = time.time()
+        if args.verbose:
+            players = play_game(
+                args.map,
+                args.agents,
+                args.sims,
+                args.depth,
+                args.time,
+                args.min_sims,
+                args.reward,
+            )
+        else:
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                players = play_game(
+                    args.map,
+                    args.agents,
+                    args.sims,
+                    args.depth,
+                    args.time,
+                    args.min_sims,
+                    args.reward,
+                )
+
+        scores = ", ".join(
+            f"{player.name} ({agent}): {player.points}"
+            for player, agent in zip(players, args.agents)
+        )
+        print(f"Game {game_num + 1}: {scores} [{time.time() - game_start:.1f}s]")
+        for i, player in enumerate(players):
+            wins[i] += player.winner
+            total_points[i] += player.points
+
+    print(f"\n{args.games} games in {time.time() - start:.1f}s")
+    for i, agent in enumerate(args.agents):
+        print(
+            f"Player {i + 1} ({agent}): {wins[i]} wins, "
+            f"average score {total_points[i] / args.games:.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
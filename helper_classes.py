@@ -1,10 +1,17 @@
+import random
+import time
+from collections import OrderedDict
 from dataclasses import dataclass
-from enum import Enum
-from typing import Dict, List, Set, Tuple
+from enum import IntEnum
+from typing import List, Set, Tuple
 
 
 class UnionFind:
-    """Disjointed set for efficient connectivity checking, modified to use index matrix"""
+    """
+    Disjointed set for efficient connectivity checking, with a city bitset per component.
+    Unions are by rank and fully compress the absorbed component's paths using its bitset,
+    so every parent entry points straight at its root and a find is a single lookup.
+    """
 
     def __init__(self, cities):
         """
@@ -17,72 +24,85 @@ class UnionFind:
         self.city_to_idx = {city: i for i, city in enumerate(cities)}
         self.n = len(cities)
 
-        # Initialize direct connectivity matrix (n*n boolean matrix)
-        self.connected = [[False for _ in range(self.n)] for _ in range(self.n)]
+        # Standard Union-Find parent array for tracking components, ranks for union by rank
+        self.parent = list(range(self.n))
+        self.rank = [0] * self.n
 
-        # Set diagonal to True (each city is connected to itself)
-        for i in range(self.n):
-            self.connected[i][i] = True
+        # Bitset of the cities in each component, only kept up to date at the roots
+        self.members = [1 << i for i in range(self.n)]
 
-        # Standard Union-Find parent array for tracking components
-        self.parent = list(range(self.n))
+    def clone(self):
+        """
+        Copies the connectivity state without replaying any unions.
+        The city index mapping is immutable so it is shared with the clone.
+
+        :return: An independent copy of this UnionFind
+        :rtype: UnionFind
+        """
+        new_uf = UnionFind.__new__(UnionFind)
+        new_uf.city_to_idx = self.city_to_idx
+        new_uf.n = self.n
+        new_uf.parent = self.parent[:]
+        new_uf.rank = self.rank[:]
+        new_uf.members = self.members[:]
+        return new_uf
 
     def find_idx(self, idx):
         """
-        Finds an id.
+        Finds the root of a city's component.
 
         :param idx: The index of the city to find
         :type idx: int
+        :return: Index of the component's root
+        :rtype: int
         """
-        if self.parent[idx] != idx:
-            self.parent[idx] = self.find_idx(self.parent[idx])
         return self.parent[idx]
 
     def union(self, city1, city2):
         """
-        Union two cities and updates the connectivity matrix.
+        Union two cities, attaching the lower ranked root under the higher one.
 
         :param city1: The first city to union
         :type city1: str
         :param city2: The second city to union
         :type city2: str
+        :return: True if two components were merged, False if already connected
+        :rtype: bool
+        """
+        root1 = self.find_idx(self.city_to_idx[city1])
+        root2 = self.find_idx(self.city_to_idx[city2])
+        if root1 == root2:
+            return False
+
+        if self.rank[root1] < self.rank[root2]:
+            root1, root2 = root2, root1
+        if self.rank[root1] == self.rank[root2]:
+            self.rank[root1] += 1
+
+        # Compress every path in the absorbed component straight to the new root
+        parent = self.parent
+        absorbed = self.members[root2]
+        while absorbed:
+            low = absorbed & -absorbed
+            parent[low.bit_length() - 1] = root1
+            absorbed ^= low
+        self.members[root1] |= self.members[root2]
+        return True
+
+    def component_mask(self, city):
+        """
+        Bitset of every city (by index) in the same component as a city.
+
+        :param city: The city to look up
+        :type city: str
+        :return: Bitset with bit i set for each connected city index i
+        :rtype: int
         """
-        idx1 = self.city_to_idx[city1]
-        idx2 = self.city_to_idx[city2]
-
-        root1 = self.find_idx(idx1)
-        root2 = self.find_idx(idx2)
-
-        if root1 != root2:
-            # Find all cities in each component
-            comp1 = set()
-            comp2 = set()
-            for i in range(self.n):
-                i_root = self.find_idx(i)
-                if i_root == root1:
-                    comp1.add(i)
-                elif i_root == root2:
-                    comp2.add(i)
-
-            # Merge the smaller component into the larger one
-            if len(comp1) < len(comp2):
-                self.parent[root1] = root2
-                # Update connectivity matrix for all city pairs
-                for i in comp1:
-                    for j in comp2:
-                        self.connected[i][j] = True
-                        self.connected[j][i] = True
-            else:
-                self.parent[root2] = root1
-                # Update connectivity matrix for all city pairs
-                for i in comp2:
-                    for j in comp1:
-                        self.connected[i][j] = True
-                        self.connected[j][i] = True
+        return self.members[self.parent[self.city_to_idx[city]]]
 
     def is_connected(self, city1, city2):
         """
-        O(1) connectivity check between two cities.
+        O(1) connectivity check between two cities, parents always point at the root.
 
         :param city1: The first city to check
         :type city1: str
@@ -91,12 +111,118 @@ class UnionFind:
         :return: True if the cities are connected, False otherwise
         :rtype: bool
         """
-        idx1 = self.city_to_idx[city1]
-        idx2 = self.city_to_idx[city2]
-        return self.connected[idx1][idx2]
+        parent = self.parent
+        city_to_idx = self.city_to_idx
+        return parent[city_to_idx[city1]] == parent[city_to_idx[city2]]
 
 
-@dataclass
+class LRUCache:
+    """Dictionary bounded to a maximum size, evicting the least recently used entry"""
+
+    def __init__(self, max_size: int):
+        """
+        Create an empty cache.
+
+        :param max_size: Maximum number of entries kept
+        :type max_size: int
+        """
+        self.max_size = max_size
+        self.entries = OrderedDict()
+
+    def get(self, key, default=None):
+        """
+        Looks up a key, marking it as recently used.
+
+        :param key: The key to look up
+        :return: The stored value, or default if the key is not cached
+        """
+        value = self.entries.get(key, default)
+        if value is not default:
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        """
+        Stores a value, evicting the least recently used entry if the cache is full.
+
+        :param key: The key to store under
+        :param value: The value to store
+        """
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        """Removes every entry."""
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+
+class SearchBudget:
+    """
+    When an MCTS search stops: after a fixed number of simulations, or once a wall-clock
+    time limit has passed, with a minimum and maximum number of simulations either side.
+    """
+
+    def __init__(
+        self, max_simulations: int, time_limit: float = None, min_simulations: int = 1
+    ):
+        """
+        Start the clock for a search.
+
+        :param max_simulations: Simulations to run, the most to run with a time limit
+        :type max_simulations: int
+        :param time_limit: Seconds to search for, None to run max_simulations
+        :type time_limit: float
+        :param min_simulations: Simulations to run even if the time limit has passed
+        :type min_simulations: int
+        """
+        self.max_simulations = max_simulations
+        self.min_simulations = min(min_simulations, max_simulations)
+        self.start = time.perf_counter()
+        self.deadline = None if time_limit is None else self.start + time_limit
+
+    def done(self, completed: int) -> bool:
+        """
+        :param completed: Simulations run so far
+        :type completed: int
+        :return: True if the search should stop
+        :rtype: bool
+        """
+        if completed >= self.max_simulations:
+            return True
+        if self.deadline is None or completed < self.min_simulations:
+            return False
+        return time.perf_counter() >= self.deadline
+
+    def batch_size(self, completed: int, batch_size: int) -> int:
+        """
+        Size of the next batch of simulations run together, keeping within the maximum
+        and (going by the time per simulation so far) the time limit.
+
+        :param completed: Simulations run so far
+        :type completed: int
+        :param batch_size: Largest batch wanted
+        :type batch_size: int
+        :return: Number of simulations in the next batch, at least 1
+        :rtype: int
+        """
+        size = min(batch_size, self.max_simulations - completed)
+        if self.deadline is not None and completed > 0:
+            now = time.perf_counter()
+            per_simulation = (now - self.start) / completed
+            fits = int((self.deadline - now) / per_simulation)
+            size = min(size, max(fits, self.min_simulations - completed))
+        return max(1, size)
+
+
+@dataclass(frozen=True)
 class Destination:
     """Destination class to store destination cities and points"""
 
@@ -105,24 +231,132 @@ class Destination:
     points: int
 
 
-class Colour(Enum):
+class Colour(IntEnum):
     """
     Enum class to store the colours of the routes and train cards.
+    Colours are small ints so hands and decks can be indexed by colour directly.
 
-    :param Enum: Enum class
-    :type Enum: Enum
+    :param IntEnum: IntEnum class
+    :type IntEnum: IntEnum
     """
 
-    RED = "Red"
-    BLUE = "Blue"
-    GREEN = "Green"
-    YELLOW = "Yellow"
-    BLACK = "Black"
-    ORANGE = "Orange"
-    WHITE = "White"
-    PINK = "Pink"
-    GRAY = "Gray"
-    WILD = "Wild"
+    RED = 0
+    BLUE = 1
+    GREEN = 2
+    YELLOW = 3
+    BLACK = 4
+    ORANGE = 5
+    WHITE = 6
+    PINK = 7
+    GRAY = 8
+    WILD = 9
+
+    @property
+    def label(self) -> str:
+        """Display name of the colour, e.g. "Red"."""
+        return self.name.capitalize()
+
+
+COLOURS: List[Colour] = list(Colour)  # Colour by index
+NUM_COLOURS: int = len(COLOURS)
+CARD_COLOURS: List[Colour] = COLOURS[: Colour.GRAY]  # Colours a gray route can take
+
+
+class TrainDeck:
+    """
+    Pile of train cards held as a count per colour rather than a list of cards.
+    The order is never stored: each draw samples a colour weighted by the remaining
+    counts, which is equivalent to drawing from a shuffled deck, and copying is one slice.
+    """
+
+    def __init__(self, counts: List[int] = None):
+        """
+        Create a pile from per-colour counts (empty by default).
+
+        :param counts: Number of cards of each colour, indexed by Colour
+        :type counts: List[int]
+        """
+        self.counts = counts if counts is not None else [0] * NUM_COLOURS
+        self.size = sum(self.counts)
+        self.top = None  # Next card to be drawn, once sampled by peek()
+
+    def __len__(self):
+        return self.size
+
+    def __repr__(self):
+        return f"TrainDeck({self.counts})"
+
+    def copy(self):
+        """
+        :return: An independent copy of this pile, including a sampled top card
+        :rtype: TrainDeck
+        """
+        new_deck = TrainDeck.__new__(TrainDeck)
+        new_deck.counts = self.counts[:]
+        new_deck.size = self.size
+        new_deck.top = self.top
+        return new_deck
+
+    def add(self, colour: Colour, count: int = 1):
+        """
+        Adds cards of one colour to the pile.
+
+        :param colour: Colour of the cards
+        :type colour: Colour
+        :param count: Number of cards to add
+        :type count: int
+        """
+        self.counts[colour] += count
+        self.size += count
+
+    def merge(self, other: "TrainDeck"):
+        """
+        Adds every card of another pile to this one (e.g. reshuffling the discards in).
+
+        :param other: The pile to add
+        :type other: TrainDeck
+        """
+        counts = self.counts
+        for colour, count in enumerate(other.counts):
+            counts[colour] += count
+        self.size += other.size
+
+    def clear(self):
+        """Removes every card."""
+        self.counts = [0] * NUM_COLOURS
+        self.size = 0
+        self.top = None
+
+    def peek(self) -> Colour:
+        """
+        Returns the card the next pop() will draw without drawing it.
+
+        :return: The next card
+        :rtype: Colour
+        """
+        if self.top is None:
+            if self.size == 0:
+                raise IndexError("peek from empty deck")
+            r = random.randrange(self.size)
+            for colour, count in enumerate(self.counts):
+                if r < count:
+                    self.top = COLOURS[colour]
+                    break
+                r -= count
+        return self.top
+
+    def pop(self) -> Colour:
+        """
+        Draws a card.
+
+        :return: The drawn card
+        :rtype: Colour
+        """
+        card = self.peek()
+        self.top = None
+        self.counts[card] -= 1
+        self.size -= 1
+        return card
 
 
 @dataclass
@@ -131,7 +365,7 @@ class Player:
 
     name: str
     remaining_trains: int = 45
-    train_cards: Dict[Colour, int] = None
+    train_cards: List[int] = None  # Card count indexed by Colour
     destinations: List[Destination] = None
     claimed_connections: List[Tuple[str, str, Colour]] = None
     claimed_cities: Set[str] = None
@@ -140,6 +374,8 @@ class Player:
     winner: bool = False
     wins: int = 0
     uf: UnionFind = None
+    route_mask: int = 0  # Bitmask of claimed route ids
+    longest_route: int = 0  # Longest continuous route, kept up to date on claims
 
 
 @dataclass
@@ -148,24 +384,33 @@ class Route:
 
     length: int
     colour: Colour
-    claimed_by: str = None
     tunnel: bool = False
     num_locomotives: int = 0
+    route_id: int = None  # Index in the map's route list, set by MapTopology
 
-    def claim(self, player: str):
-        """
-        Sets the route to claimed
 
-        :param player: The name of the player who claimed the route
-        :type player: str
-        """
-        self.claimed_by = player
-
-    def is_claimed(self) -> bool:
-        """
-        Checks if the route is claimed
+@dataclass
+class UndoRecord:
+    """
+    Dataclass to store what GameEngine.make_action changed, so that
+    GameEngine.unmake_action can restore the state exactly.
+    """
 
-        :return: True if the route is claimed, False otherwise
-        :rtype: bool
-        """
-        return self.claimed_by is not None
+    player_idx: int
+    most_recent_hits: int
+    train_deck: TrainDeck
+    discard_deck: TrainDeck
+    face_up_cards: List[Colour]
+    train_cards: List[int]
+    points: int
+    remaining_trains: int
+    num_destinations: int
+    num_connections: int
+    claimed_mask: int
+    route_mask: int
+    longest_route: int
+    destination_deck: List[Destination] = None
+    destination_discard_deck: List[Destination] = None
+    added_cities: List[str] = None
+    uf: UnionFind = None
+    result: bool = None
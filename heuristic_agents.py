@@ -59,10 +59,10 @@ class BestMoveHeuristic:
 
     def choose_action(self):
         player = self.game_state.current_player
-        player.train_cards[Colour.WILD] += 50
+        # Go through the engine so the claim index sees the change and its reversal
+        self.game_state.change_train_cards(Colour.WILD, 50)
         best_actions = self.game_state.get_legal_actions()
-        player.train_cards[Colour.WILD] -= 50
-        self.game_state.routes_cache_valid[player.name] = False
+        self.game_state.change_train_cards(Colour.WILD, -50)
         actions = self.game_state.get_legal_actions()
 
         if not actions:
@@ -105,13 +105,17 @@ class BestMoveHeuristic:
                 return check_all_colours[0]
             # Otherwise, attempt to draw cards that help make it affordable
             else:
-                colour_needed = best_route[5].colour
+                colour_needed = self.game_state.topology.route_list[
+                    best_route[5]
+                ].colour
                 card_actions = [a for a in actions if a[0] == "draw_two_train_cards"]
                 if card_actions:
                     # If it's a gray route, draw the colour that the player has most of
                     if colour_needed == Colour.GRAY:
                         top_colours = sorted(
-                            player.train_cards, key=player.train_cards.get, reverse=True
+                            Colour,
+                            key=player.train_cards.__getitem__,
+                            reverse=True,
                         )
                         max_colour = top_colours[0]
                         max_colour_2 = top_colours[1]
@@ -177,16 +181,11 @@ class LongestRouteHeuristic:
                 # Check if route is on any destination's optimal path
                 for dest in player.destinations:
                     if not player.uf.is_connected(dest.city1, dest.city2):
-                        optimal_path = self.game_state.fw.get_path(
-                            dest.city1, dest.city2
-                        )
-
                         # Check if both cities are on the optimal path and adjacent
-                        if city1 in optimal_path and city2 in optimal_path:
-                            idx1 = optimal_path.index(city1)
-                            idx2 = optimal_path.index(city2)
-                            if abs(idx1 - idx2) == 1:
-                                score += 50 + dest.points
+                        if self.game_state.fw.is_path_edge(
+                            dest.city1, dest.city2, city1, city2
+                        ):
+                            score += 50 + dest.points
 
                 # Base score is route length
                 score += route_length
@@ -213,52 +212,8 @@ class LongestRouteHeuristic:
         return random.choice(actions)
 
     def find_longest_path(self, player):
-        """Find the longest path in player's network and its end cities"""
-        if not player.claimed_connections:
-            return [], set()
-
-        # Build adjacency list of player's network
-        network = {}
-        for city1, city2, _ in player.claimed_connections:
-            if city1 not in network:
-                network[city1] = []
-            if city2 not in network:
-                network[city2] = []
-            network[city1].append(city2)
-            network[city2].append(city1)
-
-        # Find longest path using DFS from each city
-        longest_path = []
-
-        for start_city in network:
-            for path in self.dfs_paths(network, start_city):
-                if len(path) > len(longest_path):
-                    longest_path = path
-
-        # Get end cities (first and last city in the path)
-        end_cities = set()
-        if longest_path:
-            end_cities.add(longest_path[0])
-            end_cities.add(longest_path[-1])
-
-        return end_cities
-
-    def dfs_paths(self, network, start, path=None):
-        """Find all paths from start using DFS"""
-        if path is None:
-            path = [start]
-
-        # Yield the current path if it's a dead end
-        if (
-            len(path) > 1
-            and len([city for city in network[path[-1]] if city not in path]) == 0
-        ):
-            yield path
-
-        # Continue DFS
-        for next_city in network[path[-1]]:
-            if next_city not in path:
-                yield from self.dfs_paths(network, start, path + [next_city])
+        """Find the end cities of the longest path (by number of routes) in player's network"""
+        return self.game_state.topology.longest_trail_ends(player.route_mask)
 
 
 class RandomHeuristic:
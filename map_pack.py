@@ -0,0 +1,299 @@
+import hashlib
+import mmap
+import os
+import struct
+import sys
+from array import array
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+from helper_classes import Colour, Destination, Route
+
+# Compiled packs are saved here, one file per map type and version of the map data
+PACK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".map_packs")
+MAP_DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "map_data.py")
+FORMAT_VERSION = 1
+
+# magic, format version, cities, routes, destinations, city names length (bytes)
+HEADER = struct.Struct("<4sHHHHI")
+MAGIC = b"TTRM"
+ROUTE_FIELDS = 6  # city1, city2, length, colour, tunnel, num_locomotives
+DESTINATION_FIELDS = 3  # city1, city2, points
+UNREACHABLE = -1  # Distance stored for unconnected city pairs
+
+
+@dataclass
+class MapPack:
+    """
+    Everything MapTopology needs from the map data, in a compact packed form.
+
+    File layout (native byte order, all arrays int16):
+        header: See HEADER
+        city_names: Sorted city names, UTF-8 joined by newlines
+        routes: ROUTE_FIELDS per route, in route id order
+        destinations: DESTINATION_FIELDS per destination ticket
+        dist: Shortest distance between every pair of cities, row major
+        next: Next city on the shortest path between every pair of cities, row major
+    """
+
+    city_names: List[str]
+    routes: List[
+        Tuple[int, int, Route]
+    ]  # (city1 index, city2 index, route) by route id
+    destinations: List[Destination]
+    dist: List[List[float]]  # Infinity for unconnected pairs
+    next: List[List[int]]
+
+    def to_bytes(self) -> bytes:
+        """
+        :return: The packed map
+        :rtype: bytes
+        """
+        names = "\n".join(self.city_names).encode("utf-8")
+        routes = array(
+            "h",
+            [
+                field
+                for city1, city2, route in self.routes
+                for field in (
+                    city1,
+                    city2,
+                    route.length,
+                    route.colour,
+                    route.tunnel,
+                    route.num_locomotives,
+                )
+            ],
+        )
+        city_to_idx = {city: i for i, city in enumerate(self.city_names)}
+        destinations = array(
+            "h",
+            [
+                field
+                for destination in self.destinations
+                for field in (
+                    city_to_idx[destination.city1],
+                    city_to_idx[destination.city2],
+                    destination.points,
+                )
+            ],
+        )
+        dist = array(
+            "h",
+            [
+                UNREACHABLE if d == float("inf") else int(d)
+                for row in self.dist
+                for d in row
+            ],
+        )
+        nxt = array("h", [k for row in self.next for k in row])
+        header = HEADER.pack(
+            MAGIC,
+            FORMAT_VERSION,
+            len(self.city_names),
+            len(self.routes),
+            len(self.destinations),
+            len(names),
+        )
+        return b"".join(
+            [
+                header,
+                names,
+                routes.tobytes(),
+                destinations.tobytes(),
+                dist.tobytes(),
+                nxt.tobytes(),
+            ]
+        )
+
+    @classmethod
+    def from_buffer(cls, buffer) -> "MapPack":
+        """
+        Unpacks a map from a buffer (bytes or a memory map).
+        Every table is copied out and each view of the buffer released before returning,
+        so the pack holds no reference to the buffer and the caller can close it straight
+        away. Views are released explicitly rather than left to reference counting, which
+        PyPy does not have, because a memory map with views still open cannot be closed.
+
+        :param buffer: The packed map
+        :type buffer: bytes or mmap.mmap
+        :raises ValueError: If the buffer is not a pack of this format version
+        :return: The unpacked map
+        :rtype: MapPack
+        """
+        with memoryview(buffer) as view:
+            if len(view) < HEADER.size:
+                raise ValueError("Map pack is truncated")
+            magic, version, n, num_routes, num_destinations, names_size = (
+                HEADER.unpack_from(view)
+            )
+            if magic != MAGIC or version != FORMAT_VERSION:
+                raise ValueError("Not a map pack of this version")
+
+            sizes = [
+                num_routes * ROUTE_FIELDS,
+                num_destinations * DESTINATION_FIELDS,
+                n * n,
+                n * n,
+            ]
+            offset = HEADER.size + names_size
+            if len(view) != offset + sum(sizes) * array("h").itemsize:
+                raise ValueError("Map pack is truncated")
+            with view[HEADER.size : offset] as names:
+                city_names = bytes(names).decode("utf-8").split("\n")
+            tables = []
+            for size in sizes:
+                table = array("h")
+                with view[offset : offset + size * table.itemsize] as chunk:
+                    table.frombytes(chunk)
+                offset += size * table.itemsize
+                tables.append(table.tolist())
+        route_table, destination_table, dist, nxt = tables
+
+        routes = []
+        for r in range(0, len(route_table), ROUTE_FIELDS):
+            city1, city2, length, colour, tunnel, num_locomotives = route_table[
+                r : r + ROUTE_FIELDS
+            ]
+            route = Route(length, Colour(colour), bool(tunnel), num_locomotives)
+            routes.append((city1, city2, route))
+        destinations = [
+            Destination(city_names[city1], city_names[city2], points)
+            for city1, city2, points in zip(
+                destination_table[0::DESTINATION_FIELDS],
+                destination_table[1::DESTINATION_FIELDS],
+                destination_table[2::DESTINATION_FIELDS],
+            )
+        ]
+        INF = float("inf")
+        return cls(
+            city_names=city_names,
+            routes=routes,
+            destinations=destinations,
+            dist=[
+                [INF if d == UNREACHABLE else d for d in dist[i : i + n]]
+                for i in range(0, n * n, n)
+            ],
+            next=[nxt[i : i + n] for i in range(0, n * n, n)],
+        )
+
+
+def map_data_key() -> str:
+    """
+    Hash naming the packs built from the current map data, so editing map_data.py
+    (or the pack format) compiles new packs rather than loading stale ones.
+
+    :return: Hex digest of map_data.py, the format version and the byte order
+    :rtype: str
+    """
+    digest = hashlib.sha1()
+    with open(MAP_DATA_PATH, "rb") as f:
+        digest.update(f.read())
+    digest.update(f"{FORMAT_VERSION}-{sys.byteorder}".encode())
+    return digest.hexdigest()[:16]
+
+
+def pack_path(map_type: str) -> str:
+    """
+    :param map_type: The type of map (USA or Europe)
+    :type map_type: str
+    :return: Path of the compiled pack for the current map data
+    :rtype: str
+    """
+    return os.path.join(PACK_DIR, f"{map_type}_{map_data_key()}.bin")
+
+
+def compile_map(map_type: str) -> MapPack:
+    """
+    Builds the pack for a map from map_data.MapData.
+
+    Map data lists every route in both directions as separate objects, only one canonical
+    list per city pair is kept (the alphabetical direction wins when they disagree).
+    Routes are numbered in upper triangle order of the sorted cities, which is the
+    route id order MapTopology uses.
+
+    :param map_type: The type of map (USA or Europe)
+    :type map_type: str
+    :return: The compiled map
+    :rtype: MapPack
+    """
+    # Only needed to compile, so loading a pack doesn't import the map data or solver
+    from fw import FloydWarshall
+    from map_data import MapData
+
+    map_data = MapData(map_type)
+    raw_routes = map_data.get_routes()
+    city_names = sorted(
+        set(raw_routes.keys())
+        | {city for connections in raw_routes.values() for city in connections}
+    )
+    city_to_idx = {city: i for i, city in enumerate(city_names)}
+
+    route_pairs: Dict[Tuple[str, str], List[Route]] = {}
+    for city1, connections in raw_routes.items():
+        for city2, routes_list in connections.items():
+            key = (city1, city2) if city1 < city2 else (city2, city1)
+            if key not in route_pairs or city1 < city2:
+                route_pairs[key] = routes_list
+
+    routes = []
+    canonical_routes: Dict[str, Dict[str, List[Route]]] = {}
+    for city1, city2 in sorted(
+        route_pairs, key=lambda k: (city_to_idx[k[0]], city_to_idx[k[1]])
+    ):
+        routes_list = route_pairs[(city1, city2)]
+        for route in routes_list:
+            routes.append((city_to_idx[city1], city_to_idx[city2], route))
+        canonical_routes.setdefault(city1, {})[city2] = routes_list
+        canonical_routes.setdefault(city2, {})[city1] = routes_list
+
+    fw = FloydWarshall(canonical_routes)
+    return MapPack(
+        city_names=city_names,
+        routes=routes,
+        destinations=map_data.get_destinations() or [],
+        dist=fw.dist,
+        next=fw.next,
+    )
+
+
+def load_map(map_type: str) -> MapPack:
+    """
+    Loads the pack for a map in one memory-mapped read, compiling and saving it first
+    if there is none for the current map data.
+
+    :param map_type: The type of map (USA or Europe)
+    :type map_type: str
+    :return: The map
+    :rtype: MapPack
+    """
+    path = pack_path(map_type)
+    try:
+        with open(path, "rb") as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as buffer:
+            return MapPack.from_buffer(buffer)
+    except (OSError, ValueError):
+        pass
+
+    pack = compile_map(map_type)
+    try:
+        os.makedirs(PACK_DIR, exist_ok=True)
+        # Write then rename so a concurrent reader never sees a partial file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(pack.to_bytes())
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+    return pack
+
+
+if __name__ == "__main__":
+    for map_type in ("USA", "Europe"):
+        pack = compile_map(map_type)
+        path = pack_path(map_type)
+        os.makedirs(PACK_DIR, exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(pack.to_bytes())
+        print(f"Compiled {map_type} map to {path}")
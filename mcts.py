@@ -1,179 +1,317 @@
 import math
 import random
+from array import array
 
 from console import LiveConsole, is_pypy
+from helper_classes import LRUCache, SearchBudget
 from heuristic_agents import DestinationHeuristic
+from mcts_tree import NO_NODE, TreeStore
 
-# from graph import visualize_mcts_tree as viz_mcts
+# Action types, expand picks one uniformly before picking an action of that type
+ACTION_TYPES = ("draw_two_train_cards", "claim_route", "draw_destination_tickets")
 
 
-class MCTSNode:
-    def __init__(self, state, parent=None, action=None):
-        self.state = state
-        self.parent = parent
-        self.action = action
-        self.action_type = action[0] if action else None
-        self.children = []
-        self.visits = 0
-        self.value = 0.0
+class TranspositionTable:
+    """
+    Visit and value totals shared by every node where the agent holds the same routes, hand
+    and destination tickets (see GameEngine.info_set_key). Nodes only differ below that in
+    sampled opponent moves and draws, so their results are pooled. Bounded, the least
+    recently used entries are evicted.
+    """
 
-    def is_fully_expanded(self):
-        possible_actions = self.state.get_legal_actions()
+    def __init__(self, max_entries=100000):
+        self.entries = LRUCache(max_entries)
 
-        const = 2  # Can modify exploration constant
-        max_children = int(math.ceil(const * math.sqrt(self.visits)))
-        return len(self.children) >= min(len(possible_actions), max_children)
+    def lookup(self, key):
+        # [visits, value] for the information set, or None if it has not been seen
+        return self.entries.get(key)
 
-    def expand(self):
-        # Get all possible actions from the current state
-        possible_actions = self.state.get_legal_actions()
-        if len(possible_actions) == 0:
-            return None
-        # Filter out actions that have already been tried (i.e., have corresponding child nodes)
-        untried_actions = [
-            action
-            for action in possible_actions
-            if action not in [child.action for child in self.children]
-        ]
-        if len(untried_actions) == 0:
-            return None
+    def update(self, key, result):
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = [0, 0.0]
+            self.entries.put(key, entry)
+        entry[0] += 1
+        entry[1] += result
 
-        # Split actions into their respective types to make random selection fair
-        random_type = random.choice(
-            ["draw_two_train_cards", "claim_route", "draw_destination_tickets"]
-        )
-        action_type = [action for action in untried_actions if action[0] == random_type]
-        if not action_type:
-            action_type = untried_actions
-        # MCTS agent plays a move
-        action = random.choice(action_type)
-        child_state = self.state.copy()
-        child_state.apply_action(action)
-        current_player = child_state.current_player
-
-        for player in child_state.players:
-            # Cycle all players
-            child_state.switch_turn()
-            if child_state.current_player.name != current_player.name:
-                # Opponents play immediately after
-                opponent_actions = child_state.get_legal_actions()
-                if opponent_actions:
-                    opponent_action = random.choice(opponent_actions)
-                    child_state.apply_action(opponent_action)
-
-        child_node = MCTSNode(child_state, parent=self, action=action)
-        self.children.append(child_node)
-        return child_node
-
-    def best_child(self, c_param=1.4):
-        if not self.children:
-            return None
 
-        choices_weights = []
+class MCTS:
+    def __init__(
+        self, game_state, table_size=100000, state_cache_size=256, reward="score"
+    ):
+        self.reward = reward  # Rollout reward, see GameEngine.game_results
+        # Kept across turns, see advance
+        self.table = TranspositionTable(table_size)
+        # Nodes are ids into the tree store, see mcts_tree.TreeStore
+        self.tree = TreeStore()
+        self.root = self.tree.add_root()
+        self.game_state = game_state  # The real game, actions are returned for it
+        # Searched on a copy, so the states below the root can still be replayed from it
+        # after the real game has moved on
+        self.root_state = self.search_copy(game_state)
+        self.tree.key[self.root] = self.root_state.info_set_key()
+        # Node states by serial, the rest are rebuilt when needed, see state()
+        self.states = LRUCache(state_cache_size)
+        self.console = None if is_pypy else LiveConsole()
+        self.played = NO_NODE  # Root child of the last action returned, see advance
+
+    def state(self, node):
+        # Nodes only keep their action and seed, a state evicted from the cache is rebuilt
+        # by replaying them from the nearest ancestor whose state is still cached
+        if node == self.root:
+            return self.root_state
+        tree = self.tree
+        serial = tree.serial
+        state = self.states.get(serial[node])
+        if state is not None:
+            return state
+
+        path = []
+        while state is None:
+            path.append(node)
+            node = tree.parent[node]
+            if node == self.root:
+                state = self.root_state
+            else:
+                state = self.states.get(serial[node])
+        for node in reversed(path):
+            state = self.replay(state, tree.action_id[node], tree.seed[node])
+            self.states.put(serial[node], state)
+        return state
+
+    def replay(self, state, action_id, seed):
+        # Plays the agent's action and one sampled move per opponent on a copy of the
+        # parent's state. Every chance outcome (deck draws, tunnel hits, destination
+        # reshuffles and the sampled opponent moves) comes from the seed, so replaying
+        # rebuilds exactly the state the node was expanded with
+        saved = random.getstate()
+        random.seed(seed)
+        try:
+            child_state = state.copy()
+            child_state.apply_action(child_state.decode_action(action_id))
+            current_player = child_state.current_player
 
-        # Get number of incomplete destination tickets for distance biasing
-        num_incomplete = 0
-        if hasattr(self.state, "check_all_destinations"):
-            results = self.state.check_all_destinations(self.state.current_player)
-            num_incomplete = sum(1 for dest in results if dest[1] == False)
+            for player in child_state.players:
+                # Cycle all players
+                child_state.switch_turn()
+                if child_state.current_player.name != current_player.name:
+                    # Opponents play immediately after
+                    opponent_actions = child_state.get_legal_actions()
+                    if opponent_actions:
+                        opponent_action = random.choice(opponent_actions)
+                        child_state.apply_action(opponent_action)
+
+            # Fix the top card too, it is part of the node's legal draw actions
+            if len(child_state.train_deck) > 0:
+                child_state.train_deck.peek()
+        finally:
+            random.setstate(saved)
+        return child_state
+
+    def search_copy(self, game_state):
+        # Draw indices only name slots, a draw of the same slot twice takes the top card.
+        # It is fixed before copying so the real game and the searched copy share it, and
+        # a root draw decoded from the copy takes the same cards in the real game
+        if len(game_state.train_deck) > 0:
+            game_state.train_deck.peek()
+        return game_state.copy()
+
+    def action(self, node):
+        # Rebuild the action leading to a node from the state it was searched from
+        tree = self.tree
+        return self.state(tree.parent[node]).decode_action(tree.action_id[node])
+
+    def init_actions(self, node):
+        # A node's state is always rewound to the same position, so its legal actions are
+        # generated once and kept as action ids bucketed by type for expand
+        tree = self.tree
+        state = self.state(node)
+        encode_action = state.encode_action
+        tried = {tree.action_id[child] for child in tree.children(node)}
+        possible_actions = state.get_legal_actions()
+        untried = {action_type: array("i") for action_type in ACTION_TYPES}
+        for action in possible_actions:
+            action_id = encode_action(action)
+            if action_id not in tried:
+                untried[action[0]].append(action_id)
+        tree.untried[node] = untried
+        tree.num_actions[node] = len(possible_actions)
+        player = state.current_player
+        tree.num_incomplete[node] = sum(
+            1
+            for dest in player.destinations
+            if not player.uf.is_connected(dest.city1, dest.city2)
+        )
+        tree.num_untried[node] = sum(map(len, untried.values()))
 
-        for child in self.children:
-            if child.visits == 0:
-                choices_weights.append(float("inf"))
-            else:
-                # Base UCT score
-                uct_score = (child.value / child.visits) + c_param * math.sqrt(
-                    (2 * math.log(self.visits) / child.visits)
-                )
+    def is_fully_expanded(self, node):
+        tree = self.tree
+        if tree.untried[node] is None:
+            self.init_actions(node)
 
+        const = 2  # Can modify exploration constant
+        max_children = int(math.ceil(const * math.sqrt(tree.visits[node])))
+        return tree.num_children[node] >= min(tree.num_actions[node], max_children)
+
+    def expand(self, node):
+        tree = self.tree
+        if tree.untried[node] is None:
+            self.init_actions(node)
+        num_untried = tree.num_untried[node]
+        if num_untried == 0:
+            return None
+
+        # Split actions into their respective types to make random selection fair
+        pools = tree.untried[node]
+        untried = pools[random.choice(ACTION_TYPES)]
+        if untried:
+            idx = random.randrange(len(untried))
+        else:
+            # None of that type left, pick from every untried action
+            idx = random.randrange(num_untried)
+            for untried in pools.values():
+                if idx < len(untried):
+                    break
+                idx -= len(untried)
+        # MCTS agent plays a move, swap removed from the untried pool
+        action_id = untried[idx]
+        untried[idx] = untried[-1]
+        untried.pop()
+        tree.num_untried[node] = num_untried - 1
+        state = self.state(node)
+        action = state.decode_action(action_id)
+        seed = random.getrandbits(64)
+        child_state = self.replay(state, action_id, seed)
+
+        child = tree.add_child(node, action_id, tree.num_actions[node])
+        tree.seed[child] = seed
+        tree.key[child] = child_state.info_set_key()
+        self.states.put(tree.serial[child], child_state)
+        tree.prior[child] = self.action_bias(node, action)
+        return child
+
+    def action_bias(self, node, action):
+        # Heuristic bias added to a child's UCT score. It only depends on this node's state
+        # and the child's action, so it is worked out once when the child is expanded
+        state = self.state(node)
+        player = state.current_player
+        num_incomplete = self.tree.num_incomplete[node]
+        match action[0]:
+            case "claim_route" if num_incomplete > 0:
                 # Add bias for claim_route actions that might reduce destination distances
-                if (
-                    child.action
-                    and child.action[0] == "claim_route"
-                    and num_incomplete > 0
-                ):
-                    city1, city2 = child.action[1], child.action[2]
-                    # Quick check if route directly connects destination endpoints
-                    dest_bonus = 0
-                    for dest in self.state.current_player.destinations:
-                        if not self.state.current_player.uf.is_connected(
-                            dest.city1, dest.city2
+                city1, city2 = action[1], action[2]
+                uf = player.uf
+                dest_bonus = 0
+                for dest in player.destinations:
+                    if not uf.is_connected(dest.city1, dest.city2):
+                        if (
+                            uf.is_connected(city1, dest.city1)
+                            and uf.is_connected(city1, dest.city2)
+                            or uf.is_connected(city2, dest.city1)
+                            and uf.is_connected(city2, dest.city2)
                         ):
-                            best_path = self.state.fw.get_path(dest.city1, dest.city2)
-                            if (
-                                self.state.current_player.uf.is_connected(
-                                    city1, dest.city1
-                                )
-                                and self.state.current_player.uf.is_connected(
-                                    city1, dest.city2
-                                )
-                                or self.state.current_player.uf.is_connected(
-                                    city2, dest.city1
-                                )
-                                and self.state.current_player.uf.is_connected(
-                                    city2, dest.city2
-                                )
-                            ):
-                                # Move connects destination endpoints
-                                dest_bonus += 5
-                            elif best_path and (
+                            # Move connects destination endpoints
+                            dest_bonus += 5
+                        else:
+                            best_path = state.fw.get_path_cities(dest.city1, dest.city2)
+                            if best_path and (
                                 city1 in best_path and city2 in best_path
                             ):
                                 # Move is in path
                                 dest_bonus += 1
-                    # Scale bonus perhaps
-                    uct_score += dest_bonus
-
+                return dest_bonus
+            case "draw_destination_tickets":
                 # Penalize drawing more destination tickets when we already have many
-                if child.action and child.action[0] == "draw_destination_tickets":
-                    if num_incomplete >= 1:
-                        # Progressive penalty: more incomplete tickets = bigger penalty
-                        uct_score -= 2 * num_incomplete
-                    elif self.state.current_player.remaining_trains > 15:
-                        uct_score += 5
-
-                if child.action and child.action[0] == "draw_two_train_cards":
-                    # Punish drawing train cards if we have many already
-                    num_cards = len(self.state.current_player.train_cards)
-                    if num_cards > 15:
-                        uct_score -= num_cards * 0.5
-
-                choices_weights.append(uct_score)
-
-        return self.children[choices_weights.index(max(choices_weights))]
+                if num_incomplete >= 1:
+                    # Progressive penalty: more incomplete tickets = bigger penalty
+                    return -2 * num_incomplete
+                elif player.remaining_trains > 15:
+                    return 5
+            case "draw_two_train_cards":
+                # Punish drawing train cards if we have many already
+                num_cards = len(player.train_cards)
+                if num_cards > 15:
+                    return -num_cards * 0.5
+        return 0
+
+    def best_child(self, node, c_param=1.4):
+        tree = self.tree
+        count = tree.num_children[node]
+        if count == 0:
+            return None
 
-    def rollout(self, max_depth):
-        current_rollout_state = self.state.copy()
+        # UCT score plus each child's stored bias over the slice of sibling ids,
+        # ties go to the first child
+        log_visits = 2 * math.log(max(tree.visits[node], 1))
+        first = tree.first_child[node]
+        visits = tree.visits[first : first + count]
+        values = tree.value[first : first + count]
+        priors = tree.prior[first : first + count]
+        keys = tree.key[first : first + count]
+        lookup = self.table.lookup
+        best = None
+        best_score = float("-inf")
+        for i in range(count):
+            child_visits = visits[i]
+            child_value = values[i]
+            # Use the pooled totals when other nodes have explored the information set more
+            entry = lookup(keys[i])
+            if entry is not None and entry[0] > child_visits:
+                child_visits, child_value = entry
+            if child_visits == 0:
+                return first + i
+            score = (
+                (child_value / child_visits)
+                + c_param * math.sqrt(log_visits / child_visits)
+                + priors[i]
+            )
+            if score > best_score:
+                best = first + i
+                best_score = score
+        return best
+
+    def rollout(self, node, max_depth, sim_num):
+        # Play out on the node's own state and undo afterwards instead of copying it
+        current_rollout_state = self.state(node)
+        history = []
         depth = 0
-
-        while not current_rollout_state.is_end() and depth < max_depth:
-            action = self.rollout_policy(current_rollout_state)
-            if action is None:
-                break
-            current_rollout_state.apply_action(action)
-            current_player = current_rollout_state.current_player
-            # Opponent plays immediately after
-            for player in current_rollout_state.players:
-                # Cycle all players
-                current_rollout_state.switch_turn()
-                if current_rollout_state.current_player.name != current_player.name:
-                    # Opponents play immediately after
-                    opponent_action = DestinationHeuristic(
-                        current_rollout_state
-                    ).choose_action()
-                    # opponent_action = RandomHeuristic(current_rollout_state).choose_action()
-                    if opponent_action:
-                        current_rollout_state.apply_action(opponent_action)
-                    else:
-                        opponent_actions = current_rollout_state.get_legal_actions()
-                        if opponent_actions:
-                            opponent_action = random.choice(
-                                opponent_actions
-                            )  # TODO - Could make this more advanced
-            if current_rollout_state.current_player.name != current_player.name:
-                pass
-            depth += 1
-        return current_rollout_state
+        try:
+            while not current_rollout_state.is_end() and depth < max_depth:
+                action = self.rollout_policy(current_rollout_state)
+                if action is None:
+                    break
+                history.append(current_rollout_state.make_action(action))
+                current_player = current_rollout_state.current_player
+                # Opponent plays immediately after
+                for player in current_rollout_state.players:
+                    # Cycle all players
+                    current_rollout_state.switch_turn()
+                    if current_rollout_state.current_player.name != current_player.name:
+                        # Opponents play immediately after
+                        opponent_action = DestinationHeuristic(
+                            current_rollout_state
+                        ).choose_action()
+                        # opponent_action = RandomHeuristic(current_rollout_state).choose_action()
+                        if opponent_action:
+                            history.append(
+                                current_rollout_state.make_action(opponent_action)
+                            )
+                        else:
+                            opponent_actions = current_rollout_state.get_legal_actions()
+                            if opponent_actions:
+                                opponent_action = random.choice(
+                                    opponent_actions
+                                )  # TODO - Could make this more advanced
+                depth += 1
+
+            # Score the playout
+            reward = current_rollout_state.game_result(sim_num, self.reward)
+        finally:
+            # Rewind the node's state for the next simulation, even if the playout failed,
+            # the state may belong to the real game
+            for record in reversed(history):
+                current_rollout_state.unmake_action(record)
+        return reward
 
     def rollout_policy(self, current_rollout_state):
         # Just use the agent
@@ -223,33 +361,112 @@ class MCTSNode:
         return random.choice(action_type)
         """
 
-    def backpropagate(self, result):
-        self.visits += 1
-        self.value += result
-        if self.action_type == "draw_destination_tickets":
-            pass
-        if self.action_type == "claim_route":
-            pass
-        if self.parent:
-            self.parent.backpropagate(result)
+    def backpropagate(self, node, result):
+        # Iterative, the node and each ancestor up to the root, and their information sets
+        tree = self.tree
+        tree.backpropagate(node, result)
+        update = self.table.update
+        while node != NO_NODE:
+            update(tree.key[node], result)
+            node = tree.parent[node]
 
-
-class MCTS:
-    def __init__(self, game_state):
-        self.root = MCTSNode(game_state)
-        self.console = None if is_pypy else LiveConsole()
-
-    def best_action(self, simulations_number, max_depth):
+    def advance(self, game_state):
+        """
+        Moves the root to the agent's last move, so the next search starts from the
+        statistics of the previous one instead of from nothing.
+        The opponent replies and card draws under that move were sampled and rarely match
+        the real ones, so only the agent's next moves are kept: those still legal in the
+        real position keep their visits, values and seeds, their subtrees are dropped and
+        their states are replayed from the real position, sampling the chance outcomes
+        again. Draw indices only name face-up slots, so a draw is kept only if it still
+        takes the same cards.
+
+        :param game_state: The game state at the start of this agent's turn
+        :type game_state: GameEngine
+        :return: Number of simulations reused, 0 if the tree starts again
+        :rtype: int
+        """
+        old_tree = self.tree
+        played = self.played
+        self.played = NO_NODE
+        kept = []
+        # The move may not have had the searched outcome, e.g. a tunnel that was not paid
+        if played != NO_NODE and self.state(played).same_outcome(
+            game_state, game_state.current_player_idx
+        ):
+            kept = [
+                (
+                    old_tree.action_id[child],
+                    self.action(child),
+                    old_tree.visits[child],
+                    old_tree.value[child],
+                    old_tree.seed[child],
+                )
+                for child in old_tree.children(played)
+                if old_tree.visits[child]
+            ]
+
+        self.game_state = game_state
+        self.root_state = self.search_copy(game_state)
+        self.states = LRUCache(self.states.max_size)
+        self.tree = tree = TreeStore()
+        self.root = root = tree.add_root()
+        tree.key[root] = self.root_state.info_set_key()
+        if not kept:
+            return 0
+
+        encode_action = self.root_state.encode_action
+        legal = {
+            encode_action(action) for action in self.root_state.get_legal_actions()
+        }
+        for action_id, action, visits, value, seed in kept:
+            if (
+                action_id not in legal
+                or self.root_state.decode_action(action_id) != action
+            ):
+                continue
+            child = tree.add_child(root, action_id, len(legal))
+            tree.visits[child] = visits
+            tree.value[child] = value
+            tree.seed[child] = seed
+            tree.visits[root] += visits
+            tree.value[root] += value
+        if tree.num_children[root]:
+            self.init_actions(root)
+            for child in tree.children(root):
+                tree.prior[child] = self.action_bias(root, self.action(child))
+                tree.key[child] = self.state(child).info_set_key()
+        return tree.visits[root]
+
+    def best_action(
+        self, simulations_number, max_depth, time_limit=None, min_simulations=1
+    ):
+        """
+        Searches from the root and returns the best action found.
+
+        :param simulations_number: Simulations to run, the most to run with a time limit
+        :type simulations_number: int
+        :param max_depth: Maximum rollout depth
+        :type max_depth: int
+        :param time_limit: Seconds to search for before returning the best action so far,
+            None to always run simulations_number
+        :type time_limit: float
+        :param min_simulations: Simulations to run even if the time limit has passed
+        :type min_simulations: int
+        :return: The best action, or None if there is none
+        :rtype: tuple(str, ...)
+        """
+        budget = SearchBudget(simulations_number, time_limit, min_simulations)
         if self.console and not is_pypy:
             self.console.start_live(simulations_number)
 
         try:
-            for sim_num in range(simulations_number):
+            sim_num = 0
+            while not budget.done(sim_num):
                 v = self.tree_policy()
-                state = v.rollout(max_depth)
-                player = state.players[state.current_player_idx]
-                reward = state.game_result(sim_num)
-                v.backpropagate(reward)
+                reward = self.rollout(v, max_depth, sim_num)
+                player = self.state(v).current_player
+                self.backpropagate(v, reward)
 
                 # Update the console display every 10 simulations to avoid slowdown
                 if self.console and sim_num % 10 == 0 and not is_pypy:
@@ -259,22 +476,19 @@ class MCTS:
                         "points": reward,  # Use the calculated reward as points
                     }
                     self.console.update_display(sim_num, player_info)
+                sim_num += 1
 
             # Show when its complete
             if self.console and not is_pypy:
-                player = self.root.state.current_player
+                player = self.root_state.current_player
                 self.console.update_display(
-                    simulations_number, {"name": player.name, "points": player.points}
+                    sim_num, {"name": player.name, "points": player.points}
                 )
                 self.console.stop()
 
-            # Visualize the tree
-            """
-            viz_mcts(self.root, max_depth=4, 
-                        filename=f"mcts_tree_turn_{self.root.state.current_player.turn}.png")
-            """
             # Print score and return best action
-            return self.root.best_child().action
+            self.played = self.best_child(self.root)
+            return self.action(self.played)
 
         except Exception as e:
             print(f"Error in MCTS simulation: {e}")
@@ -282,25 +496,28 @@ class MCTS:
             if self.console and not is_pypy:
                 self.console.stop()
             # Return a valid action if possible
-            if self.root.children:
-                return self.root.best_child().action
+            if self.tree.num_children[self.root]:
+                self.played = self.best_child(self.root)
+                return self.action(self.played)
+            self.played = NO_NODE
             return None
 
     def tree_policy(self):
+        tree = self.tree
         current_node = self.root
-        while not current_node.state.is_end():
-            if not current_node.is_fully_expanded():
-                new_node = current_node.expand()
+        while not self.state(current_node).is_end():
+            if not self.is_fully_expanded(current_node):
+                new_node = self.expand(current_node)
                 if new_node is not None:
                     return new_node
-                elif current_node.children:
-                    current_node = current_node.best_child()
+                elif tree.num_children[current_node]:
+                    current_node = self.best_child(current_node)
                     if current_node is None:
                         return None
                 else:
                     return None
             else:
-                next_node = current_node.best_child()
+                next_node = self.best_child(current_node)
                 if next_node is None:
                     return current_node
                 current_node = next_node
@@ -1,8 +1,10 @@
+import atexit
 import math
 import multiprocessing as mp
 import random
 
 from console import LiveConsole, is_pypy
+from helper_classes import SearchBudget
 from heuristic_agents import DestinationHeuristic
 
 # from graph import visualize_mcts_tree as viz_mcts
@@ -14,6 +16,41 @@ if is_pypy:
         # Method already set, ignore
         pass
 
+# Action types, expand picks one uniformly before picking an action of that type
+ACTION_TYPES = ("draw_two_train_cards", "claim_route", "draw_destination_tickets")
+
+# One core is left for the master. Very large machines are limited to avoid
+# diminishing returns, 12 is an empirically good value for many-core systems
+NUM_WORKERS = 12 if mp.cpu_count() > 16 else max(1, mp.cpu_count() - 1)
+_pool = None  # Worker pool shared by every MCTS, see get_pool
+
+
+def get_pool():
+    """
+    Returns the worker pool, starting it on first use. The pool lives for the rest of the
+    program and is shared by every MCTS, so seats and turns do not each pay for starting
+    their own processes.
+
+    :return: The pool, with NUM_WORKERS processes
+    :rtype: multiprocessing.pool.Pool
+    """
+    global _pool
+    if _pool is None:
+        _pool = mp.Pool(processes=NUM_WORKERS)
+    return _pool
+
+
+def close_pool():
+    """Stops the shared worker pool, the next get_pool starts a new one."""
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool.join()
+        _pool = None
+
+
+atexit.register(close_pool)
+
 
 class MCTSNode:
     def __init__(self, state, parent=None, action=None):
@@ -22,39 +59,74 @@ class MCTSNode:
         self.action = action
         self.action_type = action[0] if action else None
         self.children = []
+        self.num_actions = (
+            None  # Number of legal actions, set by init_actions on first use
+        )
+        self.untried = None  # Actions without a child yet, by action type
+        self.num_untried = 0
+        self.num_incomplete = 0  # Incomplete destinations of the player to move
+        self.bias = 0.0  # Selection bias of this node's action, see action_bias
         self.visits = 0
         self.value = 0.0
 
-    def is_fully_expanded(self):
+    def init_actions(self):
+        # A node's state is always rewound to the same position, so its legal actions are
+        # generated once and bucketed by type for expand
+        encode_action = self.state.encode_action
+        tried = {encode_action(child.action) for child in self.children}
         possible_actions = self.state.get_legal_actions()
+        self.untried = {action_type: [] for action_type in ACTION_TYPES}
+        for action in possible_actions:
+            if encode_action(action) not in tried:
+                self.untried[action[0]].append(action)
+        self.num_actions = len(possible_actions)
+        player = self.state.current_player
+        self.num_incomplete = sum(
+            1
+            for dest in player.destinations
+            if not player.uf.is_connected(dest.city1, dest.city2)
+        )
+        self.num_untried = sum(map(len, self.untried.values()))
+
+    def is_fully_expanded(self):
+        if self.untried is None:
+            self.init_actions()
 
         const = 2  # TODO modify exploration constant
         max_children = int(math.ceil(const * math.sqrt(self.visits)))
-        return len(self.children) >= min(len(possible_actions), max_children)
+        return len(self.children) >= min(self.num_actions, max_children)
 
     def expand(self):
-        # Get all possible actions from the current state
-        possible_actions = self.state.get_legal_actions()
-        if len(possible_actions) == 0:
-            return None
-        # Filter out actions that have already been tried (i.e., have corresponding child nodes)
-        untried_actions = [
-            action
-            for action in possible_actions
-            if action not in [child.action for child in self.children]
-        ]
-        if len(untried_actions) == 0:
+        if self.untried is None:
+            self.init_actions()
+        if self.num_untried == 0:
             return None
 
         # Split actions into their respective types to make random selection fair
-        random_type = random.choice(
-            ["draw_two_train_cards", "claim_route", "draw_destination_tickets"]
-        )
-        action_type = [action for action in untried_actions if action[0] == random_type]
-        if not action_type:
-            action_type = untried_actions
-        # MCTS agent plays a move
-        action = random.choice(action_type)
+        untried = self.untried[random.choice(ACTION_TYPES)]
+        if untried:
+            idx = random.randrange(len(untried))
+        else:
+            # None of that type left, pick from every untried action
+            idx = random.randrange(self.num_untried)
+            for untried in self.untried.values():
+                if idx < len(untried):
+                    break
+                idx -= len(untried)
+        # MCTS agent plays a move, swap removed from the untried pool
+        action = untried[idx]
+        untried[idx] = untried[-1]
+        untried.pop()
+        self.num_untried -= 1
+        child_state = self.sample_child_state(action)
+        child_node = MCTSNode(child_state, parent=self, action=action)
+        child_node.bias = self.action_bias(action)
+        self.children.append(child_node)
+        return child_node
+
+    def sample_child_state(self, action):
+        # The agent plays the action on a copy of this node's state, then each opponent
+        # plays a sampled reply, giving the state at the agent's next turn
         child_state = self.state.copy()
         child_state.apply_action(action)
         current_player = child_state.current_player
@@ -70,87 +142,74 @@ class MCTSNode:
                         opponent_actions
                     )  # TODO - Could make this more advanced
                     child_state.apply_action(opponent_action)
-
-        child_node = MCTSNode(child_state, parent=self, action=action)
-        self.children.append(child_node)
-        return child_node
-
-    def best_child(self, c_param=1.4):
-        if not self.children:
-            return None
-
-        choices_weights = []
-
-        # Get number of incomplete destination tickets for distance biasing
-        num_incomplete = 0
-        if hasattr(self.state, "check_all_destinations"):
-            results = self.state.check_all_destinations(self.state.current_player)
-            num_incomplete = sum(1 for dest in results if dest[1] == False)
-
-        for child in self.children:
-            if child.visits == 0:
-                choices_weights.append(float("inf"))
-            else:
-                # Base UCT score
-                uct_score = (child.value / child.visits) + c_param * math.sqrt(
-                    (2 * math.log(self.visits) / child.visits)
-                )
-
+        return child_state
+
+    def action_bias(self, action):
+        # Heuristic bias added to a child's UCT score. It only depends on this node's state
+        # and the child's action, so it is worked out once when the child is expanded
+        player = self.state.current_player
+        num_incomplete = self.num_incomplete
+        match action[0]:
+            case "claim_route" if num_incomplete > 0:
                 # Add bias for claim_route actions that might reduce destination distances
-                if (
-                    child.action
-                    and child.action[0] == "claim_route"
-                    and num_incomplete > 0
-                ):
-                    city1, city2 = child.action[1], child.action[2]
-                    # Quick check if route directly connects destination endpoints
-                    dest_bonus = 0
-                    for dest in self.state.current_player.destinations:
-                        if not self.state.current_player.uf.is_connected(
-                            dest.city1, dest.city2
+                city1, city2 = action[1], action[2]
+                uf = player.uf
+                dest_bonus = 0
+                for dest in player.destinations:
+                    if not uf.is_connected(dest.city1, dest.city2):
+                        if (
+                            uf.is_connected(city1, dest.city1)
+                            and uf.is_connected(city1, dest.city2)
+                            or uf.is_connected(city2, dest.city1)
+                            and uf.is_connected(city2, dest.city2)
                         ):
-                            best_path = self.state.fw.get_path(dest.city1, dest.city2)
-                            if (
-                                self.state.current_player.uf.is_connected(
-                                    city1, dest.city1
-                                )
-                                and self.state.current_player.uf.is_connected(
-                                    city1, dest.city2
-                                )
-                                or self.state.current_player.uf.is_connected(
-                                    city2, dest.city1
-                                )
-                                and self.state.current_player.uf.is_connected(
-                                    city2, dest.city2
-                                )
-                            ):
-                                # Move connects destination endpoints
-                                dest_bonus += 10
-                            elif best_path and (
+                            # Move connects destination endpoints
+                            dest_bonus += 10
+                        else:
+                            best_path = self.state.fw.get_path_cities(
+                                dest.city1, dest.city2
+                            )
+                            if best_path and (
                                 city1 in best_path and city2 in best_path
                             ):
                                 # Move is in path
                                 dest_bonus += 2
-                    # Scale bonus perhaps
-                    uct_score += dest_bonus
-
+                return dest_bonus
+            case "draw_destination_tickets":
                 # Penalize drawing more destination tickets when we already have many
-                if child.action and child.action[0] == "draw_destination_tickets":
-                    if num_incomplete >= 1:
-                        # Progressive penalty: more incomplete tickets = bigger penalty
-                        uct_score -= 10 * num_incomplete
-                    elif self.state.current_player.remaining_trains > 15:
-                        uct_score += 10
-
-                if child.action and child.action[0] == "draw_two_train_cards":
-                    # Punish drawing train cards if we have many already
-                    num_cards = len(self.state.current_player.train_cards)
-                    if num_cards > 15:
-                        uct_score -= num_cards * 0.5
+                if num_incomplete >= 1:
+                    # Progressive penalty: more incomplete tickets = bigger penalty
+                    return -10 * num_incomplete
+                elif player.remaining_trains > 15:
+                    return 10
+            case "draw_two_train_cards":
+                # Punish drawing train cards if we have many already
+                num_cards = len(player.train_cards)
+                if num_cards > 15:
+                    return -num_cards * 0.5
+        return 0
 
-                choices_weights.append(uct_score)
+    def best_child(self, c_param=1.4):
+        if not self.children:
+            return None
 
-        return self.children[choices_weights.index(max(choices_weights))]
+        # UCT score plus the bias stored on each child, ties go to the first child
+        log_visits = 2 * math.log(self.visits)
+        best = None
+        best_score = float("-inf")
+        for child in self.children:
+            child_visits, child_value = child.visits, child.value
+            if child_visits == 0:
+                return child
+            score = (
+                (child_value / child_visits)
+                + c_param * math.sqrt(log_visits / child_visits)
+                + child.bias
+            )
+            if score > best_score:
+                best = child
+                best_score = score
+        return best
 
     def backpropagate(self, result, dest_mod, dist_mod):
         self.visits += 1
@@ -166,9 +225,10 @@ class MCTSNode:
 
 
 # Modified rollout function to accept a tuple argument
-def parallel_rollout(node_state, max_depth):
-    """Rollout function that accepts two parameters directly"""
-    current_rollout_state = node_state.copy()
+def parallel_rollout(node_state, max_depth, reward="score"):
+    """Rollout function that accepts its parameters directly, reward as in game_results"""
+    # The worker receives its own unpickled state, so there is nothing to copy or rewind
+    current_rollout_state = node_state
     depth = 0
     destination_modifier = 0
     distance_modifier = 0
@@ -192,52 +252,155 @@ def parallel_rollout(node_state, max_depth):
                     current_rollout_state.apply_action(opponent_action)
         depth += 1
 
-    return (current_rollout_state, destination_modifier, distance_modifier)
+    # Score in the worker so the final state never has to be pickled back
+    result = current_rollout_state.game_result(0, reward)
+    return (result, destination_modifier, distance_modifier)
+
+
+def tree_policy(root):
+    """
+    Selects the node to simulate from next, expanding a new child where there is room.
+
+    :param root: Root of the tree
+    :type root: MCTSNode
+    :return: The node, or None if there is nothing left to search
+    :rtype: MCTSNode
+    """
+    current_node = root
+    while not current_node.state.is_end():
+        if not current_node.is_fully_expanded():
+            new_node = current_node.expand()
+            if new_node is not None:
+                return new_node
+            elif current_node.children:
+                current_node = current_node.best_child()
+                if current_node is None:
+                    return None
+            else:
+                return None
+        else:
+            next_node = current_node.best_child()
+            if next_node is None:
+                return current_node
+            current_node = next_node
+    return current_node
+
+
+def search_determinisation(
+    game_state,
+    simulations_number,
+    max_depth,
+    time_limit,
+    min_simulations,
+    seed,
+    reward="score",
+):
+    """
+    Runs a whole search in a worker, over its own determinisation of the hidden decks,
+    and returns the root statistics for the master to merge (see MCTS.root_parallel).
+
+    :param game_state: The root state, the worker's own unpickled copy
+    :type game_state: GameEngine
+    :param simulations_number: Simulations to run, the most to run with a time limit
+    :type simulations_number: int
+    :param max_depth: Maximum rollout depth
+    :type max_depth: int
+    :param time_limit: Seconds to search for, None to run simulations_number
+    :type time_limit: float
+    :param min_simulations: Simulations to run even if the time limit has passed
+    :type min_simulations: int
+    :param seed: Seed for the worker's random draws
+    :type seed: int
+    :param reward: Rollout reward, see GameEngine.game_results
+    :type reward: str
+    :return: Simulations run, and the visits and value of each root child by action index
+    :rtype: tuple(int, dict)
+    """
+    budget = SearchBudget(simulations_number, time_limit, min_simulations)
+    # Forked workers start with the same random state, so each is seeded by the master
+    random.seed(seed)
+    game_state.determinise()
+    root = MCTSNode(game_state)
+
+    completed_sims = 0
+    while not budget.done(completed_sims):
+        leaf_node = tree_policy(root)
+        if leaf_node is None:
+            break
+        # Rollouts play on the state they are given, so the leaf's state is copied
+        leaf_node.backpropagate(
+            *parallel_rollout(leaf_node.state.copy(), max_depth, reward)
+        )
+        completed_sims += 1
+
+    encode_action = game_state.encode_action
+    root_stats = {
+        encode_action(child.action): (child.visits, child.value)
+        for child in root.children
+    }
+    return completed_sims, root_stats
 
 
 class MCTS:
-    def __init__(self, game_state):
+    def __init__(self, game_state, root_parallel=False, reward="score"):
+        """
+        :param game_state: The game state to search from
+        :type game_state: GameEngine
+        :param root_parallel: Search an independent tree in each worker and merge their
+            root statistics, rather than growing one tree here and only running the
+            rollouts in the workers
+        :type root_parallel: bool
+        :param reward: Rollout reward, see GameEngine.game_results
+        :type reward: str
+        """
         self.root = MCTSNode(game_state)
+        self.root_parallel = root_parallel
+        self.reward = reward
         self.console = None if is_pypy else LiveConsole()
-        # Multiprocessing setup with optimal process count
-        cpu_count = mp.cpu_count()
-        self.num_processes = max(1, cpu_count - 1)
-
-        # For very large machines, limit processes to avoid diminishing returns
-        if cpu_count > 16:
-            self.num_processes = 12  # Empirically good value for many-core systems
-
-        # Adjust batch size based on CPU count
+        # Size batches for the shared pool's workers
+        self.num_processes = NUM_WORKERS
         self.batch_size = min(200, max(50, self.num_processes * 8))
 
-        # Create process pool once and reuse
-        self.pool = mp.Pool(processes=self.num_processes)
-
-    def __del__(self):
-        """Clean up process pool on deletion"""
-        if hasattr(self, "pool"):
-            self.pool.close()
-            self.pool.join()
-
-    def best_action(self, simulations_number, max_depth):
+    def best_action(
+        self, simulations_number, max_depth, time_limit=None, min_simulations=1
+    ):
+        """
+        Searches from the root and returns the best action found.
+
+        :param simulations_number: Simulations to run, the most to run with a time limit
+        :type simulations_number: int
+        :param max_depth: Maximum rollout depth
+        :type max_depth: int
+        :param time_limit: Seconds to search for before returning the best action so far,
+            None to always run simulations_number
+        :type time_limit: float
+        :param min_simulations: Simulations to run even if the time limit has passed
+        :type min_simulations: int
+        :return: The best action, or None if there is none
+        :rtype: tuple(str, ...)
+        """
+        if self.root_parallel:
+            return self.best_action_root_parallel(
+                simulations_number, max_depth, time_limit, min_simulations
+            )
+        budget = SearchBudget(simulations_number, time_limit, min_simulations)
         if self.console and not is_pypy:
             self.console.start_live(simulations_number)
 
         completed_sims = 0
 
         try:
-            # Reuse existing pool instead of creating a new one each time
-            pool = self.pool
+            # Reuse the shared pool instead of creating a new one each time
+            pool = get_pool()
 
             # Preallocate arrays for better memory efficiency
             rollout_results = []
             leaf_nodes = []
 
-            while completed_sims < simulations_number:
+            while not budget.done(completed_sims):
                 # Calculate batch size - dynamically adjust based on remaining simulations
-                current_batch = min(
-                    self.batch_size, simulations_number - completed_sims
-                )
+                # and, with a time limit, on how many more fit before the deadline
+                current_batch = budget.batch_size(completed_sims, self.batch_size)
 
                 # Clear previous batch data
                 rollout_results.clear()
@@ -253,7 +416,9 @@ class MCTS:
                 if not leaf_nodes:
                     break
 
-                batch_tasks = [(node.state, max_depth) for node in leaf_nodes]
+                batch_tasks = [
+                    (node.state, max_depth, self.reward) for node in leaf_nodes
+                ]
                 async_result = pool.starmap_async(parallel_rollout, batch_tasks)
 
                 # Process results more efficiently - get them all at once
@@ -261,12 +426,11 @@ class MCTS:
                     all_results = async_result.get(timeout=max(5, current_batch * 0.5))
 
                     # Process in bulk
-                    for i, (final_state, dest_mod, dist_mod) in enumerate(all_results):
+                    for i, (reward, dest_mod, dist_mod) in enumerate(all_results):
                         if i >= len(leaf_nodes):
                             continue
 
-                        # Calculate reward and backpropagate
-                        reward = final_state.game_result(completed_sims + i)
+                        # Backpropagate the reward calculated by the worker
                         leaf_nodes[i].backpropagate(reward, dest_mod, dist_mod)
 
                         # Throttle console updates for performance
@@ -275,7 +439,7 @@ class MCTS:
                             and (completed_sims + i) % 25 == 0
                             and not is_pypy
                         ):
-                            player = final_state.players[final_state.current_player_idx]
+                            player = leaf_nodes[i].state.current_player
                             player_info = {"name": player.name, "points": reward}
                             self.console.update_display(completed_sims + i, player_info)
                 except Exception as e:
@@ -288,7 +452,7 @@ class MCTS:
             if self.console and not is_pypy:
                 player = self.root.state.current_player
                 self.console.update_display(
-                    simulations_number, {"name": player.name, "points": player.points}
+                    completed_sims, {"name": player.name, "points": player.points}
                 )
                 self.console.stop()
 
@@ -302,22 +466,93 @@ class MCTS:
                 return self.root.best_child().action
             return None
 
+    def best_action_root_parallel(
+        self, simulations_number, max_depth, time_limit=None, min_simulations=1
+    ):
+        """
+        Splits the simulations between the workers, each searching its own tree over its
+        own determinisation, then adds up the visits and value of every root action across
+        the trees. The action visited most in total is played, ties going to the higher
+        average value.
+
+        :param simulations_number: Simulations to run, the most to run with a time limit
+        :type simulations_number: int
+        :param max_depth: Maximum rollout depth
+        :type max_depth: int
+        :param time_limit: Seconds to search for before returning the best action so far,
+            None to always run simulations_number
+        :type time_limit: float
+        :param min_simulations: Simulations to run even if the time limit has passed
+        :type min_simulations: int
+        :return: The best action, or None if there is none
+        :rtype: tuple(str, ...)
+        """
+        game_state = self.root.state
+        if self.console and not is_pypy:
+            self.console.start_live(simulations_number)
+
+        # Split the budget exactly, the first workers take one more simulation each
+        # until the remainder is used up
+        sims_per_worker, extra_sims = divmod(simulations_number, NUM_WORKERS)
+        min_per_worker, extra_min = divmod(min_simulations, NUM_WORKERS)
+        tasks = [
+            (
+                game_state.copy(),
+                sims_per_worker + (i < extra_sims),
+                max_depth,
+                time_limit,
+                min_per_worker + (i < extra_min),
+                random.getrandbits(64),
+                self.reward,
+            )
+            for i in range(NUM_WORKERS)
+            if sims_per_worker + (i < extra_sims) > 0
+        ]
+        try:
+            # One task per worker so the trees are searched side by side
+            results = get_pool().starmap(search_determinisation, tasks, chunksize=1)
+        except Exception:
+            # Raised rather than returning None, which callers take as no legal move
+            if self.console and not is_pypy:
+                self.console.stop()
+            raise
+
+        completed_sims = 0
+        merged = {}
+        for worker_sims, root_stats in results:
+            completed_sims += worker_sims
+            for action_id, (visits, value) in root_stats.items():
+                totals = merged.setdefault(action_id, [0, 0.0])
+                totals[0] += visits
+                totals[1] += value
+
+        if self.console and not is_pypy:
+            player = game_state.current_player
+            self.console.update_display(
+                completed_sims, {"name": player.name, "points": player.points}
+            )
+            self.console.stop()
+
+        best_id = None
+        best_score = None
+        for action_id, (visits, value) in merged.items():
+            if visits == 0:
+                continue
+            score = (visits, value / visits)
+            if best_score is None or score > best_score:
+                best_id = action_id
+                best_score = score
+        if best_id is None:
+            return None
+        # The workers' trees are not kept, so the action is rebuilt from the real state
+        return game_state.decode_action(best_id)
+
     def tree_policy(self):
-        current_node = self.root
-        while not current_node.state.is_end():
-            if not current_node.is_fully_expanded():
-                new_node = current_node.expand()
-                if new_node is not None:
-                    return new_node
-                elif current_node.children:
-                    current_node = current_node.best_child()
-                    if current_node is None:
-                        return None
-                else:
-                    return None
-            else:
-                next_node = current_node.best_child()
-                if next_node is None:
-                    return current_node
-                current_node = next_node
-        return current_node
+        return tree_policy(self.root)
+
+
+class RootParallelMCTS(MCTS):
+    """MCTS searching an independent tree in each worker, see MCTS.root_parallel"""
+
+    def __init__(self, game_state, reward="score"):
+        super().__init__(game_state, root_parallel=True, reward=reward)
@@ -2,9 +2,13 @@ import math
 import random
 
 from console import LiveConsole, is_pypy
+from helper_classes import SearchBudget
 
 # from graph import visualize_mcts_tree as viz_mcts
 
+# Action types, expand picks one uniformly before picking an action of that type
+ACTION_TYPES = ("draw_two_train_cards", "claim_route", "draw_destination_tickets")
+
 
 class MCTSNode:
     def __init__(self, state, parent=None, action=None):
@@ -13,39 +17,65 @@ class MCTSNode:
         self.action = action
         self.action_type = action[0] if action else None
         self.children = []
+        self.num_actions = (
+            None  # Number of legal actions, set by init_actions on first use
+        )
+        self.untried = None  # Actions without a child yet, by action type
+        self.num_untried = 0
         self.visits = 0
         self.value = 0.0
 
-    def is_fully_expanded(self):
+    def init_actions(self):
+        # A node's state is always rewound to the same position, so its legal actions are
+        # generated once and bucketed by type for expand
+        encode_action = self.state.encode_action
+        tried = {encode_action(child.action) for child in self.children}
         possible_actions = self.state.get_legal_actions()
+        self.untried = {action_type: [] for action_type in ACTION_TYPES}
+        for action in possible_actions:
+            if encode_action(action) not in tried:
+                self.untried[action[0]].append(action)
+        self.num_actions = len(possible_actions)
+        self.num_untried = sum(map(len, self.untried.values()))
+
+    def is_fully_expanded(self):
+        if self.untried is None:
+            self.init_actions()
 
         const = 2  # TODO modify exploration constant
         max_children = int(math.ceil(const * math.sqrt(self.visits)))
-        return len(self.children) >= min(len(possible_actions), max_children)
+        return len(self.children) >= min(self.num_actions, max_children)
 
     def expand(self):
-        # Get all possible actions from the current state
-        possible_actions = self.state.get_legal_actions()
-        if len(possible_actions) == 0:
-            return None
-        # Filter out actions that have already been tried (i.e., have corresponding child nodes)
-        untried_actions = [
-            action
-            for action in possible_actions
-            if action not in [child.action for child in self.children]
-        ]
-        if len(untried_actions) == 0:
+        if self.untried is None:
+            self.init_actions()
+        if self.num_untried == 0:
             return None
 
         # Split actions into their respective types to make random selection fair
-        random_type = random.choice(
-            ["draw_two_train_cards", "claim_route", "draw_destination_tickets"]
-        )
-        action_type = [action for action in untried_actions if action[0] == random_type]
-        if not action_type:
-            action_type = untried_actions
-        # MCTS agent plays a move
-        action = random.choice(action_type)
+        untried = self.untried[random.choice(ACTION_TYPES)]
+        if untried:
+            idx = random.randrange(len(untried))
+        else:
+            # None of that type left, pick from every untried action
+            idx = random.randrange(self.num_untried)
+            for untried in self.untried.values():
+                if idx < len(untried):
+                    break
+                idx -= len(untried)
+        # MCTS agent plays a move, swap removed from the untried pool
+        action = untried[idx]
+        untried[idx] = untried[-1]
+        untried.pop()
+        self.num_untried -= 1
+        child_state = self.sample_child_state(action)
+        child_node = MCTSNode(child_state, parent=self, action=action)
+        self.children.append(child_node)
+        return child_node
+
+    def sample_child_state(self, action):
+        # The agent plays the action on a copy of this node's state, then each opponent
+        # plays a sampled reply, giving the state at the agent's next turn
         child_state = self.state.copy()
         child_state.apply_action(action)
 
@@ -60,33 +90,41 @@ class MCTSNode:
 
         # Back to MCTS agent's turn
         child_state.switch_turn()
-        child_node = MCTSNode(child_state, parent=self, action=action)
-        self.children.append(child_node)
-        return child_node
+        return child_state
 
-    def rollout(self, max_depth):
-        current_rollout_state = self.state.copy()
+    def rollout(self, max_depth, sim_num, reward="score"):
+        # Play out on the node's own state and undo afterwards instead of copying it
+        current_rollout_state = self.state
+        history = []
         depth = 0
+        try:
+            while not current_rollout_state.is_end() and depth < max_depth:
+                possible_moves = current_rollout_state.get_legal_actions()
+                if not possible_moves:
+                    break
+                action = self.rollout_policy(possible_moves)
+                history.append(current_rollout_state.make_action(action))
+
+                # Opponent plays immediately after
+                current_rollout_state.switch_turn()
+                opponent_actions = current_rollout_state.get_legal_actions()
+                if not opponent_actions:
+                    break
+                opponent_action = random.choice(opponent_actions)
+                history.append(current_rollout_state.make_action(opponent_action))
 
-        while not current_rollout_state.is_end() and depth < max_depth:
-            possible_moves = current_rollout_state.get_legal_actions()
-            if not possible_moves:
-                break
-            action = self.rollout_policy(possible_moves)
-            current_rollout_state.apply_action(action)
-
-            # Opponent plays immediately after
-            current_rollout_state.switch_turn()
-            opponent_actions = current_rollout_state.get_legal_actions()
-            if not opponent_actions:
-                break
-            opponent_action = random.choice(opponent_actions)
-            current_rollout_state.apply_action(opponent_action)
-
-            # Back to MCTS agent's turn
-            current_rollout_state.switch_turn()
-            depth += 1
-        return current_rollout_state
+                # Back to MCTS agent's turn
+                current_rollout_state.switch_turn()
+                depth += 1
+
+            # Score the playout
+            result = current_rollout_state.game_result(sim_num, reward)
+        finally:
+            # Rewind the node's state for the next simulation, even if the playout failed,
+            # the state may belong to the real game
+            for record in reversed(history):
+                current_rollout_state.unmake_action(record)
+        return result
 
     def rollout_policy(self, possible_moves):
         return random.choice(possible_moves)
@@ -120,20 +158,87 @@ class MCTSNode:
 
 
 class MCTS:
-    def __init__(self, game_state):
-        self.root = MCTSNode(game_state)
+    def __init__(self, game_state, reward="score"):
+        self.reward = reward  # Rollout reward, see GameEngine.game_results
+        # Rollouts play out in place on the root's state, so it must not be the real game
+        self.root = MCTSNode(game_state.copy())
         self.console = None if is_pypy else LiveConsole()
+        self.played = None  # Root child of the last action returned, see advance
+
+    def advance(self, game_state):
+        """
+        Moves the root to the agent's last move, so the next search starts from the
+        statistics of the previous one instead of from nothing.
+        The opponent replies and card draws under that move were sampled and rarely match
+        the real ones, so only the agent's next moves are kept: those still legal in the
+        real position keep their visits and values, their subtrees are dropped and their
+        states are sampled again from the real position. Draw indices only name face-up
+        slots, so a draw is kept only if it still takes the same cards.
+
+        :param game_state: The game state at the start of this agent's turn
+        :type game_state: GameEngine
+        :return: Number of simulations reused, 0 if the tree starts again
+        :rtype: int
+        """
+        played = self.played
+        self.played = None
+        # Rollouts play out in place on the root's state, so it must not be the real game
+        new_root = MCTSNode(game_state.copy())
+        self.root = new_root
+        # The move may not have had the searched outcome, e.g. a tunnel that was not paid
+        if played is None or not played.state.same_outcome(
+            game_state, game_state.current_player_idx
+        ):
+            return 0
+
+        state = new_root.state
+        encode_action = state.encode_action
+        legal = {encode_action(action) for action in state.get_legal_actions()}
+        for child in played.children:
+            action_id = encode_action(child.action)
+            if child.visits == 0 or action_id not in legal:
+                continue
+            action = state.decode_action(action_id)
+            if action != child.action:
+                continue
+            kept = MCTSNode(
+                new_root.sample_child_state(action), parent=new_root, action=action
+            )
+            kept.visits = child.visits
+            kept.value = child.value
+            new_root.children.append(kept)
+            new_root.visits += child.visits
+            new_root.value += child.value
+        return new_root.visits
+
+    def best_action(
+        self, simulations_number, max_depth, time_limit=None, min_simulations=1
+    ):
+        """
+        Searches from the root and returns the best action found.
 
-    def best_action(self, simulations_number, max_depth):
+        :param simulations_number: Simulations to run, the most to run with a time limit
+        :type simulations_number: int
+        :param max_depth: Maximum rollout depth
+        :type max_depth: int
+        :param time_limit: Seconds to search for before returning the best action so far,
+            None to always run simulations_number
+        :type time_limit: float
+        :param min_simulations: Simulations to run even if the time limit has passed
+        :type min_simulations: int
+        :return: The best action, or None if there is none
+        :rtype: tuple(str, ...)
+        """
+        budget = SearchBudget(simulations_number, time_limit, min_simulations)
         if self.console and not is_pypy:
             self.console.start_live(simulations_number)
 
         try:
-            for sim_num in range(simulations_number):
+            sim_num = 0
+            while not budget.done(sim_num):
                 v = self.tree_policy()
-                state = v.rollout(max_depth)
-                player = state.players[state.current_player_idx]
-                reward = state.game_result(sim_num)
+                reward = v.rollout(max_depth, sim_num, self.reward)
+                player = v.state.current_player
                 v.backpropagate(reward)
 
                 # Update the console display every 10 simulations to avoid slowdown
@@ -144,12 +249,13 @@ class MCTS:
                         "points": reward,  # Use the calculated reward as points
                     }
                     self.console.update_display(sim_num, player_info)
+                sim_num += 1
 
             # Show when its complete
             if self.console and not is_pypy:
                 player = self.root.state.current_player
                 self.console.update_display(
-                    simulations_number, {"name": player.name, "points": player.points}
+                    sim_num, {"name": player.name, "points": player.points}
                 )
                 self.console.stop()
 
@@ -159,7 +265,8 @@ class MCTS:
                         filename=f"mcts_tree_turn_{self.root.state.current_player.turn}.png")
             """
             # Return best action
-            return self.root.best_child().action
+            self.played = self.root.best_child()
+            return self.played.action
 
         except Exception as e:
             print(f"Error in MCTS simulation: {e}")
@@ -168,7 +275,8 @@ class MCTS:
                 self.console.stop()
             # Return a valid action if possible
             if self.root.children:
-                return self.root.best_child().action
+                self.played = self.root.best_child()
+                return self.played.action
             return None
 
     def tree_policy(self):
@@ -0,0 +1,215 @@
+from array import array
+from typing import Dict, List
+
+NO_NODE = -1  # Parent of the root, first child of a node without children
+
+# Numeric per-node fields, name -> array typecode
+INT_FIELDS = {
+    "parent": "i",
+    "first_child": "i",  # First id of the node's block of children
+    "num_children": "i",
+    "child_capacity": "i",  # Room in the block before it has to be moved
+    "visits": "i",
+    "action_id": "i",  # Action leading to the node, see GameEngine.encode_action
+    "num_actions": "i",  # Number of legal actions, -1 until they are generated
+    "num_untried": "i",  # Legal actions without a child yet
+    "num_incomplete": "i",  # Incomplete destinations of the player to move
+    "key": "q",  # Information set of the player to move, see GameEngine.info_set_key
+    "seed": "Q",  # Seed of the node's chance outcomes, see MCTS.replay
+    "serial": "Q",  # Id that stays the same when the node is moved, see move_block
+}
+FLOAT_FIELDS = {
+    "value": "d",  # Sum of the rewards backpropagated through the node
+    "prior": "d",  # Selection bias of the node's action
+}
+# Python object per node, None where unused
+OBJECT_FIELDS = ("untried",)
+FIRST_BLOCK = 4  # Children room given to a node on its first expansion
+
+
+class TreeStore:
+    """
+    MCTS tree kept as parallel arrays indexed by node id, rather than an object per node.
+    The children of a node have consecutive ids (first_child to first_child + num_children),
+    so selection scans one slice of each array. When a node's block of children is full it
+    is moved to a block with twice the room, so the ids of a node's children can change
+    when it is expanded, but the ids of the node and its ancestors never do. Blocks left
+    behind are kept by size and reused for the next block of that size.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        """
+        Create an empty store.
+
+        :param capacity: Number of nodes to preallocate room for
+        :type capacity: int
+        """
+        self.size = 0
+        self.capacity = 0
+        self.next_serial = 0
+        self.free_blocks: Dict[int, List[int]] = (
+            {}
+        )  # First ids of unused blocks, by size
+        for name, typecode in {**INT_FIELDS, **FLOAT_FIELDS}.items():
+            setattr(self, name, array(typecode))
+        for name in OBJECT_FIELDS:
+            setattr(self, name, [])
+        self.reserve(capacity)
+
+    def __len__(self):
+        return self.size
+
+    def reserve(self, count: int):
+        """
+        Makes room for at least count more nodes, doubling the arrays when they are full.
+
+        :param count: Number of nodes about to be added
+        :type count: int
+        """
+        needed = self.size + count
+        if needed <= self.capacity:
+            return
+        extra = max(needed, 2 * self.capacity) - self.capacity
+        for name in (*INT_FIELDS, *FLOAT_FIELDS):
+            values = getattr(self, name)
+            values.frombytes(bytes(extra * values.itemsize))
+        for name in OBJECT_FIELDS:
+            getattr(self, name).extend([None] * extra)
+        self.capacity += extra
+
+    def allocate(self, count: int) -> int:
+        """
+        Claims count consecutive unused ids.
+
+        :param count: Number of ids
+        :type count: int
+        :return: The first id
+        :rtype: int
+        """
+        self.reserve(count)
+        start = self.size
+        self.size += count
+        return start
+
+    def init_node(self, node: int, parent: int, action_id: int):
+        """
+        Sets up a newly allocated node without children or statistics.
+
+        :param node: Id of the node
+        :type node: int
+        :param parent: Id of its parent, NO_NODE for a root
+        :type parent: int
+        :param action_id: Action leading to the node, NO_NODE for a root
+        :type action_id: int
+        """
+        self.parent[node] = parent
+        self.first_child[node] = NO_NODE
+        self.num_children[node] = 0
+        self.child_capacity[node] = 0
+        self.visits[node] = 0
+        self.value[node] = 0.0
+        self.action_id[node] = action_id
+        self.num_actions[node] = -1
+        self.num_untried[node] = 0
+        self.num_incomplete[node] = 0
+        self.key[node] = 0
+        self.seed[node] = 0
+        self.serial[node] = self.next_serial
+        self.next_serial += 1
+        self.prior[node] = 0.0
+        self.untried[node] = None
+
+    def add_root(self) -> int:
+        """
+        :return: Id of the new root
+        :rtype: int
+        """
+        node = self.allocate(1)
+        self.init_node(node, NO_NODE, NO_NODE)
+        return node
+
+    def add_child(self, node: int, action_id: int, max_children: int) -> int:
+        """
+        Adds a child after the node's existing children, moving them to a bigger block
+        first if theirs is full.
+
+        :param node: Id of the parent
+        :type node: int
+        :param action_id: Action leading to the child
+        :type action_id: int
+        :param max_children: Most children the node can ever have, caps its block
+        :type max_children: int
+        :return: Id of the new child
+        :rtype: int
+        """
+        count = self.num_children[node]
+        if count == self.child_capacity[node]:
+            self.move_block(node, min(max(2 * count, FIRST_BLOCK), max_children))
+        child = self.first_child[node] + count
+        self.init_node(child, node, action_id)
+        self.num_children[node] = count + 1
+        return child
+
+    def move_block(self, node: int, capacity: int):
+        """
+        Moves a node's children to a new block of ids with room for capacity children,
+        pointing their own children at the new ids. The old block is kept for reuse.
+
+        :param node: Id of the parent
+        :type node: int
+        :param capacity: Room in the new block
+        :type capacity: int
+        """
+        old_first = self.first_child[node]
+        old_capacity = self.child_capacity[node]
+        count = self.num_children[node]
+        free = self.free_blocks.get(capacity)
+        new_first = free.pop() if free else self.allocate(capacity)
+        if count:
+            for name in (*INT_FIELDS, *FLOAT_FIELDS, *OBJECT_FIELDS):
+                values = getattr(self, name)
+                values[new_first : new_first + count] = values[
+                    old_first : old_first + count
+                ]
+            # Drop the old block's references so they can be freed
+            for name in OBJECT_FIELDS:
+                getattr(self, name)[old_first : old_first + count] = [None] * count
+
+            parent = self.parent
+            first_child = self.first_child
+            num_children = self.num_children
+            for child in range(new_first, new_first + count):
+                start = first_child[child]
+                for grandchild in range(start, start + num_children[child]):
+                    parent[grandchild] = child
+        if old_capacity:
+            self.free_blocks.setdefault(old_capacity, []).append(old_first)
+        self.first_child[node] = new_first
+        self.child_capacity[node] = capacity
+
+    def children(self, node: int) -> range:
+        """
+        :param node: Id of the node
+        :type node: int
+        :return: Ids of the node's children, in the order they were added
+        :rtype: range
+        """
+        first = self.first_child[node]
+        return range(first, first + self.num_children[node])
+
+    def backpropagate(self, node: int, result: float):
+        """
+        Adds a simulation result to a node and every ancestor.
+
+        :param node: Id of the node the simulation started from
+        :type node: int
+        :param result: Reward of the simulation
+        :type result: float
+        """
+        visits = self.visits
+        value = self.value
+        parent = self.parent
+        while node != NO_NODE:
+            visits[node] += 1
+            value[node] += result
+            node = parent[node]
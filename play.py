@@ -9,8 +9,8 @@ class PlayerController:
 
     def formatted_trains(self, player: Player) -> List[str]:
         return [
-            f"{colour.name.capitalize()}: {count}"
-            for colour, count in player.train_cards.items()
+            f"{colour.label}: {count}"
+            for colour, count in zip(Colour, player.train_cards)
             if count > 0
         ]
 
@@ -21,7 +21,7 @@ class PlayerController:
         ]
 
     def formatted_colours(self, colours: List[Colour]) -> List[str]:
-        return [colour.name.capitalize() for colour in colours]
+        return [colour.label for colour in colours]
 
     def print_board(self):
         print("=== Ticket to Ride Board ===")
@@ -29,12 +29,11 @@ class PlayerController:
             print(f"\n{city1}:")
             for city2, routes in sorted(connections.items()):
                 for route in routes:
-                    status = (
-                        "Claimed by " + route.claimed_by
-                        if route.claimed_by
-                        else "Available"
+                    owner = self.game_state.route_owner(route)
+                    status = "Claimed by " + owner if owner else "Available"
+                    print(
+                        f"  -> {city2} ({route.colour.label} * {route.length}): {status}"
                     )
-                    print(f"  -> {city2} ({route.colour} * {route.length}): {status}")
         print("===========================")
 
     def print_available_routes(self, player: Player):
@@ -69,7 +68,7 @@ class PlayerController:
         if available_routes:
             print("\nRoutes you can complete:")
             for city1, city2, route, colour in available_routes:
-                print(f"{city1} -> {city2} ({colour} * {route.length})")
+                print(f"{city1} -> {city2} ({colour.label} * {route.length})")
         else:
             print("\nNo routes available to claim with your current cards.")
 
@@ -148,8 +147,9 @@ class PlayerController:
         route = routes[0]  # Get the first route between these cities
 
         # Check if the route is already claimed
-        if route.claimed_by is not None:
-            print(f"This route is already claimed by {route.claimed_by}.")
+        owner = self.game_state.route_owner(route)
+        if owner is not None:
+            print(f"This route is already claimed by {owner}.")
             return self.play_turn(player)
 
         # Special handling for ferries and tunnels
@@ -243,7 +243,7 @@ class PlayerController:
             city2,
             colour,
             base_wilds_needed,
-            route,
+            route.route_id,
             player.name,
         ]
 
@@ -0,0 +1,399 @@
+from typing import Dict, List, Set, Tuple
+
+from action_space import ActionSpace
+from fw import DynamicDistances, FloydWarshall
+from helper_classes import CARD_COLOURS, Colour, Destination, LRUCache, Route
+from map_pack import load_map
+
+
+class MapTopology:
+    """
+    Static, per-map data shared by every GameEngine (and every copy of one).
+
+    Nothing in here changes during a game, so it is built once per map type and
+    referenced by all game states. Per-game mutable state (route ownership, decks,
+    hands, connectivity) lives on the GameEngine instead.
+    """
+
+    _cache: Dict[str, "MapTopology"] = {}
+
+    def __init__(self, map_type: str):
+        """
+        Build the route indices for a map.
+
+        Indices:
+            routes: Maps city1 -> city2 -> List[Route] (same list in both directions)
+            route_list: All routes, indexed by Route.route_id
+            city_to_routes: Maps cities to all (city2, route) pairs from that city
+            route_pairs: Maps (city1,city2) (alphabetical) to its routes
+            city_names: Sorted list of all city names
+            city_to_idx: Maps city name to relative index
+            idx_to_city: Maps index to city name
+            adjacency: Adjacency matrix of route lists (i = city1, j = city2)
+            route_groups: (city1, city2, routes) per city pair, in route id order
+            pair_masks: Bitmask of every route sharing a city pair, by route id
+            route_cities: (city1, city2) (alphabetical) by route id
+            action_space: Fixed integer index of every action on the map
+            city_route_masks: Bitmask of the routes touching each city, by city index
+            route_pair_idx: Index of each route's city pair in route_groups, by route id
+            distances: Shortest paths between cities with per player edge weights
+
+        :param map_type: The type of map to be used (USA or Europe)
+        :type map_type: str
+        """
+        self.map_type = map_type
+        # Compiled from map_data.py once, then loaded in one read (see map_pack.py)
+        pack = load_map(map_type)
+        self.destinations: List[Destination] = pack.destinations
+
+        self.city_names: List[str] = pack.city_names
+        self.city_to_idx: Dict[str, int] = {
+            city: i for i, city in enumerate(self.city_names)
+        }
+        self.idx_to_city: Dict[int, str] = {
+            i: city for i, city in enumerate(self.city_names)
+        }
+
+        # The pack holds one canonical list of routes per city pair
+        self.route_pairs: Dict[Tuple[str, str], List[Route]] = {}
+        for i, j, route in pack.routes:
+            key = (self.city_names[i], self.city_names[j])
+            self.route_pairs.setdefault(key, []).append(route)
+
+        n = len(self.city_names)
+        self.routes: Dict[str, Dict[str, List[Route]]] = {}
+        self.city_to_routes: Dict[str, List[Tuple[str, Route]]] = {
+            city: [] for city in self.city_names
+        }
+        self.adjacency: List[List[List[Route]]] = [
+            [[] for _ in range(n)] for _ in range(n)
+        ]
+        self.route_list: List[Route] = []
+        self.route_groups: List[Tuple[str, str, List[Route]]] = []
+        self.pair_masks: List[int] = []
+        self.route_cities: List[Tuple[str, str]] = []
+        self.route_pair_idx: List[int] = []
+
+        # Number routes in upper triangle order so ids are stable for a given map
+        for city1, city2 in sorted(
+            self.route_pairs,
+            key=lambda k: (self.city_to_idx[k[0]], self.city_to_idx[k[1]]),
+        ):
+            routes_list = self.route_pairs[(city1, city2)]
+            pair_mask = 0
+            for route in routes_list:
+                route.route_id = len(self.route_list)
+                self.route_list.append(route)
+                pair_mask |= 1 << route.route_id
+            self.pair_masks.extend([pair_mask] * len(routes_list))
+            self.route_cities.extend([(city1, city2)] * len(routes_list))
+            self.route_pair_idx.extend([len(self.route_groups)] * len(routes_list))
+            self.route_groups.append((city1, city2, routes_list))
+
+            i, j = self.city_to_idx[city1], self.city_to_idx[city2]
+            self.adjacency[i][j] = routes_list
+            self.adjacency[j][i] = routes_list
+            self.routes.setdefault(city1, {})[city2] = routes_list
+            self.routes.setdefault(city2, {})[city1] = routes_list
+            self.city_to_routes[city1].extend([(city2, route) for route in routes_list])
+            self.city_to_routes[city2].extend([(city1, route) for route in routes_list])
+
+        self.num_routes = len(self.route_list)
+        self.city_route_masks: List[int] = [0] * n
+        for route in self.route_list:
+            city1, city2 = self.route_cities[route.route_id]
+            self.city_route_masks[self.city_to_idx[city1]] |= 1 << route.route_id
+            self.city_route_masks[self.city_to_idx[city2]] |= 1 << route.route_id
+        # Longest trail by edge set, shared by every game on this map
+        self._trail_cache = LRUCache(100000)
+        self._trail_ends_cache = LRUCache(100000)
+        self.all_routes_mask = (1 << self.num_routes) - 1
+
+        # _affordable_masks[colour][n] holds the routes payable with colour (gray routes
+        # with any colour) that need at most n cards, ferry locomotives included
+        max_need = max(
+            route.length + route.num_locomotives for route in self.route_list
+        )
+        self._affordable_masks: List[List[int]] = [
+            [0] * (max_need + 1) for _ in CARD_COLOURS
+        ]
+        for route in self.route_list:
+            if route.colour == Colour.GRAY:
+                need = route.length + route.num_locomotives
+                colours = CARD_COLOURS
+            else:
+                need = route.length
+                colours = (route.colour,)
+            for colour in colours:
+                masks = self._affordable_masks[colour]
+                for cards in range(need, max_need + 1):
+                    masks[cards] |= 1 << route.route_id
+
+        # _min_length_masks[n] holds the routes of length n or more
+        max_length = max(route.length for route in self.route_list)
+        self._min_length_masks: List[int] = [0] * (max_length + 1)
+        for route in self.route_list:
+            for length in range(route.length + 1):
+                self._min_length_masks[length] |= 1 << route.route_id
+        self.fw = FloydWarshall.from_matrices(self.city_names, pack.dist, pack.next)
+        self.distances = DynamicDistances(
+            n,
+            [
+                (self.city_to_idx[city1], self.city_to_idx[city2])
+                for city1, city2, _ in self.route_groups
+            ],
+        )
+        # Player distances by (own routes, claimed routes, two players), see player_distances
+        self._distance_cache = LRUCache(10000)
+        # Route values by network, claims, destinations and two players, filled in by
+        # GameEngine.get_route_values. Kept per process, pickling only sends the map type
+        self.route_value_cache = LRUCache(10000)
+        self.action_space = ActionSpace(self.route_list, self.route_cities)
+
+    def long_routes_mask(self, remaining_trains: int) -> int:
+        """
+        Bitmask of the routes too long to claim with a number of trains left (or one short).
+        A player needs more trains than the route length, so these are the routes whose
+        claimability can change when the remaining trains drop to this number.
+
+        :param remaining_trains: Trains the player has left
+        :type remaining_trains: int
+        :return: Bitmask of route ids with length >= remaining_trains
+        :rtype: int
+        """
+        if remaining_trains >= len(self._min_length_masks):
+            return 0
+        return self._min_length_masks[max(remaining_trains, 0)]
+
+    def card_change_mask(self, hand: List[int], colour: Colour, count: int) -> int:
+        """
+        Bitmask of the routes whose claim actions can change when a hand's count of one
+        colour changes. A route only has claim actions once the cards of its colour (any
+        colour for gray) and the wilds cover it, so routes the larger count cannot pay
+        for have none either side of the change.
+
+        :param hand: Card counts indexed by Colour, the other colours as they are
+        :type hand: List[int]
+        :param colour: The colour whose count changes
+        :type colour: Colour
+        :param count: The larger of its counts before and after the change
+        :type count: int
+        :return: Bitmask of route ids to re-evaluate
+        :rtype: int
+        """
+        masks = self._affordable_masks
+        max_need = len(masks[0]) - 1
+        if colour == Colour.WILD:
+            # Wilds pay for every colour
+            mask = 0
+            for card_colour in CARD_COLOURS:
+                mask |= masks[card_colour][min(hand[card_colour] + count, max_need)]
+            return mask
+        return masks[colour][min(count + hand[Colour.WILD], max_need)]
+
+    def incident_routes(self, city_mask: int) -> int:
+        """
+        Bitmask of the routes touching any of a set of cities.
+
+        :param city_mask: Bitset of city indices
+        :type city_mask: int
+        :return: Bitmask of route ids
+        :rtype: int
+        """
+        route_mask = 0
+        while city_mask:
+            low = city_mask & -city_mask
+            route_mask |= self.city_route_masks[low.bit_length() - 1]
+            city_mask ^= low
+        return route_mask
+
+    def longest_trail(self, route_mask: int) -> int:
+        """
+        Length of the longest continuous route through a set of routes, where cities may be
+        revisited but routes may not. Cached per route set.
+
+        :param route_mask: Bitmask of the route ids in the network
+        :type route_mask: int
+        :return: Total length of the longest trail
+        :rtype: int
+        """
+        cached = self._trail_cache.get(route_mask)
+        if cached is None:
+            cached = self._solve_trail(route_mask, weighted=True)[0]
+            self._trail_cache.put(route_mask, cached)
+        return cached
+
+    def longest_trail_ends(self, route_mask: int) -> Set[str]:
+        """
+        End cities of the trail using the most routes through a set of routes.
+        Cached per route set, so a player's result is reused until their network changes.
+
+        :param route_mask: Bitmask of the route ids in the network
+        :type route_mask: int
+        :return: The two end cities (one for a closed loop), empty for no routes
+        :rtype: Set[str]
+        """
+        cached = self._trail_ends_cache.get(route_mask)
+        if cached is None:
+            length, start, end = self._solve_trail(route_mask, weighted=False)
+            cached = set()
+            if length:
+                cached = {self.idx_to_city[start], self.idx_to_city[end]}
+            self._trail_ends_cache.put(route_mask, cached)
+        return set(cached)
+
+    def _solve_trail(self, route_mask: int, weighted: bool) -> Tuple[int, int, int]:
+        """
+        Longest trail search over edges, memoising the best continuation from each
+        (city, used routes) state. Branches stop early once a continuation uses every
+        remaining route, since nothing can beat it.
+
+        :param route_mask: Bitmask of the route ids in the network
+        :type route_mask: int
+        :param weighted: Measure trails by route length if True, by number of routes if False
+        :type weighted: bool
+        :return: (length, start city index, end city index) of a longest trail
+        :rtype: Tuple[int, int, int]
+        """
+        # city index -> (route bit, other city index, length) for every route in the network
+        edges: Dict[int, List[Tuple[int, int, int]]] = {}
+        total = 0
+        remaining = route_mask
+        while remaining:
+            low = remaining & -remaining
+            route = self.route_list[low.bit_length() - 1]
+            city1, city2 = self.route_cities[route.route_id]
+            i, j = self.city_to_idx[city1], self.city_to_idx[city2]
+            length = route.length if weighted else 1
+            edges.setdefault(i, []).append((low, j, length))
+            edges.setdefault(j, []).append((low, i, length))
+            total += length
+            remaining ^= low
+
+        memo: Dict[Tuple[int, int], Tuple[int, int]] = {}
+
+        def best_from(city: int, used: int, left: int) -> Tuple[int, int]:
+            # (length, end city) of the best continuation, left is the unused length
+            key = (city, used)
+            best = memo.get(key)
+            if best is None:
+                best = (0, city)
+                for route_bit, next_city, length in edges[city]:
+                    if not used & route_bit:
+                        rest, end = best_from(
+                            next_city, used | route_bit, left - length
+                        )
+                        if length + rest > best[0]:
+                            best = (length + rest, end)
+                            if best[0] == left:
+                                break
+                memo[key] = best
+            return best
+
+        longest = (0, -1, -1)
+        for start in edges:
+            length, end = best_from(start, 0, total)
+            if length > longest[0]:
+                longest = (length, start, end)
+                if length == total:
+                    break
+        return longest
+
+    def pair_weight(
+        self, pair_idx: int, own_mask: int, claimed_mask: int, two_player: bool
+    ) -> float:
+        """
+        Weight of a city pair's edge for a player: free if they own one of its routes,
+        the route length if they can still claim one, removed (infinity) otherwise.
+
+        :param pair_idx: Index of the city pair in route_groups
+        :type pair_idx: int
+        :param own_mask: Bitmask of the player's route ids
+        :type own_mask: int
+        :param claimed_mask: Bitmask of every claimed route id
+        :type claimed_mask: int
+        :param two_player: True in a two player game, where one claim closes a double route
+        :type two_player: bool
+        :return: The edge weight
+        :rtype: float
+        """
+        routes = self.route_groups[pair_idx][2]
+        pair_mask = self.pair_masks[routes[0].route_id]
+        if own_mask & pair_mask:
+            return 0
+        if two_player and claimed_mask & pair_mask:
+            return float("inf")
+        lengths = [
+            route.length for route in routes if not claimed_mask >> route.route_id & 1
+        ]
+        return min(lengths) if lengths else float("inf")
+
+    def player_distances(
+        self, own_mask: int, claimed_mask: int, two_player: bool, base=None
+    ):
+        """
+        Shortest distances between cities for a player, counting their own routes as
+        free and routes they can no longer claim as removed. Results are cached per
+        route ownership, and a missing one is repaired from base (the player's previous
+        result) for the routes claimed or unclaimed since, rather than solved again.
+
+        :param own_mask: Bitmask of the player's route ids
+        :type own_mask: int
+        :param claimed_mask: Bitmask of every claimed route id
+        :type claimed_mask: int
+        :param two_player: True in a two player game, where one claim closes a double route
+        :type two_player: bool
+        :param base: A previous result of this method for the same player, if any
+        :type base: Tuple[tuple, DistanceRows]
+        :return: (key, distances by city index)
+        :rtype: Tuple[tuple, DistanceRows]
+        """
+        key = (own_mask, claimed_mask, two_player)
+        if base is not None and base[0] == key:
+            return base
+        distances = self._distance_cache.get(key)
+        if distances is None:
+            if own_mask == 0 and claimed_mask == 0:
+                # The empty board, every pair at its route length
+                distances = self.distances.distances(
+                    [
+                        self.pair_weight(pair_idx, 0, 0, two_player)
+                        for pair_idx in range(len(self.route_groups))
+                    ]
+                )
+            else:
+                if base is None or base[0][2] != two_player:
+                    base = self.player_distances(0, 0, two_player)
+                (base_own, base_claimed, _), base_distances = base
+                changed = (own_mask ^ base_own) | (claimed_mask ^ base_claimed)
+                new_weights = {}
+                while changed:
+                    low = changed & -changed
+                    pair_idx = self.route_pair_idx[low.bit_length() - 1]
+                    new_weights[pair_idx] = self.pair_weight(
+                        pair_idx, own_mask, claimed_mask, two_player
+                    )
+                    changed ^= low
+                distances = base_distances.repaired(new_weights)
+            self._distance_cache.put(key, distances)
+        return key, distances
+
+    @classmethod
+    def get(cls, map_type: str) -> "MapTopology":
+        """
+        Returns the shared topology for a map type, building it on first use.
+
+        :param map_type: The type of map to be used (USA or Europe)
+        :type map_type: str
+        :return: The topology for that map
+        :rtype: MapTopology
+        """
+        topology = cls._cache.get(map_type)
+        if topology is None:
+            topology = cls(map_type)
+            cls._cache[map_type] = topology
+        return topology
+
+    def __reduce__(self):
+        # Pickle by map type so worker processes rebuild (once) rather than receive the tables
+        return (MapTopology.get, (self.map_type,))